@@ -0,0 +1,338 @@
+"""
+Basic reproduction number of .serimodel files by the next-generation matrix.
+
+Compartments are classified from their names with the `compartment_types`
+categories of metamodel.txt, plus the flows:
+
+- terminal, demographic and the uninfected epidemiological states
+  (Susceptible, Recovered, Removed, ...), Vaccinated and compartments
+  without outgoing flows are not infected;
+- Exposed, Infectious and the severity modifiers (Mild, Severe, ...) are
+  infected;
+- any other compartment is infected if it is entered from an infected
+  compartment or directly from an uninfected epidemiological state
+  ("Untreated Infected", "Admitted to hospital", "Treated with ART").
+
+Flows from uninfected into infected compartments are transmission flows.
+Every infected compartment transmits (`infectivity` 1) except exposed
+ones and treatment or location states (isolated, hospital, ICU, ...),
+unless it is named Infectious or by a severity modifier.
+
+Rates in a .serimodel are numbers, so a transmission flow holds the force
+of infection λ at the model's initial state. With populations (or
+`initial`) it is converted back to new infections per infective, assuming
+homogeneous mixing: F[t, j] = λ * x_source / Σ_k w_k x_k * w_j. Without
+populations the transmission rate is taken as already per infective. V
+holds the transitions out of and between infected compartments, so
+K = F V^-1 has rank one and R0 = w^T V^-1 a, where a collects the
+transmission rates. One batched solve for V and one for V^T give R0 and
+its derivative with respect to every flow rate for a chunk of parameter
+draws at once. V is dense, so models are limited to
+MAX_INFECTED_COMPARTMENTS infected compartments; the draws are split so
+each chunk's V stays near DENSE_BYTES.
+"""
+import argparse
+import json
+import re
+
+import numpy as np
+
+import serimodel
+import streaming
+
+
+_INFECTED_STATES = {"exposed", "infectious"}
+_LATENT_STATES = {"exposed"}
+_TRANSMITTING_STATES = {"infectious"}
+_UNINFECTED_TREATMENTS = {"vaccinated"}
+
+# V is solved densely, (m, m) per draw: at most this many infected
+# compartments (8 MiB per matrix), with draws solved in chunks of about
+# DENSE_BYTES.
+MAX_INFECTED_COMPARTMENTS = 1024
+DENSE_BYTES = 64 * 2 ** 20
+
+
+def load_compartment_types(metamodel_path: str = streaming.METAMODEL_PATH) -> dict:
+    """The `compartment_types` categories of metamodel.txt, each term as a tuple of lower-case words."""
+    with open(metamodel_path, "r", encoding="utf-8") as f:
+        types = json.load(f)["seirmodel_metamodel"]["compartment_types"]
+    return {category: [tuple(_words(term)) for term in terms] for category, terms in types.items()}
+
+
+def _words(name: str) -> list:
+    # CamelCase names from the fast path ("DeathDueToAIDS") are split into words first.
+    name = re.sub(r"(?<=[a-z0-9])(?=[A-Z])|(?<=[A-Z])(?=[A-Z][a-z])", " ", name)
+    return re.findall(r"[a-z0-9]+", name.lower())
+
+
+def _matches(name_words: list, terms) -> set:
+    """The terms (word tuples) that occur as a run of words in `name_words`."""
+    found = set()
+    for term in terms:
+        for start in range(len(name_words) - len(term) + 1):
+            if tuple(name_words[start:start + len(term)]) == term:
+                found.add(" ".join(term))
+                break
+    return found
+
+
+def classify(model, compartment_types: dict = None) -> dict:
+    """
+    Returns boolean arrays "infected" and "infectious" (n_compartments,) and
+    "transmission" (n_flows,) for a CompiledModel.
+    """
+    types = compartment_types or load_compartment_types()
+    states = types.get("epidemiological_states", [])
+    n = model.n_compartments
+    infected = np.zeros(n, dtype=bool)
+    settled = np.zeros(n, dtype=bool)
+    susceptible_like = np.zeros(n, dtype=bool)
+    transmitting = np.zeros(n, dtype=bool)
+    non_transmitting = np.zeros(n, dtype=bool)
+
+    for index, name in enumerate(model.names):
+        words = _words(name)
+        epidemiological = _matches(words, states)
+        treatments = _matches(words, types.get("treatment_states", []))
+        named_transmitting = bool(epidemiological & _TRANSMITTING_STATES) or bool(
+            _matches(words, types.get("severity_modifiers", [])))
+        if _matches(words, types.get("terminal_states", [])) or _matches(words, types.get("demographic_states", [])):
+            settled[index] = True
+        elif epidemiological & _INFECTED_STATES or named_transmitting:
+            settled[index] = infected[index] = True
+        elif epidemiological or treatments & _UNINFECTED_TREATMENTS:
+            settled[index] = susceptible_like[index] = True
+        transmitting[index] = named_transmitting
+        non_transmitting[index] = bool(epidemiological & _LATENT_STATES or treatments
+                                       or _matches(words, types.get("location_modifiers", [])))
+
+    # Compartments without outgoing flows are sinks (deaths, removals), never infected.
+    sinks = np.diff(model.indptr) == 0
+    infected &= ~sinks
+    settled |= sinks
+
+    # Unclassified compartments take their status from the flows that enter them.
+    sources, targets = model.sources, model.targets
+    while True:
+        entering = (infected[sources] | susceptible_like[sources]) & ~settled[targets] & ~infected[targets]
+        if not entering.any():
+            break
+        infected[targets[entering]] = True
+
+    return {
+        "infected": infected,
+        "infectious": infected & (transmitting | ~non_transmitting),
+        "transmission": ~infected[sources] & infected[targets],
+    }
+
+
+def next_generation(model, rates=None, initial=None, infectivity=None, classes: dict = None) -> dict:
+    """
+    Builds the next-generation factors for a batch of rate vectors.
+
+    - rates: (n_flows,) or (batch, n_flows), defaulting to the model's rates.
+    - initial: state the transmission rates were evaluated at, (n_compartments,)
+      or (batch, n_compartments); defaults to the model's populations.
+    - infectivity: relative infectiousness per compartment (n_compartments,);
+      defaults to 1 for the infectious compartments of classify().
+
+    Returns "a" (batch, m) new infections per infective entering each of the
+    m infected compartments, "w" (m,) their infectivity, "V" (batch, m, m),
+    "scale" (batch, n_flows) (rate to per-infective factor of transmission
+    flows) and "infected" (the compartment indices).
+    """
+    if isinstance(model, str):
+        model = serimodel.load(model)
+    classes = classes or classify(model)
+    rates = np.atleast_2d(model.rates if rates is None else np.asarray(rates, dtype=np.float64))
+    if rates.shape[-1] != model.n_flows:
+        raise ValueError(f"`rates` needs {model.n_flows} values per draw, got {rates.shape[-1]}")
+
+    infected = np.flatnonzero(classes["infected"])
+    if not len(infected):
+        raise ValueError("The model has no infected compartments")
+    m = len(infected)
+    local = np.full(model.n_compartments, -1, dtype=np.int64)
+    local[infected] = np.arange(m)
+    weights = classes["infectious"].astype(np.float64) if infectivity is None else np.asarray(infectivity, np.float64)
+    w = weights[infected]
+
+    if initial is None:
+        initial = model.populations
+    scale = np.zeros((1, model.n_flows))
+    transmission = np.flatnonzero(classes["transmission"])
+    if initial is None:
+        scale[:, transmission] = 1.0
+    else:
+        initial = np.atleast_2d(np.asarray(initial, dtype=np.float64))
+        infective_load = initial @ weights
+        if (infective_load <= 0).any():
+            raise ValueError("The initial state has no infectives to convert the force of infection")
+        scale = np.zeros((len(initial), model.n_flows))
+        scale[:, transmission] = initial[:, model.sources[transmission]] / infective_load[:, None]
+
+    batch = np.broadcast_shapes(rates.shape[:1], scale.shape[:1])[0]
+    rates = np.broadcast_to(rates, (batch, model.n_flows))
+    scale = np.broadcast_to(scale, (batch, model.n_flows))
+
+    a = np.zeros((batch, m))
+    np.add.at(a, (slice(None), local[model.targets[transmission]]), rates[:, transmission] * scale[:, transmission])
+
+    # V from the flows leaving infected compartments, scattered like rate_matrix().
+    internal = np.flatnonzero(classes["infected"][model.sources])
+    source = local[model.sources[internal]]
+    target = local[model.targets[internal]]
+    V = np.zeros((batch, m * m))
+    np.add.at(V, (slice(None), source * m + source), rates[:, internal])
+    inside = target >= 0
+    np.add.at(V, (slice(None), target[inside] * m + source[inside]), -rates[:, internal[inside]])
+    return {"a": a, "w": w, "V": V.reshape(batch, m, m), "scale": scale, "infected": infected}
+
+
+def reproduction_number(model, rates=None, initial=None, infectivity=None, growth_rate: bool = False) -> dict:
+    """
+    R0 for every rate vector in `rates` (see next_generation for the
+    arguments). Returns "R0" (batch,), "sensitivity" (batch, n_flows) with
+    dR0/drate, "elasticity" (batch, n_flows) with the relative change of R0
+    per relative change of each rate, and the classification. Draws whose V
+    is singular (infected compartments that never leave the infected set
+    along flows with a positive rate) get R0 = inf.
+
+    With `growth_rate`, also the dominant eigenvalue of F - V per draw: the
+    early exponential growth rate, negative exactly when R0 < 1 and the
+    disease-free equilibrium is stable.
+    """
+    if isinstance(model, str):
+        model = serimodel.load(model)
+    classes = classify(model)
+    m = int(classes["infected"].sum())
+    if m > MAX_INFECTED_COMPARTMENTS:
+        raise ValueError(f"{m} infected compartments need dense {m}x{m} solves; "
+                         f"at most {MAX_INFECTED_COMPARTMENTS} are supported")
+    rates = np.atleast_2d(model.rates if rates is None else np.asarray(rates, np.float64))
+    if initial is not None:
+        initial = np.atleast_2d(np.asarray(initial, dtype=np.float64))
+    batch = np.broadcast_shapes(rates.shape[:1], (1,) if initial is None else initial.shape[:1])[0]
+
+    chunk = max(1, DENSE_BYTES // (8 * max(m, 1) ** 2))
+    parts = []
+    for start in range(0, batch, chunk):
+        rows = slice(start, min(start + chunk, batch))
+        parts.append(_reproduction_chunk(
+            model, classes, rates if len(rates) == 1 else rates[rows],
+            initial if initial is None or len(initial) == 1 else initial[rows], infectivity, growth_rate,
+        ))
+
+    result = {key: np.concatenate([part[key] for part in parts]) if len(parts) > 1 else parts[0][key]
+              for key in ("R0", "sensitivity", "elasticity") + (("growth_rate",) if growth_rate else ())}
+    result.update({key: parts[0][key] for key in ("infected", "infectious", "transmission")})
+    return result
+
+
+def _reproduction_chunk(model, classes: dict, rates, initial, infectivity, growth_rate: bool) -> dict:
+    factors = next_generation(model, rates, initial, infectivity, classes)
+    a, w, V, scale = factors["a"], factors["w"], factors["V"], factors["scale"]
+    batch, m = a.shape
+    rates = np.broadcast_to(rates, (batch, model.n_flows))
+
+    v = np.full((batch, m), np.inf)
+    u = np.full((batch, m), np.inf)
+    regular = leaves_infection(model, classes, rates)
+    if regular.any():
+        v[regular] = np.linalg.solve(V[regular], a[regular][..., None])[..., 0]
+        u[regular] = np.linalg.solve(np.swapaxes(V[regular], -1, -2),
+                                     np.broadcast_to(w, (regular.sum(), m))[..., None])[..., 0]
+    r0 = np.full(batch, np.inf)
+    r0[regular] = v[regular] @ w
+
+    sensitivity = np.zeros((batch, model.n_flows))
+    transmission = np.flatnonzero(classes["transmission"])
+    local = np.full(model.n_compartments, -1, dtype=np.int64)
+    local[factors["infected"]] = np.arange(m)
+    sensitivity[:, transmission] = u[:, local[model.targets[transmission]]] * scale[:, transmission]
+    internal = np.flatnonzero(classes["infected"][model.sources])
+    source = local[model.sources[internal]]
+    target = local[model.targets[internal]]
+    target_u = np.where(target >= 0, u[:, np.maximum(target, 0)], 0.0)
+    with np.errstate(invalid="ignore"):
+        sensitivity[:, internal] = -v[:, source] * (u[:, source] - target_u)
+    sensitivity[~regular] = np.nan
+    with np.errstate(divide="ignore", invalid="ignore"):
+        elasticity = np.where(r0[:, None] > 0, rates * sensitivity / r0[:, None], 0.0)
+
+    result = {
+        "R0": r0,
+        "sensitivity": sensitivity,
+        "elasticity": elasticity,
+        "infected": factors["infected"],
+        "infectious": np.flatnonzero(classes["infectious"]),
+        "transmission": transmission,
+    }
+    if growth_rate:
+        F = a[:, :, None] * w[None, None, :]
+        result["growth_rate"] = np.linalg.eigvals(F - V).real.max(axis=-1)
+    return result
+
+
+def leaves_infection(model, classes: dict, rates) -> np.ndarray:
+    """
+    (batch,) True for the rate vectors under which every infected
+    compartment reaches a non-infected one along flows with a positive
+    rate, which is exactly when V is nonsingular. Decided on the flow graph,
+    since det(V) underflows for long chains of slow flows.
+    """
+    infected = classes["infected"]
+    internal = np.flatnonzero(infected[model.sources])
+    sources, targets = model.sources[internal], model.targets[internal]
+    positive = np.atleast_2d(rates)[:, internal] > 0
+    rows = np.arange(len(positive))[:, None]
+
+    exits = np.zeros((len(positive), model.n_compartments), dtype=bool)
+    np.logical_or.at(exits, (rows, sources[None, :]), positive & ~infected[targets])
+    onward = positive & infected[targets] & (targets != sources)
+    while True:
+        reached = exits.copy()
+        np.logical_or.at(reached, (rows, sources[None, :]), onward & exits[:, targets])
+        if (reached == exits).all():
+            return exits[:, infected].all(axis=1)
+        exits = reached
+
+
+def sample_rates(model, draws: int, spread: float = 0.1, seed: int = 0) -> np.ndarray:
+    """(draws, n_flows) rates perturbed log-normally around the model's rates."""
+    rng = np.random.default_rng(seed)
+    return model.rates * rng.lognormal(0.0, spread, size=(draws, model.n_flows))
+
+
+if __name__ == "__main__":
+    import time
+
+    parser = argparse.ArgumentParser(description="Basic reproduction number of a .serimodel file.")
+    parser.add_argument("model", help="path to a .serimodel file (or its compiled form)")
+    parser.add_argument("--draws", type=int, default=0, help="also evaluate this many log-normal rate draws")
+    parser.add_argument("--spread", type=float, default=0.1, help="log-scale standard deviation of the draws")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--top", type=int, default=5, help="number of most influential flows to list")
+    args = parser.parse_args()
+
+    compiled = serimodel.load(args.model)
+    nominal = reproduction_number(compiled, growth_rate=True)
+    names = compiled.names
+    print("Infected:     " + ", ".join(names[i] for i in nominal["infected"]))
+    print("Infectious:   " + ", ".join(names[i] for i in nominal["infectious"]))
+    print("Transmission: " + ", ".join(
+        f"{names[compiled.sources[f]]} -> {names[compiled.targets[f]]}" for f in nominal["transmission"]))
+    print(f"R0 = {nominal['R0'][0]:.4g} (growth rate {nominal['growth_rate'][0]:+.4g} per unit time)")
+    print("Largest elasticities:")
+    for f in np.argsort(-np.abs(nominal["elasticity"][0]))[:args.top]:
+        print(f"  {names[compiled.sources[f]]:>40} -> {names[compiled.targets[f]]:<40} "
+              f"{nominal['elasticity'][0, f]:+.3f}")
+
+    if args.draws:
+        start = time.perf_counter()
+        result = reproduction_number(compiled, sample_rates(compiled, args.draws, args.spread, args.seed))
+        seconds = time.perf_counter() - start
+        low, median, high = np.quantile(result["R0"], [0.05, 0.5, 0.95])
+        print(f"{args.draws} draws in {seconds:.3f}s: R0 median {median:.4g}, 90% interval [{low:.4g}, {high:.4g}], "
+              f"P(R0 > 1) = {(result['R0'] > 1).mean():.3f}")
@@ -0,0 +1,236 @@
+"""
+Model backends that generate_seirmodel_from_image calls through.
+
+A backend is any object with a `model_name` attribute and a
+`generate(parts) -> str` method, where `parts` is either a prompt string or a
+list of PIL images and strings (the same shapes Gemini's generate_content
+accepts). Backends also offer `stream(parts)`, a generator of text chunks;
+closing the generator early cancels the request. generate takes an
+optional `response_schema`, a JSON schema the response must follow
+(Gemini constrains its output to it; other backends ignore it).
+
+- GeminiBackend talks to Gemini. The SDK is imported and configured on the
+  first call, so importing this module (or main.py) has no side effects.
+- ReplayBackend records responses from another backend to disk, or replays
+  them offline.
+- FakeBackend returns a canned response after a simulated latency, and
+  can inject slow tail responses and rate-limit errors.
+
+resilience.ResilientBackend wraps any of these with deadlines, retries and
+hedging.
+"""
+import argparse
+import hashlib
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+
+import llm_cache
+
+
+DEFAULT_MODEL_NAME = "gemini-1.5-flash-latest"
+DEFAULT_REPLAY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "replays")
+
+
+class RateLimitError(RuntimeError):
+    """Raised by FakeBackend in place of Gemini's 429 ResourceExhausted."""
+
+    code = 429
+
+
+class GeminiBackend:
+    """
+    Gemini backend, created lazily on the first generate call. `timeout`
+    (seconds) is passed to the SDK as the request timeout.
+    """
+
+    def __init__(self, model_name: str = DEFAULT_MODEL_NAME, timeout: float = None):
+        self.model_name = model_name
+        self.timeout = timeout
+        self._model = None
+        self._lock = threading.Lock()
+
+    def _get_model(self):
+        with self._lock:
+            if self._model is None:
+                from dotenv import load_dotenv
+                import google.generativeai as genai
+
+                # Load the API key from environment variables
+                load_dotenv(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".env"))
+                api_key = os.environ.get("GOOGLE_API_KEY")
+                if not api_key:
+                    raise RuntimeError(
+                        "'GOOGLE_API_KEY' environment variable not set. Please set it before running the script."
+                    )
+                genai.configure(api_key=api_key)
+                self._model = genai.GenerativeModel(self.model_name)
+            return self._model
+
+    def warm(self):
+        """Imports and configures the SDK now rather than on the first request."""
+        self._get_model()
+
+    def _request_options(self) -> dict:
+        return {"request_options": {"timeout": self.timeout}} if self.timeout else {}
+
+    def generate(self, parts, response_schema: dict = None) -> str:
+        options = self._request_options()
+        if response_schema is not None:
+            options["generation_config"] = {"response_mime_type": "application/json",
+                                            "response_schema": response_schema}
+        return self._get_model().generate_content(parts, **options).text
+
+    def stream(self, parts):
+        # Closing this generator drops the response iterator, which ends the
+        # underlying server stream.
+        for chunk in self._get_model().generate_content(parts, stream=True, **self._request_options()):
+            yield chunk.text
+
+
+class FakeBackend:
+    """
+    Local stand-in for Gemini. Sleeps `latency` seconds (plus up to `jitter`
+    extra) per call and returns `response`, which may also be a callable
+    taking the parts and returning the text. stream() yields the response in
+    `chunk_size` pieces, spreading the latency across them.
+
+    For testing the call layer, a `tail_rate` fraction of calls takes
+    `tail_latency` seconds instead, and an `error_rate` fraction fails
+    straight away with RateLimitError.
+    """
+
+    def __init__(self, response="<seir:SEIRModel/>", latency: float = 0.0, jitter: float = 0.0,
+                 model_name: str = "fake", seed: int = None, chunk_size: int = 64, tail_rate: float = 0.0,
+                 tail_latency: float = 0.0, error_rate: float = 0.0):
+        self.response = response
+        self.chunk_size = chunk_size
+        self.latency = latency
+        self.jitter = jitter
+        self.tail_rate = tail_rate
+        self.tail_latency = tail_latency
+        self.error_rate = error_rate
+        self.errors = 0
+        self.model_name = model_name
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def generate(self, parts, response_schema: dict = None) -> str:
+        delay = self._next_delay()
+        if delay > 0:
+            time.sleep(delay)
+        return self.response(parts) if callable(self.response) else self.response
+
+    def stream(self, parts):
+        delay = self._next_delay()
+        text = self.response(parts) if callable(self.response) else self.response
+        pieces = [text[i:i + self.chunk_size] for i in range(0, len(text), self.chunk_size)] or [""]
+        for piece in pieces:
+            if delay > 0:
+                time.sleep(delay / len(pieces))
+            yield piece
+
+    def _next_delay(self) -> float:
+        with self._lock:
+            self.calls += 1
+            if self._random.random() < self.error_rate:
+                self.errors += 1
+                raise RateLimitError("429 Resource has been exhausted (injected by FakeBackend)")
+            if self._random.random() < self.tail_rate:
+                return self.tail_latency
+            return self.latency + self._random.uniform(0, self.jitter)
+
+
+class ReplayBackend:
+    """
+    Record/replay backend. With an `inner` backend it forwards every call and
+    records the response under a hash of the model name and parts; without
+    one it only replays, raising LookupError for prompts it has never seen.
+    """
+
+    def __init__(self, replay_dir: str = DEFAULT_REPLAY_DIR, inner=None, model_name: str = DEFAULT_MODEL_NAME):
+        self.inner = inner
+        self.model_name = inner.model_name if inner is not None else model_name
+        self.store = llm_cache.ResponseCache(replay_dir, max_bytes=None)
+
+    def key(self, parts) -> str:
+        parts_list = parts if isinstance(parts, list) else [parts]
+        return self.store.key(self.model_name, *[_part_bytes(p) for p in parts_list])
+
+    def generate(self, parts, response_schema: dict = None) -> str:
+        key = self.key(parts)
+        if self.inner is None:
+            text = self.store.get(key)
+            if text is None:
+                raise LookupError(f"No recorded response for prompt {key[:12]} in '{self.store.cache_dir}'")
+            return text
+
+        text = self.inner.generate(parts, response_schema=response_schema)
+        self.store.put(key, text, model=self.model_name)
+        return text
+
+    def stream(self, parts):
+        if self.inner is None:
+            yield self.generate(parts)
+            return
+        received = []
+        for chunk in self.inner.stream(parts):
+            received.append(chunk)
+            yield chunk
+        # Only fully received responses are recorded; cancelled ones are not.
+        self.store.put(self.key(parts), "".join(received), model=self.model_name)
+
+
+def _part_bytes(part) -> bytes:
+    """Stable bytes for a prompt part: text as UTF-8, images as their pixel data."""
+    if isinstance(part, str):
+        return part.encode("utf-8")
+    if isinstance(part, bytes):
+        return part
+    if hasattr(part, "tobytes"):
+        digest = hashlib.sha256(part.tobytes()).hexdigest()
+        return f"image:{part.mode}:{part.size}:{digest}".encode("utf-8")
+    return repr(part).encode("utf-8")
+
+
+def measure_import_time(module: str = "main", repeats: int = 5) -> float:
+    """Best-of-N wall time, in seconds, to import `module` in a fresh interpreter."""
+    code = f"import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+    here = os.path.dirname(os.path.abspath(__file__))
+    times = []
+    for _ in range(repeats):
+        out = subprocess.run([sys.executable, "-c", code], cwd=here, capture_output=True, text=True, check=True)
+        times.append(float(out.stdout.strip().splitlines()[-1]))
+    return min(times)
+
+
+def measure_pipeline_overhead(image_path: str, user_input: str, langSpecs_path: str, output_fileName: str,
+                              repeats: int = 10) -> float:
+    """
+    Mean seconds per generate_seirmodel_from_image run against a zero-latency
+    FakeBackend, i.e. the pipeline's own overhead excluding the model.
+    """
+    import main
+
+    backend = FakeBackend()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        main.generate_seirmodel_from_image(image_path, user_input, langSpecs_path, output_fileName, backend=backend)
+    return (time.perf_counter() - start) / repeats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure import time and pipeline overhead without network.")
+    parser.add_argument("--image", default="simple_seirmodel.png")
+    parser.add_argument("--spec", default="metamodel.txt")
+    parser.add_argument("--output", default=os.path.join("bench", "overhead.txt"))
+    parser.add_argument("--repeats", type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"import main: {measure_import_time() * 1000:.1f} ms")
+    overhead = measure_pipeline_overhead(args.image, "", args.spec, args.output, args.repeats)
+    print(f"pipeline overhead: {overhead * 1000:.1f} ms/run")
@@ -0,0 +1,248 @@
+"""
+Concurrent batch runner for generate_seirmodel_from_image.
+
+A manifest is a JSON list of jobs:
+
+    [
+      {"image": "hivModel(paper).jpeg",
+       "user_input": "hiv_imp_info_only",
+       "spec": "metamodel.txt",
+       "output": "hivModels/hiv_imp_info_only.txt"},
+      ...
+    ]
+
+`user_input` may be the name of one of the input constants in main.py, a path
+to a text file, or the literal text itself. A job may also carry "options"
+for generate_seirmodel_from_image, which override the batch-wide ones.
+
+Jobs run on a thread pool, so the LLM1 and LLM2 calls of different jobs
+overlap. Every model call goes through a shared rate limiter so the batch
+stays under the requests-per-minute quota, and, unless disabled, through a
+resilience.ResilientBackend outside the limiter, so retries and hedged
+requests are rate limited too.
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import backends
+import instrumentation
+import llm_cache
+import main
+import resilience
+import run_store
+
+
+class RateLimiter:
+    """
+    Thread-safe limiter that spaces calls evenly to stay under
+    `requests_per_minute`. A value of 0 or None disables limiting.
+    """
+
+    def __init__(self, requests_per_minute: float = None):
+        self.interval = 60.0 / requests_per_minute if requests_per_minute else 0.0
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def acquire(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+class RateLimitedBackend:
+    """Wraps a backend so every generate call waits on the limiter."""
+
+    def __init__(self, backend, limiter: RateLimiter):
+        self.backend = backend
+        self.limiter = limiter
+        self.model_name = backend.model_name
+
+    def warm(self):
+        getattr(self.backend, "warm", lambda: None)()
+
+    def generate(self, parts, response_schema: dict = None) -> str:
+        self.limiter.acquire()
+        return self.backend.generate(parts, response_schema=response_schema)
+
+    def stream(self, parts):
+        self.limiter.acquire()
+        return self.backend.stream(parts)
+
+
+def load_manifest(manifest_path: str) -> list:
+    """Reads a manifest file and resolves each job's user input to text."""
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        jobs = json.load(f)
+
+    for job in jobs:
+        missing = {"image", "user_input", "spec", "output"} - job.keys()
+        if missing:
+            raise ValueError(f"Manifest job {job} is missing keys: {sorted(missing)}")
+        job["user_input"] = resolve_user_input(job["user_input"])
+    return jobs
+
+
+def resolve_user_input(value: str) -> str:
+    """Looks the value up as a main.py constant, then as a file, else returns it as-is."""
+    if isinstance(getattr(main, value, None), str):
+        return getattr(main, value)
+    if os.path.isfile(value):
+        with open(value, "r", encoding="utf-8") as f:
+            return f.read()
+    return value
+
+
+def _run_job(job: dict, backend, cache, options: dict) -> dict:
+    start = time.perf_counter()
+    result = main.generate_seirmodel_from_image(
+        job["image"], job["user_input"], job["spec"], job["output"], backend=backend, cache=cache,
+        **{**options, **job.get("options", {})}
+    )
+    return {
+        "output": job["output"],
+        "ok": result.startswith("SEIR model successfully"),
+        "result": result,
+        "seconds": time.perf_counter() - start,
+    }
+
+
+def run_batch(jobs: list, max_concurrency: int = 4, requests_per_minute: float = None, backend=None,
+              cache=None, retry_options: dict = None, **options) -> dict:
+    """
+    Runs every job concurrently and returns a report with per-job timings
+    and overall throughput. `cache` (an llm_cache.ResponseCache) is shared by
+    all jobs; its hit/miss counters are included in the report.
+    `retry_options` (a dict of resilience.ResilientBackend arguments, {} for
+    the defaults) adds timeouts, retries and hedging; its counters are
+    included in the report. Any other keyword options (stream_llm1,
+    local_rates, ...) are passed through to generate_seirmodel_from_image.
+    """
+    timeout = (retry_options or {}).get("timeout", resilience.DEFAULT_TIMEOUT)
+    backend = RateLimitedBackend(backend or backends.GeminiBackend(main.MODEL_NAME, timeout=timeout),
+                                 RateLimiter(requests_per_minute))
+    if retry_options is not None:
+        backend = resilience.ResilientBackend(backend, **retry_options)
+
+    results = []
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+        futures = {pool.submit(_run_job, job, backend, cache, options): job for job in jobs}
+        for future in as_completed(futures):
+            try:
+                results.append(future.result())
+            except Exception as err:
+                results.append({
+                    "output": futures[future]["output"],
+                    "ok": False,
+                    "result": f"An unexpected error occurred: {err}",
+                    "seconds": None,
+                })
+    wall = time.perf_counter() - start
+
+    busy = sum(r["seconds"] for r in results if r["seconds"] is not None)
+    return {
+        "jobs": results,
+        "succeeded": sum(r["ok"] for r in results),
+        "failed": sum(not r["ok"] for r in results),
+        "wall_seconds": wall,
+        "jobs_per_minute": len(results) / wall * 60 if wall else 0.0,
+        "speedup": busy / wall if wall else 0.0,
+        "cache": cache.stats() if cache is not None else None,
+        "calls": backend.stats() if retry_options is not None else None,
+    }
+
+
+def print_report(report: dict):
+    for job in sorted(report["jobs"], key=lambda r: r["output"]):
+        status = "OK  " if job["ok"] else "FAIL"
+        seconds = f"{job['seconds']:.2f}s" if job["seconds"] is not None else "-"
+        print(f"{status} {seconds:>8}  {job['output']}")
+        if not job["ok"]:
+            print(f"      {job['result']}")
+    print(
+        f"\n{report['succeeded']} succeeded, {report['failed']} failed in "
+        f"{report['wall_seconds']:.2f}s "
+        f"({report['jobs_per_minute']:.1f} jobs/min, {report['speedup']:.1f}x over sequential)"
+    )
+    if report["cache"] is not None:
+        print(f"Cache: {report['cache']['hits']} hits, {report['cache']['misses']} misses")
+    if report["calls"] is not None:
+        resilience.print_stats(report["calls"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run generate_seirmodel_from_image over a manifest of jobs.")
+    parser.add_argument("manifest", help="JSON list of {image, user_input, spec, output} jobs")
+    parser.add_argument("--concurrency", type=int, default=4, help="maximum jobs in flight")
+    parser.add_argument("--rpm", type=float, default=None, help="maximum model requests per minute")
+    parser.add_argument("--fake", type=float, metavar="LATENCY", default=None,
+                        help="use a local fake backend with this per-call latency instead of Gemini")
+    parser.add_argument("--replay", metavar="DIR", default=None, help="serve recorded responses from DIR offline")
+    parser.add_argument("--record", metavar="DIR", default=None, help="record Gemini responses into DIR")
+    parser.add_argument("--cache", metavar="DIR", nargs="?", const=llm_cache.DEFAULT_CACHE_DIR, default=None,
+                        help="reuse LLM responses from an on-disk cache")
+    parser.add_argument("--refresh", action="store_true", help="ignore cached responses but store new ones")
+    parser.add_argument("--stream", action="store_true", help="stream and validate LLM1 output as it arrives")
+    parser.add_argument("--local-rates", action="store_true", help="compute rates locally, LLM2 only as fallback")
+    parser.add_argument("--preprocess", action="store_true", help="crop, downscale and re-encode images before upload")
+    parser.add_argument("--store", metavar="DIR", nargs="?", const=run_store.DEFAULT_STORE_DIR, default=None,
+                        help="index runs in a run store and reuse results for identical inputs")
+    parser.add_argument("--no-fast-path", action="store_true",
+                        help="always call LLM1, even for inputs that already list every compartment and flow")
+    parser.add_argument("--compact", action="store_true",
+                        help="send compact, relevance-trimmed prompt context (see prompts.py)")
+    parser.add_argument("--lean", action="store_true",
+                        help="have LLM2 return only the rates as JSON, merged locally (see lean_rates.py)")
+    parser.add_argument("--no-incremental", action="store_true",
+                        help="with --store, regenerate fully even when only numbers changed since a stored run")
+    parser.add_argument("--partition", type=int, metavar="SIZE", default=None,
+                        help="generate large models in concurrent partitions of at most SIZE compartments")
+    parser.add_argument("--timeout", type=float, default=120.0, help="seconds before a model call is retried")
+    parser.add_argument("--retries", type=int, default=3, help="retries per model call (0 disables retrying)")
+    parser.add_argument("--hedge", nargs="?", type=float, const=-1.0, default=None, metavar="SECONDS",
+                        help="send a duplicate request when a call runs past SECONDS (default: observed p95)")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="with --fake, fraction of calls failing with 429")
+    parser.add_argument("--tail-rate", type=float, default=0.0, help="with --fake, fraction of calls that are slow")
+    parser.add_argument("--tail-latency", type=float, default=0.0, help="with --fake, latency of the slow calls")
+    parser.add_argument("--metrics", metavar="JSONL", default=None,
+                        help="append per-stage measurements to JSONL and print a p50/p95 summary")
+    args = parser.parse_args()
+
+    if args.fake is not None:
+        backend = backends.FakeBackend(latency=args.fake, error_rate=args.fail_rate, tail_rate=args.tail_rate,
+                                       tail_latency=args.tail_latency)
+    elif args.replay:
+        backend = backends.ReplayBackend(args.replay)
+    elif args.record:
+        backend = backends.ReplayBackend(args.record,
+                                         inner=backends.GeminiBackend(main.MODEL_NAME, timeout=args.timeout))
+    else:
+        backend = None
+    cache = llm_cache.ResponseCache(args.cache, refresh=args.refresh) if args.cache else None
+    recorder = instrumentation.Recorder(args.metrics) if args.metrics else None
+    retry_options = {
+        "timeout": args.timeout,
+        "max_attempts": args.retries + 1,
+        "hedge": args.hedge is not None,
+        "hedge_after": args.hedge if args.hedge is not None and args.hedge >= 0 else None,
+    }
+    report = run_batch(load_manifest(args.manifest), args.concurrency, args.rpm, backend=backend, cache=cache,
+                       retry_options=retry_options, stream_llm1=args.stream, local_rates=args.local_rates,
+                       preprocess_options={} if args.preprocess else None, recorder=recorder,
+                       run_store=run_store.RunStore(args.store) if args.store else None,
+                       partition_size=args.partition, fast_path=not args.no_fast_path,
+                       incremental=not args.no_incremental, compact_prompts=args.compact, lean=args.lean)
+    print_report(report)
+    if recorder is not None:
+        print()
+        instrumentation.print_summary(instrumentation.summarize(recorder.events))
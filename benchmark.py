@@ -0,0 +1,460 @@
+"""
+Accuracy and speed benchmark for the prompt strategies.
+
+The experiment folders hold one transcript per strategy and model
+(hivModels/, covidModels/, simpleModel/). Each transcript's final response
+is scored against the family's reference model:
+
+- covid:  covid.serimodel
+- hiv:    the hiv_all_info skeleton run, whose verdict records an exact
+          match with the master model
+- simple: the simpleModel(Metamodel) run, verdict "all the value and flow
+          directions are correct"
+
+Compartments are matched by name (user_input.name_key of "Primary
+Secondary", so "Exposed (quarantined)" matches PrimaryName="Exposed"
+SecondaryName="quarantined"), flows by their matched (source, target)
+pair. Each variant gets compartment and flow precision/recall/F1 and the
+median relative error of the rates on matched flows. Scores are
+aggregated per (family, strategy), since the same strategy name
+("image_only", "text_only", ...) means a different model in every family;
+rate errors are aggregated by their median too, so one badly misread rate
+(a relative error in the thousands) does not swamp the rest.
+
+With a manifest the strategies are run rather than read: each job goes
+through generate_seirmodel_from_image and its output is scored the same
+way. Jobs run on recorded responses (a ReplayBackend over --replay, filled
+by `batch.py --record DIR`), the fake backend or the live model.
+benchmark_manifest.json lists the strategies that need no model call at
+all (tabular and JSON inputs, with local rates), so it runs offline without
+any recordings:
+
+    python benchmark.py --manifest benchmark_manifest.json --workers 1
+
+Either way the variants are spread over a process pool. Only manifest runs
+are timed: each strategy's generation time and throughput are reported
+next to its accuracy, and the fastest accurate strategy is named. Stored
+transcripts carry no timing, so they are ranked by accuracy alone. A
+family's reference transcript is never scored as one of its variants.
+
+--compare-compact runs each manifest job a second time with compact
+prompts (see prompts.py) and lists accuracy and prompt tokens side by
+side; --compare-lean does the same with lean LLM2 output (see
+lean_rates.py) and lists LLM2's output tokens and seconds. Replays only cover the prompts they were recorded
+with, so these need --live (or --fake, for tokens only).
+"""
+import argparse
+import glob
+import json
+import os
+import re
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import serimodel
+import user_input
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+FAMILIES = {
+    "covid": ("covidModels", "covid.serimodel"),
+    "hiv": ("hivModels", "hivModels/skeleton_seirmodel_output/hiv_all_info.txt"),
+    "simple": ("simpleModel", "simpleModel/metamodel_vs_skeleton/simpleModel(Metamodel).txt"),
+}
+
+# Relative rate error below which a rate counts as exact.
+RATE_TOLERANCE = 1e-3
+
+_RESPONSE_HEADER_RE = re.compile(r"(?m)^[A-Z0-9' ]*RESPONSE:[ \t]*$")
+_COMMENT_RE = re.compile(r"<!--.*?-->", re.DOTALL)
+
+
+def response_section(text: str) -> str:
+    """A transcript's final response: the last RESPONSE: section, before any FINAL VERDICT."""
+    return _RESPONSE_HEADER_RE.split(text)[-1].split("FINAL VERDICT:")[0]
+
+
+def response_model(text: str) -> str:
+    """
+    Model XML of a transcript's final response (see response_section), or
+    of `text` itself if it has no such section. Placeholder comments such as
+    rate="<!-- missing info -->" are dropped so the XML parses; those rates
+    then score as missing.
+    """
+    return _COMMENT_RE.sub("", serimodel.extract_xml(response_section(text)))
+
+
+def discover_variants(families=FAMILIES) -> list:
+    """
+    One {"family", "strategy", "path", "reference"} dict per transcript in
+    the experiment folders, except the family's reference itself.
+    """
+    variants = []
+    for family, (folder, reference) in families.items():
+        for path in sorted(glob.glob(os.path.join(BASE_DIR, folder, "**", "*.txt"), recursive=True)):
+            if os.path.normpath(path) == os.path.normpath(os.path.join(BASE_DIR, reference)):
+                continue
+            variants.append({
+                "family": family,
+                "strategy": strategy_name(path),
+                "path": os.path.relpath(path, BASE_DIR),
+                "reference": reference,
+            })
+    return variants
+
+
+def strategy_name(path: str) -> str:
+    """'covid_model(image_only).txt' -> 'image_only', 'hiv_json.txt' -> 'json'."""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    match = re.search(r"\(([^)]*)\)", stem)
+    if match:
+        return match.group(1).strip().lower().replace(" ", "_")
+    return stem.split("_", 1)[-1].lower()
+
+
+def score(candidate_text: str, reference_text: str) -> dict:
+    """Structural accuracy and rate error of one model against a reference."""
+    reference = serimodel.parse_compartments(response_model(reference_text))
+    try:
+        candidate = serimodel.parse_compartments(response_model(candidate_text))
+    except Exception as err:
+        return {"parsed": False, "error": f"{type(err).__name__}: {err}",
+                **_prf("compartment", 0, 0, len(reference)),
+                **_prf("flow", 0, 0, sum(len(c["flows"]) for c in reference)),
+                "rate_error": None, "rates_exact": 0.0, "rates_missing": 0}
+
+    # Candidate compartment index -> reference index, matching names in order.
+    available = {}
+    for index, compartment in enumerate(reference):
+        available.setdefault(_compartment_key(compartment), []).append(index)
+    mapping = {}
+    for index, compartment in enumerate(candidate):
+        indices = available.get(_compartment_key(compartment))
+        if indices:
+            mapping[index] = indices.pop(0)
+
+    reference_flows = _flows_by_pair(reference, {i: i for i in range(len(reference))})
+    candidate_flows = _flows_by_pair(candidate, mapping)
+    matched = exact = missing = 0
+    relative_errors = []
+    for pair, reference_rates in reference_flows.items():
+        candidate_rates = candidate_flows.get(pair, [])
+        matched += min(len(reference_rates), len(candidate_rates))
+        # Parallel flows (e.g. several death flows) are paired in sorted order.
+        for expected, actual in zip(sorted(reference_rates, key=_rate_order), sorted(candidate_rates, key=_rate_order)):
+            if actual is None or expected is None:
+                missing += actual is None
+                continue
+            error = abs(actual - expected) / abs(expected) if expected else abs(actual)
+            relative_errors.append(error)
+            exact += error <= RATE_TOLERANCE
+
+    return {
+        "parsed": True,
+        **_prf("compartment", len(mapping), len(candidate), len(reference)),
+        **_prf("flow", matched, sum(len(c["flows"]) for c in candidate), sum(len(c["flows"]) for c in reference)),
+        "rate_error": statistics.median(relative_errors) if relative_errors else None,
+        "rates_exact": exact / matched if matched else 0.0,
+        "rates_missing": missing,
+    }
+
+
+def _compartment_key(compartment: dict) -> str:
+    primary = user_input.name_key(compartment["PrimaryName"])
+    secondary = user_input.name_key(compartment["SecondaryName"])
+    # PrimaryName="Susceptible_Women" SecondaryName="Women" is the same compartment as "Susceptible (Women)".
+    if secondary and primary.endswith(secondary) and primary != secondary:
+        primary = primary[:-len(secondary)]
+    return primary + secondary
+
+
+def _flows_by_pair(compartments: list, mapping: dict) -> dict:
+    """{(source, target) in reference indices: [rate or None, ...]} for flows whose ends are matched."""
+    flows = {}
+    for index, compartment in enumerate(compartments):
+        for flow in compartment["flows"]:
+            if index in mapping and flow["target"] in mapping:
+                try:
+                    rate = float(flow["rate"])
+                except ValueError:
+                    rate = None
+                flows.setdefault((mapping[index], mapping[flow["target"]]), []).append(rate)
+    return flows
+
+
+def _rate_order(rate) -> tuple:
+    return (rate is None, rate or 0.0)
+
+
+def _prf(name: str, matched: int, predicted: int, expected: int) -> dict:
+    precision = matched / predicted if predicted else 0.0
+    recall = matched / expected if expected else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {f"{name}_precision": precision, f"{name}_recall": recall, f"{name}_f1": f1}
+
+
+def _read(path: str) -> str:
+    with open(os.path.join(BASE_DIR, path), "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def _evaluate(task) -> dict:
+    """
+    Scores one variant, first running its job through the pipeline when it
+    has one. "seconds" is the job's generation time, None for transcripts.
+    """
+    variant, backend_options = task
+    if "job" in variant:
+        import backends
+        import instrumentation
+        import main
+
+        job = variant["job"]
+        if backend_options.get("live"):
+            backend = main.get_backend()
+        elif backend_options.get("replay"):
+            backend = backends.ReplayBackend(backend_options["replay"], model_name=backend_options["model"])
+        else:
+            backend = backends.FakeBackend(latency=backend_options.get("fake") or 0.0)
+        recorder = instrumentation.Recorder()
+        start = time.perf_counter()
+        try:
+            result = main.generate_seirmodel_from_image(job["image"], job["user_input"], job["spec"], job["output"],
+                                                        backend=backend, recorder=recorder, **job.get("options", {}))
+        except Exception as err:
+            result = f"{type(err).__name__}: {err}"
+        seconds = time.perf_counter() - start
+        llm2_events = [event for event in recorder.events if event["stage"] == "llm2"]
+        variant = {**variant, "prompt_tokens": sum(event.get("prompt_tokens", 0) for event in recorder.events
+                                                   if event["stage"] in ("llm1", "llm2")),
+                   "llm2_response_tokens": sum(event.get("response_tokens", 0) for event in llm2_events),
+                   "llm2_seconds": sum(event["seconds"] for event in llm2_events)}
+        if not result.startswith("SEIR model successfully"):
+            return {**variant, "parsed": False, "error": result, "seconds": seconds}
+        candidate = _read(main.output_path(job["output"]))
+    else:
+        seconds = None
+        candidate = _read(variant["path"])
+    scores = score(candidate, _read(variant["reference"]))
+    return {**variant, **scores, "seconds": seconds}
+
+
+def run_benchmark(variants: list, workers: int = None, **backend_options) -> dict:
+    """
+    Scores every variant (see discover_variants / manifest_variants) on a
+    process pool of `workers` (inline when 1) and aggregates per strategy.
+    `backend_options` (replay=DIR, model=NAME or fake=LATENCY) choose the
+    backend for variants that carry a pipeline job.
+    """
+    tasks = [(variant, backend_options) for variant in variants]
+    start = time.perf_counter()
+    if workers is None or workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_evaluate, tasks))
+    else:
+        results = [_evaluate(task) for task in tasks]
+    wall = time.perf_counter() - start
+    return {
+        "variants": results,
+        "strategies": summarize(results),
+        "wall_seconds": wall,
+        "variants_per_minute": len(results) / wall * 60 if wall else 0.0,
+    }
+
+
+def summarize(results: list) -> dict:
+    """
+    Per-"family/strategy" means of the scores, median rate error,
+    generation seconds and throughput (None when untimed).
+    """
+    by_strategy = {}
+    for result in results:
+        by_strategy.setdefault(strategy_key(result), []).append(result)
+
+    summary = {}
+    for strategy, rows in by_strategy.items():
+        timed = [row["seconds"] for row in rows if row["seconds"] is not None]
+        seconds = sum(timed) if timed else None
+        rate_errors = [row["rate_error"] for row in rows if row.get("rate_error") is not None]
+        summary[strategy] = {
+            "variants": len(rows),
+            "parsed": sum(row["parsed"] for row in rows),
+            "compartment_f1": sum(row.get("compartment_f1", 0.0) for row in rows) / len(rows),
+            "flow_f1": sum(row.get("flow_f1", 0.0) for row in rows) / len(rows),
+            "rates_exact": sum(row.get("rates_exact", 0.0) for row in rows) / len(rows),
+            "rate_error": statistics.median(rate_errors) if rate_errors else None,
+            "seconds": seconds,
+            "per_minute": len(timed) / seconds * 60 if seconds else None,
+        }
+    return summary
+
+
+def strategy_key(result: dict) -> str:
+    """'hiv/image_only' for a result; just the strategy when it has no family."""
+    return f"{result['family']}/{result['strategy']}" if result.get("family") else result["strategy"]
+
+
+def fastest_accurate(summary: dict, min_flow_f1: float = 0.9) -> str:
+    """Timed strategy with the lowest seconds per variant among those reaching `min_flow_f1`, or None."""
+    accurate = [(row["seconds"] / row["variants"], name) for name, row in summary.items()
+                if row["flow_f1"] >= min_flow_f1 and row["seconds"] is not None]
+    return min(accurate)[1] if accurate else None
+
+
+def manifest_variants(manifest_path: str) -> list:
+    """
+    Reads a batch.py manifest whose jobs also name a "strategy" and a
+    "reference" model, and optionally "options" for
+    generate_seirmodel_from_image (e.g. {"local_rates": true}).
+    """
+    import batch
+
+    variants = []
+    for job in batch.load_manifest(manifest_path):
+        variants.append({
+            "family": job.get("family", ""),
+            "strategy": job.get("strategy", os.path.splitext(os.path.basename(job["output"]))[0]),
+            "path": job["output"],
+            "reference": job["reference"],
+            "job": job,
+        })
+    return variants
+
+
+def option_variants(variants: list, suffix: str, **options) -> list:
+    """
+    A copy of each manifest variant that runs with extra
+    generate_seirmodel_from_image `options`, as strategy "<strategy>+<suffix>".
+    """
+    copies = []
+    for variant in variants:
+        if "job" not in variant:
+            continue
+        root, extension = os.path.splitext(variant["job"]["output"])
+        job = {**variant["job"], "output": f"{root}_{suffix}{extension}",
+               "options": {**variant["job"].get("options", {}), **options}}
+        copies.append({**variant, "strategy": f"{variant['strategy']}+{suffix}", "path": job["output"], "job": job,
+                       "variant_of": variant["path"], "option": suffix})
+    return copies
+
+
+def compact_variants(variants: list) -> list:
+    """A copy of each manifest variant that runs with compact prompts, as strategy "<strategy>+compact"."""
+    return option_variants(variants, "compact", compact_prompts=True)
+
+
+def lean_variants(variants: list) -> list:
+    """A copy of each manifest variant that runs with lean LLM2 output, as strategy "<strategy>+lean"."""
+    return option_variants(variants, "lean", lean=True)
+
+
+def _comparison_rows(report: dict, option: str) -> list:
+    """(baseline, variant) result pairs for the variants made with `option`."""
+    by_path = {row["path"]: row for row in report["variants"]}
+    return [(by_path[row["variant_of"]], row) for row in report["variants"]
+            if row.get("option") == option and row["variant_of"] in by_path]
+
+
+def _score_cells(full: dict, variant: dict) -> str:
+    cells = []
+    for key, width in (("flow_f1", 9), ("rates_exact", 7)):
+        for row, row_width in ((full, width), (variant, 9)):
+            cells.append(f"{row[key]:>{row_width}.2f}" if row["parsed"] else f"{'-':>{row_width}}")
+    return "".join(cells)
+
+
+def _saved(full: float, reduced: float, width: int = 7) -> str:
+    return f"{1 - reduced / full:>{width}.0%}" if full else f"{'-':>{width}}"
+
+
+def print_compact_comparison(report: dict):
+    """Full against compact prompts per job: flow F1, exact rates and prompt tokens."""
+    print(f"\n{'job':<48}{'flow F1':>9}{'compact':>9}{'exact':>7}{'compact':>9}{'tokens':>8}{'compact':>9}{'saved':>7}")
+    for full, compact in _comparison_rows(report, "compact"):
+        tokens, compact_tokens = full.get("prompt_tokens", 0), compact.get("prompt_tokens", 0)
+        print(f"{full['path']:<48}{_score_cells(full, compact)}{tokens:>8}{compact_tokens:>9}"
+              f"{_saved(tokens, compact_tokens)}")
+
+
+def print_lean_comparison(report: dict):
+    """Regular against lean LLM2 output per job: flow F1, exact rates, LLM2 output tokens and seconds."""
+    print(f"\n{'job':<48}{'flow F1':>9}{'lean':>9}{'exact':>7}{'lean':>9}"
+          f"{'out tok':>9}{'lean':>7}{'saved':>7}{'LLM2 s':>8}{'lean':>8}{'saved':>7}")
+    for full, lean in _comparison_rows(report, "lean"):
+        tokens, lean_tokens = full.get("llm2_response_tokens", 0), lean.get("llm2_response_tokens", 0)
+        seconds, lean_seconds = full.get("llm2_seconds", 0.0), lean.get("llm2_seconds", 0.0)
+        print(f"{full['path']:<48}{_score_cells(full, lean)}{tokens:>9}{lean_tokens:>7}{_saved(tokens, lean_tokens)}"
+              f"{seconds:>8.2f}{lean_seconds:>8.2f}{_saved(seconds, lean_seconds)}")
+
+
+def print_report(report: dict, min_flow_f1: float = 0.9):
+    print(f"{'variant':<72}{'comp F1':>9}{'flow F1':>9}{'exact':>8}{'rate err':>10}")
+    for row in sorted(report["variants"], key=lambda r: (r["family"], r["strategy"])):
+        if not row["parsed"]:
+            print(f"{row['path']:<72}  not parsed: {row['error']}")
+            continue
+        rate_error = f"{row['rate_error']:.3f}" if row["rate_error"] is not None else "-"
+        print(f"{row['path']:<72}{row['compartment_f1']:>9.2f}{row['flow_f1']:>9.2f}"
+              f"{row['rates_exact']:>8.2f}{rate_error:>10}")
+
+    print(f"\n{'strategy':<32}{'n':>4}{'comp F1':>9}{'flow F1':>9}{'exact':>8}{'rate err':>10}{'s':>9}{'per min':>10}")
+    ranked = sorted(report["strategies"].items(), key=lambda item: (-item[1]["flow_f1"], item[1]["seconds"] or 0.0))
+    for name, row in ranked:
+        rate_error = f"{row['rate_error']:.3f}" if row["rate_error"] is not None else "-"
+        timing = (f"{row['seconds']:>9.3f}{row['per_minute']:>10.1f}" if row["seconds"] is not None
+                  else f"{'-':>9}{'-':>10}")
+        print(f"{name:<32}{row['variants']:>4}{row['compartment_f1']:>9.2f}{row['flow_f1']:>9.2f}"
+              f"{row['rates_exact']:>8.2f}{rate_error:>10}{timing}")
+    print(f"\n{len(report['variants'])} variants in {report['wall_seconds']:.2f}s "
+          f"({report['variants_per_minute']:.1f}/min)")
+    if all(row["seconds"] is None for row in report["strategies"].values()):
+        print("Transcripts are not timed; run a --manifest to rank strategies by speed.")
+        return
+    best = fastest_accurate(report["strategies"], min_flow_f1)
+    print(f"Fastest strategy with flow F1 >= {min_flow_f1:g}: {best or 'none'}")
+
+
+if __name__ == "__main__":
+    import backends
+
+    parser = argparse.ArgumentParser(description="Score prompt strategies against the reference models.")
+    parser.add_argument("--manifest", help="run these jobs (with strategy and reference keys) instead of "
+                                           "scoring the transcripts in the experiment folders")
+    parser.add_argument("--replay", metavar="DIR", default=backends.DEFAULT_REPLAY_DIR,
+                        help="responses recorded with `batch.py --record DIR`, used to run manifest jobs offline")
+    parser.add_argument("--model", default=backends.DEFAULT_MODEL_NAME, help="model name the replays were recorded with")
+    parser.add_argument("--fake", type=float, metavar="LATENCY", default=None,
+                        help="run manifest jobs on the fake backend instead of replays")
+    parser.add_argument("--live", action="store_true", help="run manifest jobs against the real model")
+    parser.add_argument("--compare-compact", action="store_true",
+                        help="also run every manifest job with compact prompts and compare accuracy and tokens")
+    parser.add_argument("--compare-lean", action="store_true",
+                        help="also run every manifest job with lean LLM2 output and compare accuracy, "
+                             "output tokens and LLM2 time")
+    parser.add_argument("--workers", type=int, default=None, help="processes in the pool (1 runs inline)")
+    parser.add_argument("--min-flow-f1", type=float, default=0.9)
+    parser.add_argument("--json", metavar="PATH", help="also write the full report as JSON")
+    args = parser.parse_args()
+
+    variants = manifest_variants(args.manifest) if args.manifest else discover_variants()
+    if args.compare_compact:
+        variants += compact_variants(variants)
+    if args.compare_lean:
+        variants += lean_variants([variant for variant in variants if "option" not in variant])
+    if args.live:
+        backend_options = {"live": True}
+    elif args.fake is not None:
+        backend_options = {"fake": args.fake}
+    else:
+        backend_options = {"replay": args.replay, "model": args.model}
+    report = run_benchmark(variants, args.workers, **backend_options)
+    print_report(report, args.min_flow_f1)
+    if args.compare_compact:
+        print_compact_comparison(report)
+    if args.compare_lean:
+        print_lean_comparison(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, default=str)
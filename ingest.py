@@ -0,0 +1,354 @@
+"""
+PDF ingestion: from a paper to the one image and text the pipeline needs.
+
+Papers such as papers/Mathematical_Model_of_HIV.pdf hold the compartment
+diagram on one page and the parameter tables on others, among pages of
+prose, plots and references. Instead of uploading whole documents (or
+cropping and retyping by hand), scan() reads every page's text layout
+locally and finds the captions:
+
+- figures whose caption describes a model diagram ("Diagram and ODE system
+  for ... model") score high, plots ("Bifurcation diagram ... in function
+  of ...") score low;
+- tables of parameters or state variables score high, tables of reported
+  cases low.
+
+Tables are rebuilt from word positions (rows by baseline, cells by gaps)
+and written as markdown, which the rest of the pipeline already parses.
+Only the selected figure regions are rasterized, in a process pool, and
+stacked into one PNG, which generate_seirmodel_from_image receives with
+the tables as its user input.
+
+Papers with no caption scoring as a model diagram have nothing for the
+image stage and are reported as skipped rather than sent.
+
+Some fonts map Greek glyphs onto Latin letters (Ψ -> C, θ -> h, and δ and
+d both -> d), so a parameter table can list the same symbol twice.
+user_input.parse_values would silently keep the first value, so such
+papers are reported and run without --local-rates.
+
+PyMuPDF is optional: it is imported when a PDF is opened
+(pip install -r requirements-optional.txt).
+"""
+import argparse
+import collections
+import hashlib
+import io
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import PIL.Image
+
+import user_input
+
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".pdf_cache")
+
+DIAGRAM_WORDS = {
+    "compartment": 3, "diagram": 2, "schematic": 2, "flow": 2, "flowchart": 2, "model": 1, "ode": 1,
+    "transmission": 1, "structure": 1, "bifurcation": -3, "simulation": -2, "function of": -2,
+    "solution": -2, "versus": -2, "sensitivity": -2, "plot": -2, "fitted": -2, "cases": -1,
+}
+TABLE_WORDS = {
+    "parameter": 3, "value": 2, "state variable": 2, "compartment": 2, "initial": 1, "rate": 1,
+    "description": 1, "cases": -2, "reported": -1, "result": -1,
+}
+
+_CAPTION_RE = re.compile(r"^(FIG\.|Fig\.|Figure|FIGURE|TABLE|Table)\s*(\d+)\s*[.:]\s*(.*)$")
+_LINE_TOLERANCE = 3.0     # points between word centres on the same line
+_CELL_GAP = 7.0           # points of horizontal space that separate two cells
+_CAPTION_GAP = 14.0       # points between caption lines
+
+
+def _pymupdf():
+    try:
+        import pymupdf
+    except ImportError:
+        try:
+            import fitz as pymupdf
+        except ImportError:
+            raise ImportError("PDF ingestion needs PyMuPDF: pip install -r requirements-optional.txt "
+                              "(or pip install pymupdf)") from None
+    return pymupdf
+
+
+def scan(pdf_path: str) -> dict:
+    """
+    Reads the layout of every page and returns {"pages", "figures", "tables"}.
+    Figures are {"page", "label", "caption", "score", "clip"}, tables
+    {"page", "label", "caption", "score", "rows"}, both in document order.
+    """
+    pymupdf = _pymupdf()
+    figures, tables = [], []
+    with pymupdf.open(pdf_path) as document:
+        for page in document:
+            lines = _page_lines(page)
+            region_top = 0.0
+            for number, line in enumerate(lines):
+                # The label may be set apart from the caption text ("FIG. 2.   Diagram ...").
+                if not _CAPTION_RE.match(line["cells"][0]):
+                    continue
+                match = _CAPTION_RE.match(" ".join(line["cells"]))
+                caption_lines = _caption_lines(lines, number)
+                caption = " ".join([match.group(3)] + [" ".join(lines[i]["cells"]) for i in caption_lines]).strip()
+                entry = {"page": page.number, "label": f"{match.group(1).rstrip('.')} {match.group(2)}",
+                         "caption": caption}
+                if match.group(1).lower().startswith("fig"):
+                    entry["score"] = _score(caption, DIAGRAM_WORDS)
+                    entry["clip"] = _figure_clip(page, region_top, line["top"])
+                    figures.append(entry)
+                else:
+                    entry["score"] = _score(caption, TABLE_WORDS)
+                    entry["rows"] = _table_rows(lines, (caption_lines or [number])[-1] + 1)
+                    tables.append(entry)
+                region_top = lines[(caption_lines or [number])[-1]]["bottom"]
+        pages = len(document)
+    return {"pages": pages, "figures": figures, "tables": tables}
+
+
+def _page_lines(page) -> list:
+    """Text lines top to bottom, each {"top", "bottom", "cells"} with cells split at wide gaps."""
+    words = sorted(page.get_text("words"), key=lambda w: ((w[1] + w[3]) / 2, w[0]))
+    grouped = []
+    for word in words:
+        centre = (word[1] + word[3]) / 2
+        if grouped and abs(grouped[-1][0] - centre) < _LINE_TOLERANCE:
+            grouped[-1][1].append(word)
+        else:
+            grouped.append((centre, [word]))
+
+    lines = []
+    for _, line_words in grouped:
+        line_words.sort(key=lambda w: w[0])
+        cells = [[line_words[0]]]
+        for previous, word in zip(line_words, line_words[1:]):
+            if word[0] - previous[2] > _CELL_GAP:
+                cells.append([word])
+            else:
+                cells[-1].append(word)
+        lines.append({
+            "top": min(w[1] for w in line_words),
+            "bottom": max(w[3] for w in line_words),
+            "cells": [" ".join(w[4] for w in cell) for cell in cells],
+        })
+    return lines
+
+
+def _caption_lines(lines: list, number: int) -> list:
+    """Indices of the single-cell lines that continue the caption on line `number`."""
+    following = []
+    bottom = lines[number]["bottom"]
+    for index in range(number + 1, len(lines)):
+        line = lines[index]
+        if len(line["cells"]) > 1 or line["top"] - bottom > _CAPTION_GAP or _CAPTION_RE.match(line["cells"][0]):
+            break
+        # A full-width line after the caption is body text.
+        if len(line["cells"][0]) > 90:
+            break
+        following.append(index)
+        bottom = line["bottom"]
+    return following
+
+
+def _score(caption: str, words: dict) -> int:
+    text = caption.lower()
+    return sum(weight for word, weight in words.items() if word in text)
+
+
+def _figure_clip(page, region_top: float, caption_top: float) -> tuple:
+    """Bounding box of the images and drawings between `region_top` and the caption."""
+    boxes = [info["bbox"] for info in page.get_image_info()]
+    boxes += [tuple(drawing["rect"]) for drawing in page.get_drawings()]
+    inside = [box for box in boxes if box[1] >= region_top - 2 and box[3] <= caption_top + 2 and box[3] > box[1]]
+    if not inside:
+        return (0.0, region_top, page.rect.width, caption_top)
+    margin = 4.0
+    return (max(0.0, min(b[0] for b in inside) - margin), max(0.0, min(b[1] for b in inside) - margin),
+            min(page.rect.width, max(b[2] for b in inside) + margin), min(caption_top, max(b[3] for b in inside) + margin))
+
+
+def _table_rows(lines: list, start: int) -> list:
+    """
+    Rows of the table starting at line `start`: the header fixes the column
+    count, and the table ends at the first line that is not a row
+    (a footnote, a source line or body text).
+    """
+    rows = []
+    columns = None
+    for line in lines[start:]:
+        cells = line["cells"]
+        if columns is None:
+            if len(cells) < 2:
+                break
+            columns = len(cells)
+        elif len(cells) < 2 or len(cells) > columns or _CAPTION_RE.match(cells[0]):
+            break
+        rows.append(cells + [""] * (columns - len(cells)))
+    return rows
+
+
+def to_markdown(rows: list) -> str:
+    lines = ["| " + " | ".join(rows[0]) + " |", "|" + "---|" * len(rows[0])]
+    lines += ["| " + " | ".join(row) + " |" for row in rows[1:]]
+    return "\n".join(lines)
+
+
+def select(scanned: dict, max_figures: int = 2, min_score: int = 2) -> tuple:
+    """The diagram figures and model tables worth sending: (figures, tables)."""
+    figures = sorted((f for f in scanned["figures"] if f["score"] >= min_score), key=lambda f: -f["score"])
+    tables = [t for t in scanned["tables"] if t["score"] >= min_score and t["rows"]]
+    return sorted(figures[:max_figures], key=lambda f: (f["page"], f["clip"][1])), tables
+
+
+def duplicate_symbols(tables: list) -> list:
+    """Symbols listed more than once in the Parameter/Value tables among `tables`."""
+    counts = collections.Counter()
+    for table in tables:
+        header = [cell.lower() for cell in table["rows"][0]]
+        if not header or "parameter" not in header[0] or not any("value" in cell for cell in header):
+            continue
+        counts.update(row[0].strip() for row in table["rows"][1:]
+                      if re.fullmatch(user_input.SYMBOL, row[0].strip()))
+    return sorted(symbol for symbol, count in counts.items() if count > 1)
+
+
+def _render(task) -> bytes:
+    """Rasterizes one clip of one page to PNG (runs in a worker process)."""
+    pdf_path, page_number, clip, dpi = task
+    pymupdf = _pymupdf()
+    with pymupdf.open(pdf_path) as document:
+        pixmap = document[page_number].get_pixmap(dpi=dpi, clip=pymupdf.Rect(*clip))
+        return pixmap.tobytes("png")
+
+
+def render_all(tasks: list, workers: int = None) -> list:
+    """PNG bytes for every (pdf_path, page, clip, dpi) task, rendered in a process pool."""
+    if len(tasks) <= 1 or workers == 1:
+        return [_render(task) for task in tasks]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_render, tasks))
+
+
+def stack(images: list) -> bytes:
+    """Stacks PNG images vertically on white into one PNG."""
+    if len(images) == 1:
+        return images[0]
+    opened = [PIL.Image.open(io.BytesIO(data)).convert("RGB") for data in images]
+    canvas = PIL.Image.new("RGB", (max(im.width for im in opened), sum(im.height for im in opened)), "white")
+    top = 0
+    for im in opened:
+        canvas.paste(im, (0, top))
+        top += im.height
+    buffer = io.BytesIO()
+    canvas.save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue()
+
+
+def build_input(pdf_path: str, figures: list, tables: list) -> str:
+    """User input text for the pipeline: the selected tables as markdown plus the figure captions."""
+    parts = [f"Extracted from {os.path.basename(pdf_path)}."]
+    for table in tables:
+        parts.append(f"{table['label']}. {table['caption']}\n\n{to_markdown(table['rows'])}")
+    for figure in figures:
+        parts.append(f"The image shows {figure['label']}: {figure['caption']}")
+    return "\n\n".join(parts)
+
+
+def ingest_many(pdf_paths: list, max_figures: int = 2, min_score: int = 2, dpi: int = 150, workers: int = None,
+                cache_dir: str = DEFAULT_CACHE_DIR) -> list:
+    """
+    Scans each PDF and rasterizes the selected figures of all of them in
+    one process pool. Returns one dict per PDF with "pdf", "image"
+    (path of the stacked PNG, None without a diagram), "user_input",
+    "figures", "tables", "duplicate_symbols", "pdf_bytes" and "image_bytes".
+    """
+    results = []
+    tasks = []
+    for pdf_path in pdf_paths:
+        figures, tables = select(scan(pdf_path), max_figures, min_score)
+        results.append({"pdf": pdf_path, "figures": figures, "tables": tables,
+                        "user_input": build_input(pdf_path, figures, tables),
+                        "duplicate_symbols": duplicate_symbols(tables),
+                        "pdf_bytes": os.path.getsize(pdf_path), "image": None, "image_bytes": 0})
+        tasks += [(pdf_path, figure["page"], figure["clip"], dpi) for figure in figures]
+
+    rendered = iter(render_all(tasks, workers))
+    os.makedirs(cache_dir, exist_ok=True)
+    for result in results:
+        images = [next(rendered) for _ in result["figures"]]
+        if not images:
+            continue
+        image = stack(images)
+        with open(result["pdf"], "rb") as f:
+            digest = hashlib.sha256(f.read())
+        digest.update(json.dumps([(fig["page"], fig["clip"]) for fig in result["figures"]] + [dpi]).encode("utf-8"))
+        result["image"] = os.path.join(cache_dir, f"{digest.hexdigest()[:16]}.png")
+        result["image_bytes"] = len(image)
+        with open(result["image"], "wb") as f:
+            f.write(image)
+    return results
+
+
+def ingest(pdf_path: str, **options) -> dict:
+    """ingest_many for a single PDF."""
+    return ingest_many([pdf_path], **options)[0]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate .serimodel files from papers, sending only their "
+                                                 "diagram figures and model tables.")
+    parser.add_argument("pdfs", nargs="+", help="PDF files")
+    parser.add_argument("--spec", default="metamodel.txt", help="language specification passed to the pipeline")
+    parser.add_argument("--out-dir", default=".", help="outputs are written to OUT_DIR/prompt_sample/<pdf>.txt")
+    parser.add_argument("--scan-only", action="store_true", help="print what would be sent and exit")
+    parser.add_argument("--max-figures", type=int, default=2)
+    parser.add_argument("--min-score", type=int, default=2, help="caption relevance needed to select a figure or table")
+    parser.add_argument("--dpi", type=int, default=150)
+    parser.add_argument("--workers", type=int, default=None, help="processes used for rasterizing")
+    parser.add_argument("--concurrency", type=int, default=4, help="papers run through the pipeline at once")
+    parser.add_argument("--fake", type=float, metavar="LATENCY", default=None,
+                        help="use a local fake backend with this per-call latency instead of Gemini")
+    parser.add_argument("--preprocess", action="store_true", help="crop, downscale and re-encode images before upload")
+    parser.add_argument("--local-rates", action="store_true", help="compute rates locally, LLM2 only as fallback")
+    args = parser.parse_args()
+
+    try:
+        ingested = ingest_many(args.pdfs, args.max_figures, args.min_score, args.dpi, args.workers)
+    except ImportError as err:
+        raise SystemExit(str(err))
+    skipped = [item["pdf"] for item in ingested if not item["image"]]
+    for item in ingested:
+        if not item["image"]:
+            print(f"{item['pdf']}: no figure caption scored {args.min_score} or more as a model diagram; "
+                  f"skipped ({len(item['tables'])} table(s) found)")
+            continue
+        print(f"{item['pdf']}: {len(item['figures'])} figure(s) "
+              f"{[(f['label'], f['page'] + 1) for f in item['figures']]}, {len(item['tables'])} table(s) "
+              f"{[(t['label'], t['page'] + 1) for t in item['tables']]}; "
+              f"{item['pdf_bytes']:,} byte PDF -> {item['image_bytes']:,} byte image")
+        if item["duplicate_symbols"]:
+            print(f"{item['pdf']}: warning: parameter symbol(s) {', '.join(item['duplicate_symbols'])} appear more "
+                  f"than once (Greek letters extracted as Latin?)"
+                  + ("; rates are left to the LLM for this paper." if args.local_rates else "."))
+    if args.scan_only:
+        for item in ingested:
+            print(f"\n{item['image']}\n{item['user_input']}")
+        raise SystemExit
+
+    import backends
+    import batch
+
+    jobs = [{"image": item["image"], "user_input": item["user_input"], "spec": args.spec,
+             "output": os.path.join(args.out_dir, os.path.splitext(os.path.basename(item["pdf"]))[0] + ".txt"),
+             "options": {"local_rates": False} if item["duplicate_symbols"] else {}}
+            for item in ingested if item["image"]]
+    if jobs:
+        backend = backends.FakeBackend(latency=args.fake) if args.fake is not None else None
+        batch.print_report(batch.run_batch(jobs, args.concurrency, backend=backend, local_rates=args.local_rates,
+                                           preprocess_options={} if args.preprocess else None))
+    if skipped:
+        print(f"\nSkipped {len(skipped)} paper(s) without a model diagram (lower --min-score or crop the "
+              f"figure and run main/batch with it): {', '.join(skipped)}")
+        raise SystemExit(1)
@@ -0,0 +1,142 @@
+"""
+Per-stage instrumentation for generate_seirmodel_from_image.
+
+A Recorder times each stage of a run (spec read, image load, prompt
+assembly, LLM1, local rates, LLM2, output write) and records whatever the
+stage reports about itself: prompt characters and estimated tokens, image
+bytes, response size, retries, cache hits. Every finished stage becomes one
+event dict that is appended to a JSONL file and/or passed to hook callables,
+and summarize() turns the events of a batch into per-stage p50/p95 latency.
+"""
+import argparse
+import json
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token for English prompts)."""
+    return (len(text) + 3) // 4
+
+
+class Recorder:
+    """
+    Collects stage events. `jsonl_path` appends each event as a JSON line;
+    each callable in `hooks` is called with the event dict.
+    """
+
+    def __init__(self, jsonl_path: str = None, hooks=()):
+        self.jsonl_path = jsonl_path
+        self.hooks = list(hooks)
+        self.events = []
+        self._lock = threading.Lock()
+
+    def new_run(self, **fields) -> "Run":
+        return Run(self, fields)
+
+    def emit(self, event: dict):
+        with self._lock:
+            self.events.append(event)
+            if self.jsonl_path:
+                with open(self.jsonl_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(event, ensure_ascii=False) + "\n")
+        for hook in self.hooks:
+            hook(event)
+
+
+class Run:
+    """One pipeline run; stage() spans share its run_id and fields."""
+
+    def __init__(self, recorder, fields: dict):
+        self.recorder = recorder
+        self.run_id = uuid.uuid4().hex
+        self.fields = fields
+
+    @contextmanager
+    def stage(self, name: str, **fields):
+        """
+        Times the enclosed block as stage `name`. Yields a dict the block can
+        add measurements to; an exception is recorded as the stage's error.
+        """
+        span = dict(fields)
+        start = time.perf_counter()
+        try:
+            yield span
+        except BaseException as err:
+            span["error"] = f"{type(err).__name__}: {err}"
+            raise
+        finally:
+            if self.recorder is not None:
+                self.recorder.emit({
+                    "run_id": self.run_id,
+                    **self.fields,
+                    "stage": name,
+                    "seconds": time.perf_counter() - start,
+                    "timestamp": time.time(),
+                    **span,
+                })
+
+
+# Used when no recorder is passed; stages still run but nothing is kept.
+NULL_RUN = Run(None, {})
+
+
+def load_jsonl(path: str) -> list:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def percentile(values: list, q: float) -> float:
+    """Linear-interpolated percentile, q in [0, 100]."""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize(events: list) -> dict:
+    """
+    Per-stage summary over a batch: count, p50/p95/mean seconds and the mean
+    of every other numeric field (prompt_tokens, image_bytes, ...).
+    """
+    by_stage = {}
+    for event in events:
+        by_stage.setdefault(event["stage"], []).append(event)
+
+    skip = {"seconds", "timestamp"}
+    summary = {}
+    for stage, stage_events in by_stage.items():
+        seconds = [e["seconds"] for e in stage_events]
+        numeric = {}
+        for event in stage_events:
+            for key, value in event.items():
+                if key not in skip and isinstance(value, (int, float)) and not isinstance(value, bool):
+                    numeric.setdefault(key, []).append(value)
+        summary[stage] = {
+            "count": len(stage_events),
+            "errors": sum("error" in e for e in stage_events),
+            "p50": percentile(seconds, 50),
+            "p95": percentile(seconds, 95),
+            "mean": sum(seconds) / len(seconds),
+            "means": {key: sum(values) / len(values) for key, values in numeric.items()},
+        }
+    return summary
+
+
+def print_summary(summary: dict):
+    print(f"{'stage':<16}{'count':>7}{'errors':>8}{'p50 s':>10}{'p95 s':>10}  mean fields")
+    for stage, row in summary.items():
+        means = ", ".join(f"{key}={value:,.0f}" for key, value in sorted(row["means"].items()))
+        print(f"{stage:<16}{row['count']:>7}{row['errors']:>8}{row['p50']:>10.3f}{row['p95']:>10.3f}  {means}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize per-stage timings from an instrumentation JSONL file.")
+    parser.add_argument("jsonl", help="file written by a Recorder")
+    args = parser.parse_args()
+    print_summary(summarize(load_jsonl(args.jsonl)))
@@ -0,0 +1,145 @@
+"""
+Lean LLM2 output: rate values as JSON instead of an annotated model.
+
+LLM2_PROMPT has LLM2 write a step-by-step comment above every
+outgoingFlows and return the whole model, so its output grows with the
+model (the HIV model has 30+ flows) and output tokens dominate the stage's
+time and cost. In lean mode LLM2 gets a numbered list of the flows still
+holding `[[rate_missing]]` and answers with one JSON object mapping flow
+number to rate, constrained by response_schema() where the backend
+supports it. The values are merged into the LLM1 XML locally
+(rate_engine.apply_rates).
+
+Values that are missing or not a finite, non-negative number fail
+validation; those flows keep their placeholder and go through the regular
+LLM2 prompt, reasoning included. main.explain_rates asks for that
+reasoning on demand for any flows.
+
+The CLI estimates the output tokens lean mode saves on stored transcripts.
+"""
+import argparse
+import json
+import math
+import re
+
+import instrumentation
+import rate_engine
+import serimodel
+
+
+_FENCE_RE = re.compile(r"^```(?:json)?\s*|\s*```$")
+
+
+def pending_flows(model_xml: str) -> list:
+    """The flows holding the placeholder as (number, source name, target name, description), numbered in document order."""
+    compartments = serimodel.parse_compartments(model_xml)
+    names = [" ".join(filter(None, (c["PrimaryName"], c["SecondaryName"]))) for c in compartments]
+    pending = []
+    number = 0
+    for source, compartment in enumerate(compartments):
+        for flow in compartment["flows"]:
+            if flow["rate"] == serimodel.RATE_PLACEHOLDER:
+                target = names[flow["target"]] if flow["target"] is not None and flow["target"] < len(names) else "?"
+                pending.append((number, names[source], target, flow["description"] or ""))
+            number += 1
+    return pending
+
+
+def flow_listing(model_xml: str) -> str:
+    """The pending flows as the numbered list LLM2 answers against."""
+    return "\n".join(f"{number}: {source} → {target}" + (f" ({description})" if description else "")
+                     for number, source, target, description in pending_flows(model_xml))
+
+
+def response_schema(numbers: list) -> dict:
+    """JSON schema of the lean response: one nullable number per flow number."""
+    return {
+        "type": "OBJECT",
+        "properties": {str(number): {"type": "NUMBER", "nullable": True} for number in numbers},
+        "required": [str(number) for number in numbers],
+    }
+
+
+def parse_response(text: str, numbers: list) -> tuple:
+    """
+    Reads a lean response for the flows `numbers`. Returns (rates, failed):
+    rates maps flow number to rate text for every valid value, failed lists
+    the numbers whose value is missing, null, not a number, negative or not
+    finite. A response that is not a JSON object fails every flow.
+    """
+    try:
+        data = json.loads(_FENCE_RE.sub("", text.strip()))
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
+        return {}, list(numbers)
+
+    rates, failed = {}, []
+    for number in numbers:
+        value = data.get(str(number))
+        if isinstance(value, str):
+            try:
+                value = float(value)
+            except ValueError:
+                value = None
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value) or value < 0:
+            failed.append(number)
+        else:
+            rates[number] = repr(float(value))
+    return rates, failed
+
+
+def merge(model_xml: str, rates: dict) -> str:
+    """The model with the rates of `rates` (flow number → rate text) in place of their placeholders."""
+    flows = sum(len(c["flows"]) for c in serimodel.parse_compartments(model_xml))
+    return rate_engine.apply_rates(serimodel.extract_xml(model_xml), [rates.get(n) for n in range(flows)])
+
+
+def estimate_savings(transcript: str) -> dict:
+    """
+    Estimated output tokens of a stored transcript's final response against
+    the lean response carrying the same rates.
+    """
+    import benchmark
+
+    compartments = serimodel.parse_compartments(benchmark.response_model(transcript))
+    rates = [flow["rate"] for c in compartments for flow in c["flows"]]
+    lean = json.dumps({str(n): _number(rate) for n, rate in enumerate(rates)}, separators=(",", ":"))
+    return {"flows": len(rates), "full": instrumentation.estimate_tokens(benchmark.response_section(transcript)),
+            "lean": instrumentation.estimate_tokens(lean)}
+
+
+def _number(text: str):
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+
+if __name__ == "__main__":
+    import glob
+
+    parser = argparse.ArgumentParser(description="Estimate the LLM2 output tokens lean mode saves on transcripts.")
+    parser.add_argument("transcripts", nargs="*", help="transcripts (default: hivModels, covidModels, simpleModel)")
+    args = parser.parse_args()
+
+    paths = args.transcripts or sorted(glob.glob("hivModels/**/*.txt", recursive=True)
+                                       + glob.glob("covidModels/**/*.txt", recursive=True)
+                                       + glob.glob("simpleModel/**/*.txt", recursive=True))
+    print(f"{'transcript':<72}{'flows':>6}{'LLM2':>7}{'lean':>6}{'saved':>7}")
+    totals = [0, 0]
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            text = f.read()
+        try:
+            tokens = estimate_savings(text)
+        except Exception:
+            continue
+        if not tokens["flows"]:
+            continue
+        totals[0] += tokens["full"]
+        totals[1] += tokens["lean"]
+        print(f"{path:<72}{tokens['flows']:>6}{tokens['full']:>7}{tokens['lean']:>6}"
+              f"{1 - tokens['lean'] / tokens['full']:>7.0%}")
+    if totals[0]:
+        print(f"\nTotal: {totals[0]:,} -> {totals[1]:,} output tokens ({1 - totals[1] / totals[0]:.0%} saved)")
@@ -0,0 +1,179 @@
+"""
+Content-addressed on-disk cache for LLM stage responses.
+
+Each entry is keyed on a SHA-256 over everything that affects a stage's
+output (stage name, model name, image bytes, full prompt text), so a
+re-run only calls the model for stages whose inputs actually changed.
+Entries live as small JSON files under `cache_dir/<first two hex chars>/`.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".llm_cache")
+
+# Eviction trims to this fraction of max_bytes, so a full cache walks its
+# directory once per many writes rather than on every one.
+EVICT_TO = 0.9
+
+
+class ResponseCache:
+    """
+    Persistent response cache with age- and size-based eviction.
+
+    - max_age_seconds: entries older than this are treated as misses and deleted.
+    - max_bytes: after a write, the least recently used entries are removed
+      until the cache is under EVICT_TO * max_bytes. The cache keeps a running total of its size
+      (taken from one directory walk on the first write), so a write only
+      walks the directory when that total goes over max_bytes.
+    - enabled=False bypasses the cache entirely (no reads, no writes).
+    - refresh=True skips reads but still writes, so stale entries get replaced.
+    """
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, max_bytes: int = 200 * 1024 * 1024,
+                 max_age_seconds: float = None, enabled: bool = True, refresh: bool = False):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.enabled = enabled
+        self.refresh = refresh
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self._size = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(*parts) -> str:
+        """Hashes the given str/bytes parts into a cache key."""
+        digest = hashlib.sha256()
+        for part in parts:
+            data = part if isinstance(part, bytes) else str(part).encode("utf-8")
+            # Length-prefix every part so ("ab", "c") and ("a", "bc") differ.
+            digest.update(len(data).to_bytes(8, "big"))
+            digest.update(data)
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, key: str):
+        """Returns the cached text for `key`, or None on a miss."""
+        if not self.enabled or self.refresh:
+            self._count("misses")
+            return None
+
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self._count("misses")
+            return None
+
+        if self.max_age_seconds is not None and time.time() - entry["created"] > self.max_age_seconds:
+            self._remove(path)
+            self._count("misses")
+            return None
+
+        # Bump the access time (mtime stays the creation time used for
+        # max_age_seconds) so size-based eviction is least-recently-used.
+        os.utime(path, (time.time(), os.stat(path).st_mtime))
+        self._count("hits")
+        return entry["text"]
+
+    def put(self, key: str, text: str, **metadata):
+        if not self.enabled:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        entry = {"created": time.time(), "text": text, **metadata}
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        size = os.path.getsize(tmp_path)
+        try:
+            replaced = os.path.getsize(path)
+        except FileNotFoundError:
+            replaced = 0
+        os.replace(tmp_path, path)
+        self._count("writes")
+        if self._size is None:
+            self.evict()
+            return
+        with self._lock:
+            self._size += size - replaced
+            over = self.max_bytes is not None and self._size > self.max_bytes
+        if over:
+            self.evict()
+
+    def evict(self):
+        """
+        Drops expired entries, then, when over max_bytes, the least recently
+        used ones until under EVICT_TO * max_bytes, and resets the running
+        size total from the directory.
+        """
+        entries = []
+        total = 0
+        now = time.time()
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if self.max_age_seconds is not None and now - stat.st_mtime > self.max_age_seconds:
+                    self._remove(path)
+                    continue
+                entries.append((stat.st_atime, stat.st_size, path))
+                total += stat.st_size
+
+        if self.max_bytes is not None and total > self.max_bytes:
+            for _, size, path in sorted(entries):
+                self._remove(path, size)
+                total -= size
+                if total <= self.max_bytes * EVICT_TO:
+                    break
+        with self._lock:
+            self._size = total
+
+    def clear(self):
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith(".json"):
+                    self._remove(os.path.join(root, name))
+        with self._lock:
+            self._size = 0
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "evictions": self.evictions,
+        }
+
+    def _remove(self, path: str, size: int = None):
+        """Deletes an entry. Without `size` it is subtracted from the running total here."""
+        try:
+            if size is None:
+                removed = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        self._count("evictions")
+        if size is None:
+            with self._lock:
+                if self._size is not None:
+                    self._size -= removed
+
+    def _count(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
@@ -1,22 +1,42 @@
+import io
 import os
+import threading
 import time
-from dotenv import load_dotenv
-import google.generativeai as genai
 import PIL.Image
 
+import backends
+import instrumentation
+import lean_rates
+import partition
+import preprocess
+import prompts
+import rate_engine
+import resilience
+import serimodel
+import streaming
+import tabular
 
 
+MODEL_NAME = backends.DEFAULT_MODEL_NAME
 
-try:
-    # Load the API key from environment variables
-    env_path = os.path.join(os.path.dirname(__file__), ".env")
-    load_dotenv(env_path)
-    genai.configure(api_key=os.environ["GOOGLE_API_KEY"])
-except KeyError:
-    print("FATAL ERROR: 'GOOGLE_API_KEY' environment variable not set.")
-    print("Please set it before running the script.")
-    exit()
-model = genai.GenerativeModel('gemini-1.5-flash-latest')
+_default_backend = None
+_default_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """
+    Returns the shared Gemini backend, creating it on first use. Calls go
+    through resilience.ResilientBackend, so they time out and are retried
+    with backoff on rate-limit and server errors. The SDK is only imported
+    and configured when the first request is made, so importing this module
+    has no side effects.
+    """
+    global _default_backend
+    with _default_backend_lock:
+        if _default_backend is None:
+            _default_backend = resilience.ResilientBackend(
+                backends.GeminiBackend(MODEL_NAME, timeout=resilience.DEFAULT_TIMEOUT))
+        return _default_backend
 
 
 
@@ -25,18 +45,77 @@ model = genai.GenerativeModel('gemini-1.5-flash-latest')
 
 
 
-def generate_seirmodel_from_image(image_path: str, user_input: str, langSpecs_path: str, output_fileName: str) -> str:
+def generate_seirmodel_from_image(image_path: str, user_input: str, langSpecs_path: str, output_fileName: str, backend=None, cache=None, stream_llm1: bool = False,
+                                  local_rates: bool = False, preprocess_options: dict = None, recorder=None,
+                                  run_store=None, partition_size: int = None, fast_path: bool = True,
+                                  incremental: bool = True, compact_prompts: bool = False, lean: bool = False) -> str:
     """
     Generates a response from a multimodal prompt including text and an image,
     then saves the full interaction to a file.
+
+    `backend` overrides the default Gemini backend (see backends.py).
+    `cache` is an optional llm_cache.ResponseCache; stages whose inputs are
+    unchanged since a previous run are served from it instead of the model.
+    With `stream_llm1` the LLM1 response is streamed and validated against
+    metamodel.txt as it arrives, and regenerated as soon as it goes invalid
+    (see streaming.py).
+    With `local_rates` the `[[rate_missing]]` placeholders are computed
+    locally from the user input (see rate_engine.py); LLM2 is only called
+    for flows the engine cannot resolve, and only sees those placeholders.
+    `preprocess_options` (a dict, {} for the defaults) crops, downscales and
+    re-encodes the image before upload (see preprocess.py).
+    `recorder` (an instrumentation.Recorder) receives timing and size
+    measurements for every stage.
+    `run_store` (a run_store.RunStore) indexes the run's inputs and outputs;
+    if it already holds a run with identical inputs, that result is reused
+    and no model call is made.
+    With `partition_size` the model is generated in partitions of at most
+    that many compartments (one per stratum where the input has a Subgroup
+    column), concurrently, and stitched together; LLM2 only sees the
+    partitions that still need rates (see partition.py). Partition
+    responses are not streamed.
+    With `fast_path` (the default), inputs that already list every
+    compartment and flow in tables or as a JSON literal are turned into the
+    model structure locally and LLM1 is skipped (see tabular.py); LLM2 is
+    skipped too when those tables give every rate as a number.
+    With `incremental` (the default) and a `run_store`, an input that only
+    changes numbers (parameter or population values) relative to a stored
+    run with the same image, spec and structure reuses that run's model:
+    LLM1 is skipped and only the flows whose rates depend on a changed
+    value are recomputed (see rate_engine.affected_flows).
+    Every run reports the model stages it skipped.
+    With `compact_prompts` the metamodel is sent compactly and trimmed to
+    the compartment types the input mentions, LLM1 gets the input without
+    its parameter blocks and LLM2 without the compartment table (see
+    prompts.py); each call reports the input tokens saved.
+    With `lean` LLM2 returns only the missing rates, as JSON keyed by flow
+    number, which are merged into the LLM1 XML locally; flows whose value
+    fails validation go through the regular LLM2 prompt, with its reasoning
+    (see lean_rates.py). explain_rates asks for the reasoning on demand.
     """
+    start = time.perf_counter()
+    backend = backend or get_backend()
+    if recorder is None and run_store is not None:
+        recorder = instrumentation.Recorder()
+    run = recorder.new_run(output=output_fileName, model=backend.model_name) if recorder else instrumentation.NULL_RUN
     try:
         # Load the language specifications
-        with open(langSpecs_path, "r", encoding="utf-8") as f:
-            lang_specs = f.read()
+        with run.stage("spec_read") as span:
+            lang_specs = read_spec(langSpecs_path)
+            span["chars"] = len(lang_specs)
         
         # Load the image using the modern PIL library
-        img = PIL.Image.open(image_path)
+        with run.stage("image_load") as span:
+            if preprocess_options is not None:
+                image_bytes, report = preprocess.preprocess_image(image_path, preprocess_options)
+                img = PIL.Image.open(io.BytesIO(image_bytes))
+                span["original_bytes"] = report["original_bytes"]
+                print(f"Image preprocessed: {report['original_bytes']:,} -> {report['processed_bytes']:,} bytes.")
+            else:
+                img = PIL.Image.open(image_path)
+                with open(image_path, "rb") as f:
+                    image_bytes = f.read()
+            span["image_bytes"] = len(image_bytes)
 
     except FileNotFoundError as err:
         print(f"Error: A required file was not found - {err}")
@@ -47,37 +126,178 @@ def generate_seirmodel_from_image(image_path: str, user_input: str, langSpecs_pa
 
 
     print(f"Image loaded successfully from '{image_path}'.")
+
+    prior = None
+    if run_store is not None:
+        run_options = {"local_rates": local_rates, "fast_path": fast_path}
+        if partition_size:
+            run_options["partition_size"] = partition_size
+        if compact_prompts:
+            run_options["compact_prompts"] = True
+        if lean:
+            run_options["lean"] = True
+        input_key = run_store.input_key(image_bytes, user_input, lang_specs, backend.model_name,
+                                        (LLM1_PROMPT, LLM2_PROMPT) + ((LLM2_LEAN_PROMPT,) if lean else ()),
+                                        run_options)
+        previous = run_store.find(input_key)
+        transcript = run_store.get_text(previous["transcript_hash"]) if previous is not None else None
+        if transcript is not None:
+            print(f"Identical inputs already generated in run {previous['id']}; reusing its result.")
+            return _write_output(output_fileName, transcript, run, f" (reused run {previous['id']})")
+        if previous is not None:
+            print(f"Run {previous['id']} had identical inputs but its transcript is missing; running again.")
+        structure_key = run_store.structure_key(image_bytes, user_input, lang_specs, backend.model_name,
+                                                (LLM1_PROMPT,), {"partition_size": partition_size})
+        prior = run_store.find_structure(structure_key) if incremental else None
+
     # --- Construct the final prompt text ---
     separator = "\n" + "*" * 80 + "\n"
 
 
-    llm1_input = (
-        f"{separator}"
-        f"PROMPT: \n{LLM1_PROMPT}\n"
-        f"{separator}"
-        f"METAMODEL: \n{lang_specs}\n"
-        f"{separator}"
-        f"Data:\n{user_input}"
-    )
-
-    llm1 = model.generate_content([
-        img,                 # The image object
-        llm1_input.strip()  # The text part of the prompt
-    ]).text.strip()
+    structure = None
+    partitions = None
+    reused_model = None
+    skipped = []
+    if prior is not None:
+        with run.stage("incremental", reused_run=prior["id"]) as span:
+            try:
+                # Every stored blob is read before anything is reused, so a
+                # missing one falls back to a full run.
+                prior_xml = run_store.get_text(prior["xml_hash"])
+                prior_input = run_store.get_text(prior["user_input_hash"])
+                prior_llm1 = run_store.get_text(prior["llm1_hash"])
+                if prior_xml is None or prior_input is None or prior_llm1 is None:
+                    raise ValueError("its stored outputs are incomplete")
+                compartments = serimodel.read_compartments(prior_xml)
+                if any("population" in attributes for attributes, _ in compartments):
+                    raise ValueError("its model holds population values")
+                flags = rate_engine.affected_flows(prior_xml, prior_input, user_input)
+                flows = [flow for _, compartment_flows in compartments for flow in compartment_flows]
+                for flow, affected in zip(flows, flags):
+                    if affected:
+                        flow["rate"] = serimodel.RATE_PLACEHOLDER
+                reused_model, llm1 = serimodel.render(compartments), prior_llm1
+                span["flows"] = len(flows)
+                span["affected_flows"] = sum(flags)
+                print(f"Structure reused from run {prior['id']}; {sum(flags)} of {len(flows)} rate(s) to recompute.")
+            except Exception as err:
+                span["error"] = str(err)
+                reused_model = None
+                print(f"Could not reuse the structure of run {prior['id']}: {err}")
+
+    if reused_model is None and fast_path:
+        with run.stage("structure") as span:
+            structure = tabular.build_skeleton(user_input)
+            span["fast_path"] = structure is not None
+
+    if reused_model is not None:
+        skipped.append("llm1")
+    elif structure is not None:
+        llm1 = structure
+        skipped.append("llm1")
+        print("Model structure read from the tabular input; LLM1 skipped.")
+    else:
+        with run.stage("prompt_build") as span:
+            spec_context, llm1_data = lang_specs, user_input
+            if compact_prompts:
+                spec_context = prompts.compact_spec(lang_specs, user_input)
+                llm1_data = prompts.structure_input(user_input)
+                span["saved_tokens"] = _report_savings("LLM1", lang_specs + user_input, spec_context + llm1_data)
+            llm1_input = (
+                f"{separator}"
+                f"PROMPT: \n{LLM1_PROMPT}\n"
+                f"{separator}"
+                f"METAMODEL: \n{spec_context}\n"
+                f"{separator}"
+                f"Data:\n{llm1_data}"
+            )
+            span["chars"] = len(llm1_input)
+
+        with run.stage("llm1", prompt_chars=len(llm1_input.strip()), prompt_tokens=instrumentation.estimate_tokens(llm1_input.strip()),
+                       image_bytes=len(image_bytes), streamed=stream_llm1) as span:
+            if partition_size:
+                def generate_part(text, stage):
+                    with run.stage(stage, prompt_chars=len(text)) as part_span:
+                        return _generate(backend, [img, text], cache, stage, image_bytes, span=part_span)
+
+                llm1, partitions = partition.generate_structure(
+                    generate_part, lambda extra: f"{llm1_input.strip()}\n{separator}{extra.strip()}", user_input,
+                    partition_size,
+                )
+                span["partitions"] = len(partitions)
+            else:
+                llm1 = _generate(backend, [
+                    img,                 # The image object
+                    llm1_input.strip()  # The text part of the prompt
+                ], cache, "llm1", image_bytes, stream=stream_llm1, span=span)
+            span["response_chars"] = len(llm1)
+            span["response_tokens"] = instrumentation.estimate_tokens(llm1)
+
+
+    llm2_model = reused_model if reused_model is not None else llm1
+    unresolved = None
+    if local_rates:
+        with run.stage("local_rates") as span:
+            try:
+                llm2_model, unresolved = rate_engine.fill_rates(llm2_model, user_input)
+                span["unresolved"] = len(unresolved)
+                print(f"Rates computed locally; {len(unresolved)} flow(s) left for LLM2.")
+            except Exception as err:
+                span["error"] = str(err)
+                print(f"Local rate engine failed, falling back to LLM2: {err}")
+                unresolved = None
+
+    def build_llm2_input(model_xml, span=None, lean_input=False):
+        llm2_data = user_input
+        if compact_prompts:
+            llm2_data = prompts.rates_input(user_input, model_xml)
+            saved = _report_savings("LLM2", user_input, llm2_data)
+            if span is not None:
+                span["saved_tokens"] = saved
+        if lean_input:
+            return (
+                f"{separator}"
+                f"PROMPT:\n{LLM2_LEAN_PROMPT.strip()}\n"
+                f"{separator}"
+                f"USER INPUT:\n{llm2_data.strip()}\n"
+                f"{separator}"
+                f"FLOWS:\n{lean_rates.flow_listing(model_xml)}\n"
+                f"{separator}"
+            )
+        return (
+            f"{separator}"
+            f"PROMPT:\n{LLM2_PROMPT.strip()}\n"
+            f"{separator}"
+            f"USER INPUT:\n{llm2_data.strip()}\n"
+            f"{separator}"
+            f"STRUCTURALLY CORRECT SEIRMODEL FILE:\n{model_xml.strip()}\n"
+            f"{separator}"
+        )
 
 
-    llm2_input = (
-        f"{separator}"
-        f"PROMPT:\n{LLM2_PROMPT.strip()}\n"
-        f"{separator}"
-        f"USER INPUT:\n{user_input.strip()}\n"
-        f"{separator}"
-        f"STRUCTURALLY CORRECT SEIRMODEL FILE:\n{llm1.strip()}\n"
-        f"{separator}"
-    )
-
     # --- Call the modern API with a list of parts (image and text) ---
-    llm2 = model.generate_content(llm2_input.strip()).text.strip()
+    locally_built = structure is not None or reused_model is not None
+    if unresolved == [] or (locally_built and serimodel.RATE_PLACEHOLDER not in llm2_model):
+        llm2 = llm2_model
+        skipped.append("llm2")
+    elif lean:
+        with run.stage("llm2", lean=True) as span:
+            llm2 = _fill_rates_lean(backend, llm2_model, build_llm2_input, cache, span)
+    elif partitions:
+        with run.stage("llm2", partitions=len(partitions)) as span:
+            def fill_part(fragment):
+                with run.stage("llm2_partition") as part_span:
+                    return _generate(backend, build_llm2_input(fragment).strip(), cache, "llm2", span=part_span)
+
+            llm2, span["partitions_sent"] = partition.fill_rates(fill_part, llm2_model, partitions)
+    else:
+        with run.stage("llm2") as span:
+            llm2_input = build_llm2_input(llm2_model, span)
+            span["prompt_chars"] = len(llm2_input.strip())
+            span["prompt_tokens"] = instrumentation.estimate_tokens(llm2_input.strip())
+            llm2 = _generate(backend, llm2_input.strip(), cache, "llm2", span=span)
+            span["response_chars"] = len(llm2)
+            span["response_tokens"] = instrumentation.estimate_tokens(llm2)
     
     # --- Format and save the output ---
     output_content =(
@@ -87,26 +307,180 @@ def generate_seirmodel_from_image(image_path: str, user_input: str, langSpecs_pa
         f"{separator}"
         f"LLM1 RESPONSE:\n {llm1}"
         f"{separator}"
-        f"LLM2 PROMPT:\n{LLM2_PROMPT}"
+        f"LLM2 PROMPT:\n{LLM2_LEAN_PROMPT if lean else LLM2_PROMPT}"
         f"{separator}"
         f"USER INPUT:\n{user_input}"
         f"{separator}"
         f"LLM2'S RESPONSE:\n{llm2}"
     )
 
+    print(f"Skipped stages: {', '.join(skipped) or 'none'}")
+    result = _write_output(output_fileName, output_content, run, f" (skipped {', '.join(skipped)})" if skipped else "")
+
+    if run_store is not None and result.startswith("SEIR model successfully"):
+        stage_seconds = {e["stage"]: e["seconds"] for e in recorder.events if e["run_id"] == run.run_id}
+        run_store.record(input_key, image_bytes, user_input, lang_specs, backend.model_name, run_options,
+                         llm1, llm2, serimodel.extract_xml(llm2), output_content,
+                         time.perf_counter() - start, stage_seconds, structure_key)
+    return result
+
+
+def _fill_rates_lean(backend, model_xml: str, build_llm2_input, cache, span: dict) -> str:
+    """
+    The lean LLM2 stage: one JSON response with the missing rates, merged
+    locally. Flows it leaves invalid go through the regular LLM2 prompt.
+    """
+    numbers = [flow[0] for flow in lean_rates.pending_flows(model_xml)]
+    lean_input = build_llm2_input(model_xml, span, lean_input=True).strip()
+    span["prompt_chars"] = len(lean_input)
+    span["prompt_tokens"] = instrumentation.estimate_tokens(lean_input)
+    response = _generate(backend, lean_input, cache, "llm2_lean", span=span,
+                         response_schema=lean_rates.response_schema(numbers))
+    span["response_chars"] = len(response)
+    span["response_tokens"] = instrumentation.estimate_tokens(response)
+    rates, failed = lean_rates.parse_response(response, numbers)
+    merged = lean_rates.merge(model_xml, rates)
+    span["failed_flows"] = len(failed)
+    print(f"Lean LLM2 filled {len(rates)} of {len(numbers)} rate(s)"
+          + (f"; asking for the reasoning behind {len(failed)}." if failed else "."))
+    if not failed:
+        return merged
+    verbose_input = build_llm2_input(merged).strip()
+    verbose = _generate(backend, verbose_input, cache, "llm2", span=span)
+    span["prompt_tokens"] += instrumentation.estimate_tokens(verbose_input)
+    span["response_tokens"] += instrumentation.estimate_tokens(verbose)
+    return verbose
+
+
+def explain_rates(model_xml: str, user_input: str, flows: list, backend=None) -> str:
+    """
+    Asks LLM2 for its step-by-step reasoning on the rates of `flows` (flow
+    numbers in document order, as in lean_rates) of a finished model.
+    Returns the response: the model with those flows recomputed and
+    commented.
+    """
+    compartments = serimodel.read_compartments(model_xml)
+    number = 0
+    for _, compartment_flows in compartments:
+        for flow in compartment_flows:
+            if number in flows:
+                flow["rate"] = serimodel.RATE_PLACEHOLDER
+            number += 1
+    separator = "\n" + "*" * 80 + "\n"
+    prompt = (
+        f"{separator}"
+        f"PROMPT:\n{LLM2_PROMPT.strip()}\n"
+        f"{separator}"
+        f"USER INPUT:\n{user_input.strip()}\n"
+        f"{separator}"
+        f"STRUCTURALLY CORRECT SEIRMODEL FILE:\n{serimodel.render(compartments)}\n"
+        f"{separator}"
+    )
+    return (backend or get_backend()).generate(prompt.strip()).strip()
+
+
+def read_spec(path: str) -> str:
+    """
+    Reads a language specification file, keeping its text in memory until
+    the file changes, so long-running processes read each spec only once.
+    """
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    with _spec_cache_lock:
+        if key not in _spec_cache:
+            with open(path, "r", encoding="utf-8") as f:
+                _spec_cache[key] = f.read()
+        return _spec_cache[key]
+
+
+_spec_cache = {}
+_spec_cache_lock = threading.Lock()
+
+
+def output_path(output_fileName: str) -> str:
+    """Where the transcript for `output_fileName` is written: a prompt_sample/ folder beside it."""
+    return os.path.join(os.path.dirname(output_fileName), "prompt_sample", os.path.basename(output_fileName))
+
+
+def _report_savings(stage: str, full_text: str, compact_text: str) -> int:
+    """Prints and returns the estimated input tokens compaction saved on one call."""
+    full = instrumentation.estimate_tokens(full_text)
+    compact = instrumentation.estimate_tokens(compact_text)
+    print(f"{stage} context compacted: {full:,} -> {compact:,} tokens ({full - compact:,} saved).")
+    return full - compact
+
+
+def _write_output(output_fileName: str, output_content: str, run, note: str = "") -> str:
     try:
         # Ensure the output directory exists
-        output_dir = os.path.join(os.path.dirname(output_fileName), "prompt_sample")
-        os.makedirs(output_dir, exist_ok=True)
-        output_file = os.path.join(output_dir, os.path.basename(output_fileName))
-        with open(output_file, "w", encoding="utf-8") as tf:
-            tf.write(output_content)
+        with run.stage("output_write", chars=len(output_content)):
+            output_file = output_path(output_fileName)
+            os.makedirs(os.path.dirname(output_file), exist_ok=True)
+            with open(output_file, "w", encoding="utf-8") as tf:
+                tf.write(output_content)
     except IOError as e:
         return f"Error writing to output file '{output_fileName}': {e}"
 
-    return f"SEIR model successfully written to {output_fileName}"
+    return f"SEIR model successfully written to {output_fileName}{note}"
 
 
+def _generate(backend, parts, cache, stage: str, image_bytes: bytes = b"", stream: bool = False,
+              span: dict = None, response_schema: dict = None) -> str:
+    """
+    Calls the model for one stage, going through `cache` when one is given.
+    The cache key covers the stage, model name, image bytes and every text part.
+    Cache hits, attempts, retries and hedges are noted in `span` when
+    given, adding up over every call made with the same span.
+    `response_schema` constrains the response to a JSON schema.
+    """
+    span = span if span is not None else {}
+    counts = getattr(backend, "call_counts", None)
+
+    def call():
+        before = counts() if counts else None
+        stats = {}
+        try:
+            if stream:
+                return streaming.generate_validated(backend, parts, stats=stats)
+            if response_schema is not None:
+                return backend.generate(parts, response_schema=response_schema).strip()
+            return backend.generate(parts).strip()
+        finally:
+            _note_attempts(span, before, counts() if counts else None, stats)
+
+    if cache is None:
+        return call()
+
+    parts_list = parts if isinstance(parts, list) else [parts]
+    model_name = backend.model_name
+    key = cache.key(stage, model_name, image_bytes, *[p for p in parts_list if isinstance(p, str)])
+    text = cache.get(key)
+    span["cache_hit"] = span.get("cache_hit", True) and text is not None
+    if text is None:
+        text = call()
+        cache.put(key, text, stage=stage, model=model_name)
+    return text
+
+
+def _note_attempts(span: dict, before: dict, after: dict, stream_stats: dict):
+    """
+    Adds the attempts, retries and hedges of one model call to `span`.
+    `before` and `after` are the backend's call_counts() around the call
+    (None for backends without retries); `stream_stats` are the stats of
+    streaming.generate_validated, whose re-streams of an invalid response
+    count as retries too.
+    """
+    streams = stream_stats.get("attempts", 1)
+    if after is None:
+        made = {"attempts": streams, "retries": 0, "hedges": 0}
+    else:
+        made = {name: after.get(name, 0) - before.get(name, 0) for name in ("attempts", "retries", "hedges")}
+    made["retries"] += streams - 1
+    if "wasted_chars" in stream_stats:
+        made["wasted_chars"] = stream_stats["wasted_chars"]
+    for name, value in made.items():
+        span[name] = span.get(name, 0) + value
+
 
 
 
@@ -217,6 +591,25 @@ How to Write Reasoning (Baby-Step Style):
 Final Note: Your only task is to calculate and insert correct rate values. Please Do not add, remove, or reorder compartments or flows. Also don't change the target parameter in any ongoingrate tag.
 """
 
+LLM2_LEAN_PROMPT = """
+You are an expert at interpreting epidemiological equations and computing flow rates.
+
+You are given:
+1. A user_input section that includes all relevant parameter values, formulas, and population data.
+2. A numbered list of flows (source → target) whose rates are missing.
+
+YOUR TASK:
+For each numbered flow, determine which rate formula applies and compute the rate from the data:
+  - For contact-based flows, convert to a rate using population values.
+  - Substitute variables directly from the data.
+  - Never assume missing values unless they are explicitly derivable.
+
+Respond ONLY with a JSON object mapping each flow number to its computed rate, e.g. {"0": 0.25, "3": 18}.
+- Do not round — use full numerical precision.
+- Use null for a rate that cannot be computed from the data.
+- No explanations, comments, XML or markdown.
+"""
+
 
 PROMPT_EXTRACT_PARAMETERS = """
 You are an expert at extracting epidemiological model parameters from research data.
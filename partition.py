@@ -0,0 +1,171 @@
+"""
+Partitioned generation for large, stratified diagrams.
+
+Asking LLM1 for a whole model in one response runs into output length
+limits on big stratified models, and the calls get slower superlinearly.
+This module splits the compartments into partitions, normally one per
+stratum (the Subgroup column of the input's compartment table, e.g. the HIV
+model's Homosexual Men / Women / Heterosexual Men blocks), split further
+into chunks of at most `max_size`. Without strata the table is cut into
+contiguous chunks. Inputs without a compartment table first get a short
+outline call that lists the diagram's compartments.
+
+Each partition's prompt numbers the partition's own compartments 0..k-1,
+then every other compartment after them, so cross-partition flows can
+still be expressed. The model emits only the first k. Partitions are
+generated concurrently, and stitch() maps each response's local
+`//@compartments.N` targets back to global indices. The same split is
+applied to LLM2: only partitions that still hold `[[rate_missing]]` are
+sent, and their rates are merged back into the stitched model.
+"""
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+
+import serimodel
+import user_input
+
+
+OUTLINE_PROMPT = """
+List every compartment in the model diagram, in the order used for 0-based indexing (top-down, left-to-right).
+Answer with a single markdown table and nothing else:
+
+| Index | Compartment | Subgroup |
+| ----- | ----------- | -------- |
+
+Use the Subgroup column for the stratum a compartment belongs to (population group, age band, region, ...);
+leave it empty for compartments shared by all strata.
+"""
+
+PARTITION_PROMPT = """
+PARTITION {number} OF {count}:
+This model is generated in parts. Output an XML file containing ONLY the compartments numbered 0 to {last} in the table below, in that order, each with all of its outgoing flows.
+Number every flow target with the indices of THIS table, not the indices of the original input.
+The remaining compartments are listed only so that flows into them can be written; do not output them.
+
+{table}
+"""
+
+
+class PartitionError(ValueError):
+    """Raised when a partition's response cannot be stitched into the model."""
+
+
+def plan_partitions(table: list, max_size: int = 12) -> list:
+    """
+    Splits a compartment table ((index, name, subgroup) tuples, see
+    user_input.parse_compartment_table) into partitions. Each partition is
+    {"name": ..., "members": [global indices]}.
+    """
+    stratified = any(subgroup.strip() for _, _, subgroup in table)
+    groups = {}
+    for index, name, subgroup in sorted(table):
+        groups.setdefault(subgroup.strip() if stratified else "", []).append(index)
+
+    partitions = []
+    for subgroup, members in groups.items():
+        label = subgroup or ("shared" if stratified else "compartments")
+        chunks = [members[start:start + max_size] for start in range(0, len(members), max_size)]
+        for number, chunk in enumerate(chunks):
+            partitions.append({"name": f"{label} {number + 1}" if len(chunks) > 1 else label, "members": chunk})
+    return partitions
+
+
+def partition_table(partition: dict, table: list) -> tuple:
+    """
+    Markdown table for one partition's prompt and the local -> global index
+    order it uses: the partition's members first, then every other compartment.
+    """
+    members = set(partition["members"])
+    rows = {index: (name, subgroup) for index, name, subgroup in table}
+    order = list(partition["members"]) + [index for index in sorted(rows) if index not in members]
+    lines = ["| Index | Compartment | Subgroup |", "| ----- | ----------- | -------- |"]
+    lines += [f"| {local} | {rows[index][0]} | {rows[index][1]} |" for local, index in enumerate(order)]
+    return "\n".join(lines), order
+
+
+def stitch(responses: list, partitions: list, orders: list, n_compartments: int) -> list:
+    """
+    Combines one LLM1 response per partition into the full compartment list,
+    remapping each response's local targets through its partition's order.
+    """
+    stitched = [None] * n_compartments
+    for response, partition, order in zip(responses, partitions, orders):
+        try:
+            compartments = serimodel.read_compartments(response)
+        except ET.ParseError as err:
+            raise PartitionError(f"Partition '{partition['name']}' returned invalid XML: {err}") from None
+        if len(compartments) != len(partition["members"]):
+            raise PartitionError(
+                f"Partition '{partition['name']}' returned {len(compartments)} compartments, "
+                f"expected {len(partition['members'])}"
+            )
+        for global_index, (attributes, flows) in zip(partition["members"], compartments):
+            for flow in flows:
+                match = serimodel.TARGET_RE.fullmatch(flow.get("target", "").strip())
+                if not match or int(match.group(1)) >= len(order):
+                    raise PartitionError(
+                        f"Partition '{partition['name']}' has an invalid target {flow.get('target')!r}"
+                    )
+                flow["target"] = f"//@compartments.{order[int(match.group(1))]}"
+            stitched[global_index] = (attributes, flows)
+    return stitched
+
+
+def generate_structure(call, build_prompt, user_text: str, max_size: int = 12, max_workers: int = 8) -> tuple:
+    """
+    Partitioned LLM1. `call(prompt_text, stage)` sends the image plus the
+    text to the model, and `build_prompt(extra)` returns the usual LLM1 text
+    with `extra` appended. Returns (stitched XML, partitions).
+    """
+    table = user_input.parse_compartment_table(user_text)
+    if not table:
+        table = user_input.parse_compartment_table(call(f"{OUTLINE_PROMPT.strip()}\n\nData:\n{user_text}", "outline"))
+        if not table:
+            raise PartitionError("The outline call did not return a compartment table")
+    if sorted(index for index, _, _ in table) != list(range(len(table))):
+        raise PartitionError("The compartment table's indices are not 0..n-1")
+
+    partitions = plan_partitions(table, max_size)
+    prompts, orders = [], []
+    for number, partition in enumerate(partitions):
+        text, order = partition_table(partition, table)
+        orders.append(order)
+        prompts.append(build_prompt(PARTITION_PROMPT.format(
+            number=number + 1, count=len(partitions), last=len(partition["members"]) - 1, table=text,
+        )))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        responses = list(pool.map(lambda prompt: call(prompt, "llm1_partition"), prompts))
+    return serimodel.render(stitch(responses, partitions, orders, len(table))), partitions
+
+
+def fill_rates(call, xml_text: str, partitions: list, max_workers: int = 8) -> tuple:
+    """
+    Partitioned LLM2. Sends the XML of each partition that still has
+    placeholders (targets left global) to `call(fragment_xml)` and copies
+    the rates of the returned XML back. Returns (XML, number of partitions sent).
+    """
+    compartments = serimodel.read_compartments(xml_text)
+    pending = [
+        partition for partition in partitions
+        if any(flow.get("rate") == serimodel.RATE_PLACEHOLDER for index in partition["members"] for flow in compartments[index][1])
+    ]
+
+    def fill(partition):
+        fragment = [compartments[index] for index in partition["members"]]
+        response = call(serimodel.render(fragment))
+        try:
+            filled = serimodel.read_compartments(response)
+        except ET.ParseError as err:
+            raise PartitionError(f"LLM2 returned invalid XML for partition '{partition['name']}': {err}") from None
+        if [len(flows) for _, flows in filled] != [len(flows) for _, flows in fragment]:
+            raise PartitionError(f"LLM2 changed the flows of partition '{partition['name']}'")
+        return partition, filled
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        results = list(pool.map(fill, pending))
+    for partition, filled in results:
+        for index, (_, flows) in zip(partition["members"], filled):
+            for flow, new_flow in zip(compartments[index][1], flows):
+                flow["rate"] = new_flow.get("rate", flow.get("rate")).strip()
+    return serimodel.render(compartments), len(pending)
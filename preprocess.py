@@ -0,0 +1,143 @@
+"""
+Image preprocessing before upload.
+
+Box-and-arrow diagrams need far fewer pixels than the photos and scans we
+get them from (hivModel(epimde).jpg is 2.5 MB). preprocess_image() crops
+the blank border, downscales to a target resolution, optionally reduces to
+grayscale or a small palette and re-encodes, caching the result under a
+hash of the source bytes and options so each variant is only computed once.
+"""
+import argparse
+import hashlib
+import io
+import json
+import os
+
+import PIL.Image
+import PIL.ImageOps
+
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".image_cache")
+
+DEFAULT_OPTIONS = {
+    "max_side": 1280,       # longest side in pixels after downscaling; None keeps the size
+    "mode": "gray",         # "gray", "palette" or None to keep colour
+    "colors": 16,           # palette size for mode="palette"
+    "crop": True,           # trim the near-white border
+    "format": "PNG",        # "PNG" or "JPEG"
+    "quality": 85,          # JPEG quality
+}
+
+
+def preprocess_image(image_path: str, options: dict = None, cache_dir: str = DEFAULT_CACHE_DIR) -> tuple:
+    """
+    Returns (processed_bytes, report) for the image at `image_path`. `report`
+    holds the original and processed sizes in bytes and pixels and the bytes
+    saved. Pass cache_dir=None to skip the on-disk cache.
+    """
+    options = {**DEFAULT_OPTIONS, **(options or {})}
+    with open(image_path, "rb") as f:
+        source = f.read()
+
+    digest = hashlib.sha256(source)
+    digest.update(json.dumps(options, sort_keys=True).encode("utf-8"))
+    key = digest.hexdigest()
+    extension = "jpg" if options["format"].upper() == "JPEG" else "png"
+    cached_path = os.path.join(cache_dir, f"{key}.{extension}") if cache_dir else None
+
+    original = PIL.Image.open(io.BytesIO(source))
+    if cached_path and os.path.exists(cached_path):
+        with open(cached_path, "rb") as f:
+            processed = f.read()
+        cached = True
+    else:
+        processed = _process(original, options)
+        cached = False
+        if cached_path:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_path = f"{cached_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(processed)
+            os.replace(tmp_path, cached_path)
+
+    processed_size = PIL.Image.open(io.BytesIO(processed)).size
+    report = {
+        "image": image_path,
+        "original_bytes": len(source),
+        "processed_bytes": len(processed),
+        "bytes_saved": len(source) - len(processed),
+        "original_size": original.size,
+        "processed_size": processed_size,
+        "cached": cached,
+    }
+    return processed, report
+
+
+def _process(img, options: dict) -> bytes:
+    img = PIL.ImageOps.exif_transpose(img)
+    if img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+
+    if options["crop"]:
+        img = crop_whitespace(img)
+
+    max_side = options["max_side"]
+    if max_side and max(img.size) > max_side:
+        img.thumbnail((max_side, max_side), PIL.Image.LANCZOS)
+
+    if options["mode"] == "gray":
+        img = img.convert("L")
+    elif options["mode"] == "palette":
+        img = img.convert("RGB").quantize(colors=options["colors"])
+
+    out = io.BytesIO()
+    if options["format"].upper() == "JPEG":
+        img.convert("L" if img.mode == "L" else "RGB").save(out, "JPEG", quality=options["quality"], optimize=True)
+    else:
+        img.save(out, "PNG", optimize=True)
+    return out.getvalue()
+
+
+def crop_whitespace(img, threshold: int = 240, margin: int = 8):
+    """Crops the border where every pixel is lighter than `threshold`, keeping `margin` pixels."""
+    gray = img.convert("L")
+    # Pixels darker than the threshold become white in the mask; getbbox finds them.
+    bbox = gray.point(lambda value: 255 if value < threshold else 0).getbbox()
+    if bbox is None:
+        return img
+    left, top, right, bottom = bbox
+    return img.crop((
+        max(0, left - margin),
+        max(0, top - margin),
+        min(img.width, right + margin),
+        min(img.height, bottom + margin),
+    ))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report upload savings from preprocessing diagram images.")
+    parser.add_argument("images", nargs="+")
+    parser.add_argument("--max-side", type=int, default=DEFAULT_OPTIONS["max_side"])
+    parser.add_argument("--mode", choices=["gray", "palette", "color"], default=DEFAULT_OPTIONS["mode"])
+    parser.add_argument("--format", choices=["PNG", "JPEG"], default=DEFAULT_OPTIONS["format"])
+    parser.add_argument("--no-crop", action="store_true")
+    args = parser.parse_args()
+
+    options = {
+        "max_side": args.max_side,
+        "mode": None if args.mode == "color" else args.mode,
+        "format": args.format,
+        "crop": not args.no_crop,
+    }
+    total_before = total_after = 0
+    for path in args.images:
+        _, report = preprocess_image(path, options)
+        total_before += report["original_bytes"]
+        total_after += report["processed_bytes"]
+        print(
+            f"{path}: {report['original_bytes']:,} -> {report['processed_bytes']:,} bytes "
+            f"({report['original_size'][0]}x{report['original_size'][1]} -> "
+            f"{report['processed_size'][0]}x{report['processed_size'][1]})"
+        )
+    if total_before:
+        print(f"Total: {total_before:,} -> {total_after:,} bytes ({100 * (1 - total_after / total_before):.1f}% saved)")
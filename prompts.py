@@ -0,0 +1,175 @@
+"""
+Compact prompt context for LLM1 and LLM2.
+
+Every LLM1 call used to carry the pretty-printed metamodel.txt, and every
+LLM2 call the whole user input again. With compaction:
+
+- the metamodel JSON is serialized without indentation, and its term lists
+  (compartment_types other than the epidemiological states, and
+  secondary_name_patterns) keep only the terms that occur in the input.
+  An input that mentions none of them (image-only runs) keeps all of them.
+  flow_patterns.rate_types is dropped, since LLM1 writes placeholders
+  instead of rates. Non-JSON specs such as seirmodel_skeleton.txt only
+  lose indentation and blank lines.
+- the user input is normalized (user_input.normalize removes the invisible
+  operators and math-alphabet letters some inputs are pasted with), and
+  markdown table padding is collapsed.
+- context is not repeated between stages. LLM1 only needs structure, so it
+  does not get the parameter, population and equation blocks. LLM2 already
+  gets the compartments in the XML, so it does not get the compartment
+  table when the XML has every compartment in it.
+
+measure() estimates the input tokens saved per call. The CLI prints them
+for the inputs stored in main.py, and `benchmark.py --compare-compact`
+shows the effect on accuracy.
+"""
+import argparse
+import json
+import re
+
+import instrumentation
+import user_input
+
+
+# Lists that are part of the core vocabulary and always sent in full.
+ALWAYS_KEPT = {("compartment_types", "epidemiological_states")}
+TRIMMED_GROUPS = ("compartment_types", "secondary_name_patterns")
+
+_TABLE_SEPARATOR_RE = re.compile(r"^\|(\s*:?-+:?\s*\|)+$")
+_HEADING_RE = re.compile(r"^[^|→=]*:\s*$")
+
+
+def compact_spec(spec_text: str, user_text: str = "") -> str:
+    """The language specification in compact form, trimmed to the terms relevant to `user_text`."""
+    try:
+        spec = json.loads(spec_text)
+    except ValueError:
+        return "\n".join(line.strip() for line in spec_text.splitlines() if line.strip())
+
+    metamodel = spec.get("seirmodel_metamodel", spec)
+    text_key = user_input.name_key(user_text)
+    trimmed = {}
+    for group in TRIMMED_GROUPS:
+        for category, terms in metamodel.get(group, {}).items():
+            if (group, category) not in ALWAYS_KEPT:
+                trimmed[(group, category)] = [term for term in terms if user_input.name_key(term) in text_key]
+    if any(trimmed.values()):
+        for (group, category), terms in trimmed.items():
+            if terms:
+                metamodel[group][category] = terms
+            else:
+                del metamodel[group][category]
+        for group in TRIMMED_GROUPS:
+            if group in metamodel and not metamodel[group]:
+                del metamodel[group]
+    metamodel.get("flow_patterns", {}).pop("rate_types", None)
+    return json.dumps(spec, ensure_ascii=False, separators=(",", ":"))
+
+
+def compact_text(text: str) -> str:
+    """Normalized text with markdown table padding and runs of blank lines removed."""
+    lines = []
+    for line in user_input.normalize(text).splitlines():
+        stripped = line.strip()
+        if stripped.startswith("|"):
+            if _TABLE_SEPARATOR_RE.match(stripped.replace(" ", "")):
+                stripped = "|" + "-|" * stripped.strip("|").count("|") + "-|"
+            else:
+                stripped = "|" + "|".join(cell.strip() for cell in stripped.strip("|").split("|")) + "|"
+        else:
+            stripped = re.sub(r"[ \t]+", " ", stripped)
+        if stripped or (lines and lines[-1]):
+            lines.append(stripped)
+    return "\n".join(lines).strip()
+
+
+def split_blocks(text: str) -> list:
+    """
+    Splits an input into blank-line separated blocks labelled "compartments"
+    (the Index/Compartment table), "numbers" (parameter tables, values,
+    populations and equations, with their headings) or "shared".
+    """
+    blocks = []
+    for block in re.split(r"\n[ \t]*\n", user_input.normalize(text)):
+        if not block.strip():
+            continue
+        tables = user_input.parse_markdown_tables(block)
+        if any(table[0] and table[0][0].lower() == "index" for table in tables):
+            kind = "compartments"
+        elif tables and all(table[0] and "parameter" in table[0][0].lower() for table in tables):
+            kind = "numbers"
+        elif not tables and _is_numeric_block(block):
+            kind = "numbers"
+        else:
+            kind = "shared"
+        blocks.append((kind, block))
+    return blocks
+
+
+def _is_numeric_block(block: str) -> bool:
+    lines = [line for line in block.splitlines() if line.strip()]
+    numeric = [line for line in lines if user_input.parse_values(line) or user_input.parse_equations(line)]
+    return bool(numeric) and all(line in numeric or _HEADING_RE.match(line) for line in lines)
+
+
+def structure_input(user_text: str) -> str:
+    """LLM1's view of the input: everything except the numeric blocks."""
+    blocks = split_blocks(user_text)
+    if not any(kind != "numbers" for kind, _ in blocks):
+        return compact_text(user_text)
+    return compact_text("\n\n".join(block for kind, block in blocks if kind != "numbers"))
+
+
+def rates_input(user_text: str, model_xml: str = None) -> str:
+    """
+    LLM2's view of the input: everything except the compartment table when
+    `model_xml` already has as many compartments as the table.
+    """
+    table = user_input.parse_compartment_table(user_text)
+    if model_xml is None or not table or model_xml.count("<compartments") != len(table):
+        return compact_text(user_text)
+    return compact_text("\n\n".join(block for kind, block in split_blocks(user_text) if kind != "compartments"))
+
+
+def measure(user_text: str, spec_text: str, model_xml: str = "") -> dict:
+    """Estimated input tokens of the variable prompt parts, full and compacted, per stage."""
+    full_llm1 = instrumentation.estimate_tokens(spec_text + user_text)
+    compact_llm1 = instrumentation.estimate_tokens(compact_spec(spec_text, user_text) + structure_input(user_text))
+    full_llm2 = instrumentation.estimate_tokens(user_text + model_xml)
+    compact_llm2 = instrumentation.estimate_tokens(rates_input(user_text, model_xml or None) + model_xml)
+    return {
+        "llm1": full_llm1, "llm1_compact": compact_llm1,
+        "llm2": full_llm2, "llm2_compact": compact_llm2,
+    }
+
+
+if __name__ == "__main__":
+    import main
+
+    parser = argparse.ArgumentParser(description="Show the input tokens saved by prompt compaction.")
+    parser.add_argument("--spec", action="append", default=None,
+                        help=f"language specification (default: {main.METAMODEL_FILENAME} and {main.LANG_SPECS_FILENAME})")
+    parser.add_argument("--show", metavar="INPUT", default=None,
+                        help="print the compact LLM1 context for this main.py input and exit")
+    args = parser.parse_args()
+
+    specs = args.spec or [main.METAMODEL_FILENAME, main.LANG_SPECS_FILENAME]
+    if args.show:
+        text = getattr(main, args.show)
+        print(compact_spec(main.read_spec(specs[0]), text))
+        print()
+        print(structure_input(text))
+        raise SystemExit
+
+    import tabular
+
+    inputs = ["hiv_json", "hiv_all_info", "hiv_imp_info_only", "covidModel", "simpleModel_imp_info_only"]
+    print(f"{'input':<28}{'spec':<26}{'LLM1':>7}{'compact':>9}{'saved':>7}{'LLM2':>7}{'compact':>9}{'saved':>7}")
+    for name in inputs:
+        text = getattr(main, name)
+        model_xml = tabular.build_skeleton(text) or ""
+        for spec_path in specs:
+            tokens = measure(text, main.read_spec(spec_path), model_xml)
+            print(f"{name:<28}{spec_path:<26}{tokens['llm1']:>7}{tokens['llm1_compact']:>9}"
+                  f"{1 - tokens['llm1_compact'] / tokens['llm1']:>7.0%}{tokens['llm2']:>7}{tokens['llm2_compact']:>9}"
+                  f"{1 - tokens['llm2_compact'] / tokens['llm2']:>7.0%}")
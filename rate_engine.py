@@ -0,0 +1,289 @@
+"""
+Local, deterministic replacement for the LLM2 rate-filling stage.
+
+LLM2 only substitutes numbers into formulas such as
+`λh = βh * ch * (Ih / (Sh + Ih))`. This module does that arithmetic
+locally: it reads the parameter values, population values, `name = ...`
+equations and the `From → To` flow table from the user input, matches each
+`[[rate_missing]]` flow in the LLM1 XML to its table row, and evaluates the
+formula exactly (rational arithmetic, no rounding). Flows it cannot
+resolve keep their placeholder so the LLM can fill just those.
+"""
+import ast
+import re
+from fractions import Fraction
+
+import serimodel
+import user_input
+
+
+_TOKEN_RE = re.compile(
+    r"(?P<number>(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][+-]?\d+)?)"
+    r"|(?P<name>[^\W\d]\w*)"
+    r"|(?P<op>[-+*/^()])"
+    r"|(?P<space>\s+)"
+    r"|(?P<other>.)"
+)
+_FLOW_TAG_RE = re.compile(r"<outgoingFlows\b[^>]*>")
+
+
+class UnresolvedRate(ValueError):
+    """Raised when a rate expression cannot be evaluated from the given data."""
+
+
+def evaluate(expression: str, values: dict, equations: dict = None) -> Fraction:
+    """
+    Evaluates a rate expression exactly. Names are looked up in `values`
+    (numbers) and `equations` (expressions, evaluated recursively). Juxtaposed
+    symbols such as `Ψθ(1−γ)` are read as products when every piece is a
+    known name.
+    """
+    return _Evaluator(values, equations or {}).expression(expression)
+
+
+class _Evaluator:
+    def __init__(self, values: dict, equations: dict):
+        self.values = {name: Fraction(repr(float(value))) for name, value in values.items()}
+        self.equations = equations
+        self.resolving = []
+
+    def expression(self, expression: str) -> Fraction:
+        names = []
+        tokens = []
+        for kind, text in self._tokens(user_input.normalize(expression)):
+            if kind == "name":
+                for name in self._split_name(text):
+                    names.append(name)
+                    tokens.append(("name", f"_v{len(names) - 1}"))
+            else:
+                tokens.append((kind, text))
+
+        source = []
+        for i, (kind, text) in enumerate(tokens):
+            if i and _is_operand_end(tokens[i - 1]) and _is_operand_start((kind, text)):
+                source.append("*")
+            source.append("**" if text == "^" else text)
+        try:
+            tree = ast.parse("".join(source), mode="eval")
+        except SyntaxError as err:
+            raise UnresolvedRate(f"cannot parse expression '{expression}'") from err
+        return self._eval(tree.body, names)
+
+    def name(self, name: str) -> Fraction:
+        if name in self.values:
+            return self.values[name]
+        if name in self.resolving:
+            raise UnresolvedRate(f"circular definition of {name}")
+        self.resolving.append(name)
+        try:
+            value = self.expression(self.equations[name])
+        finally:
+            self.resolving.pop()
+        self.values[name] = value
+        return value
+
+    def _known(self, name: str) -> bool:
+        return name in self.values or name in self.equations
+
+    def _split_name(self, text: str) -> list:
+        if self._known(text):
+            return [text]
+        # Greedy longest-prefix split of juxtaposed symbols, e.g. 'Ψθ' -> Ψ, θ.
+        parts = []
+        rest = text
+        while rest:
+            for end in range(len(rest), 0, -1):
+                if self._known(rest[:end]):
+                    parts.append(rest[:end])
+                    rest = rest[end:]
+                    break
+            else:
+                raise UnresolvedRate(f"undefined variable: {text}")
+        return parts
+
+    @staticmethod
+    def _tokens(expression: str):
+        for match in _TOKEN_RE.finditer(expression):
+            kind = match.lastgroup
+            if kind == "space":
+                continue
+            if kind == "other":
+                raise UnresolvedRate(f"unsupported symbol {match.group()!r} in '{expression}'")
+            yield kind, match.group()
+
+    def _eval(self, node, names: list) -> Fraction:
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+            return Fraction(repr(node.value)) if isinstance(node.value, float) else Fraction(node.value)
+        if isinstance(node, ast.Name):
+            return self.name(names[int(node.id[2:])])
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.UAdd, ast.USub)):
+            value = self._eval(node.operand, names)
+            return -value if isinstance(node.op, ast.USub) else value
+        if isinstance(node, ast.BinOp):
+            left = self._eval(node.left, names)
+            right = self._eval(node.right, names)
+            if isinstance(node.op, ast.Add):
+                return left + right
+            if isinstance(node.op, ast.Sub):
+                return left - right
+            if isinstance(node.op, ast.Mult):
+                return left * right
+            if isinstance(node.op, ast.Div):
+                if right == 0:
+                    raise UnresolvedRate("division by zero")
+                return left / right
+            if isinstance(node.op, ast.Pow):
+                if right.denominator == 1:
+                    return left ** int(right)
+                return Fraction(float(left) ** float(right))
+        raise UnresolvedRate(f"unsupported expression element {ast.dump(node)}")
+
+
+def _is_operand_end(token) -> bool:
+    return token[0] in ("number", "name") or token[1] == ")"
+
+
+def _is_operand_start(token) -> bool:
+    return token[0] in ("number", "name") or token[1] == "("
+
+
+def format_rate(value: Fraction) -> str:
+    """Full-precision decimal text for a computed rate."""
+    return repr(float(value))
+
+
+def fill_rates(llm1_response: str, user_text: str) -> tuple:
+    """
+    Fills every `[[rate_missing]]` in the LLM1 XML that can be computed from
+    `user_text`. Returns (xml, unresolved), where `unresolved` lists
+    {"source", "target", "reason"} dicts for flows still holding the
+    placeholder.
+    """
+    xml_text = serimodel.extract_xml(llm1_response)
+    compartments = serimodel.parse_compartments(xml_text)
+    evaluator = _Evaluator(user_input.parse_values(user_text), user_input.parse_equations(user_text))
+    rows = _table_rows(compartments, user_text)
+
+    rates = []
+    unresolved = []
+    for index, compartment in enumerate(compartments):
+        for flow in compartment["flows"]:
+            if flow["rate"] != serimodel.RATE_PLACEHOLDER:
+                rates.append(None)
+                continue
+            try:
+                row = _match_row(rows, compartments, index, flow["target"])
+                rates.append(format_rate(evaluator.expression(row["expression"])))
+            except UnresolvedRate as err:
+                rates.append(None)
+                unresolved.append({"source": index, "target": flow["target"], "reason": str(err)})
+
+    return apply_rates(xml_text, rates), unresolved
+
+
+def apply_rates(xml_text: str, rates: list) -> str:
+    """
+    Replaces the placeholders of the flows (in document order) whose entry
+    in `rates` is not None, leaving the rest of the XML text untouched.
+    """
+    flow_number = iter(range(len(rates)))
+
+    def substitute(match):
+        number = next(flow_number, None)
+        rate = rates[number] if number is not None else None
+        tag = match.group(0)
+        return tag.replace(f'"{serimodel.RATE_PLACEHOLDER}"', f'"{rate}"') if rate is not None else tag
+
+    return _FLOW_TAG_RE.sub(substitute, xml_text)
+
+
+def affected_flows(xml_text: str, old_text: str, new_text: str) -> list:
+    """
+    For a model generated from `old_text`, flags (in document order) the
+    flows whose rate may differ under `new_text`, an input with the same
+    structure. A flow is unaffected when its table formula evaluates to the
+    same value under both inputs or, where it cannot be evaluated, when
+    neither its formula nor any value or equation it may refer to changed.
+    Flows without a table row are always flagged.
+    """
+    compartments = serimodel.parse_compartments(xml_text)
+    old_rows = _table_rows(compartments, old_text)
+    new_rows = _table_rows(compartments, new_text)
+    old_values, new_values = user_input.parse_values(old_text), user_input.parse_values(new_text)
+    old_equations, new_equations = user_input.parse_equations(old_text), user_input.parse_equations(new_text)
+    old_evaluator = _Evaluator(old_values, old_equations)
+    new_evaluator = _Evaluator(new_values, new_equations)
+
+    changed = {name for name in old_values.keys() | new_values.keys() if old_values.get(name) != new_values.get(name)}
+    changed |= {name for name in old_equations.keys() | new_equations.keys()
+                if old_equations.get(name) != new_equations.get(name)}
+    # Equations that mention a changed name change too (names are matched as
+    # substrings, since symbols are often juxtaposed without operators).
+    while True:
+        spreading = {name for name, equation in new_equations.items()
+                     if name not in changed and any(other in equation for other in changed)}
+        if not spreading:
+            break
+        changed |= spreading
+
+    flags = []
+    for index, compartment in enumerate(compartments):
+        for flow in compartment["flows"]:
+            try:
+                old_row = _match_row(old_rows, compartments, index, flow["target"])
+                new_row = _match_row(new_rows, compartments, index, flow["target"])
+            except UnresolvedRate:
+                flags.append(True)
+                continue
+            try:
+                flags.append(old_evaluator.expression(old_row["expression"])
+                             != new_evaluator.expression(new_row["expression"]))
+            except UnresolvedRate:
+                expression = user_input.normalize(new_row["expression"])
+                flags.append(old_row["expression"] != new_row["expression"]
+                             or any(name in expression for name in changed))
+    return flags
+
+
+def _table_rows(compartments: list, user_text: str) -> list:
+    """The input's flow table rows with their endpoints resolved to compartment indices."""
+    resolve = _name_resolver(compartments, user_input.parse_compartment_table(user_text))
+    rows = []
+    for source, target, expression in user_input.parse_flow_table(user_text):
+        wildcard = user_input.is_wildcard(source)
+        rows.append({
+            "source": None if wildcard else resolve(source),
+            "target": resolve(target),
+            "wildcard": wildcard,
+            "expression": expression,
+            "used": False,
+        })
+    return rows
+
+
+def _match_row(rows: list, compartments: list, source: int, target: int) -> dict:
+    """Next unused table row for source → target, then any wildcard row into target that applies to source."""
+    for row in rows:
+        if not row["used"] and not row["wildcard"] and row["source"] == source and row["target"] == target:
+            row["used"] = True
+            return row
+    for row in rows:
+        if (row["wildcard"] and row["target"] == target
+                and user_input.wildcard_applies(compartments[source]["PrimaryName"], source, target)):
+            return row
+    raise UnresolvedRate(f"no formula in the input for flow {source} → {target}")
+
+
+def _name_resolver(compartments: list, table: list):
+    """
+    Maps compartment names used in the flow table to indices in the XML,
+    with user_input.name_resolver. Full names (PrimaryName + SecondaryName)
+    win over a bare PrimaryName, which only counts when it is unique. The
+    input's own index table agrees with LLM1's 0-based order and fills in
+    names the XML spells differently.
+    """
+    names = [[f"{c['PrimaryName']} {c['SecondaryName']}", c["PrimaryName"] + c["SecondaryName"]] for c in compartments]
+    for index, name, subgroup in table:
+        if index < len(names):
+            names[index] += [name, name + subgroup] if subgroup else [name]
+    return user_input.name_resolver(names, [[c["PrimaryName"]] for c in compartments])
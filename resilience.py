@@ -0,0 +1,264 @@
+"""
+Deadlines, retries and hedging for model calls.
+
+ResilientBackend wraps any backend (see backends.py) so that one slow or
+failing Gemini response no longer stalls a run:
+
+- every attempt has a `timeout` (for streams, each chunk has), and a whole
+  call has an optional overall `deadline` covering its retries. Build the
+  wrapped GeminiBackend with the same timeout, so the SDK call behind an
+  abandoned attempt ends too instead of holding a pool thread;
+- rate-limit, server and timeout errors are retried with exponential
+  backoff and full jitter (a random sleep up to base_delay * 2**attempt,
+  capped at max_delay), so concurrent jobs that were throttled together do
+  not retry together;
+- with `hedge`, an attempt still running after the observed p95 latency
+  gets a duplicate request, and whichever answers first wins.
+
+Counters (calls, attempts, retries, timeouts, hedges, ...) and latency
+percentiles are available from stats(). call_counts() holds the same
+counters for the calling thread only, so a caller can tell how many
+attempts, retries and hedges one of its own calls took.
+"""
+import collections
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import instrumentation
+
+
+# Exception class names (google.api_core and friends) worth retrying, so the
+# SDK does not have to be imported to classify its errors.
+RETRYABLE_ERRORS = {
+    "ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "InternalServerError",
+    "DeadlineExceeded", "GatewayTimeout", "RateLimitError",
+}
+RETRYABLE_CODES = {429, 500, 502, 503, 504}
+
+DEFAULT_TIMEOUT = 120.0
+
+_END = object()
+
+
+class CallTimeout(TimeoutError):
+    """An attempt got no response within its timeout."""
+
+
+class DeadlineExceeded(TimeoutError):
+    """A call ran out of its overall deadline, retries included."""
+
+
+def is_retryable(err: BaseException) -> bool:
+    if isinstance(err, TimeoutError):
+        return True
+    if type(err).__name__ in RETRYABLE_ERRORS:
+        return True
+    code = getattr(err, "code", None)
+    return (code() if callable(code) else code) in RETRYABLE_CODES
+
+
+class ResilientBackend:
+    """
+    Backend wrapper adding per-attempt timeouts, an overall deadline,
+    backoff retries and optional hedged requests around `backend`.
+
+    `hedge_after` fixes the hedging delay in seconds; otherwise the
+    `hedge_quantile` percentile of the last `window` successful latencies is
+    used once `min_samples` have been seen.
+    """
+
+    def __init__(self, backend, timeout: float = DEFAULT_TIMEOUT, deadline: float = None, max_attempts: int = 4,
+                 base_delay: float = 1.0, max_delay: float = 30.0, hedge: bool = False, hedge_after: float = None,
+                 hedge_quantile: float = 95, min_samples: int = 20, window: int = 200, seed: int = None,
+                 max_workers: int = 32):
+        self.backend = backend
+        self.model_name = backend.model_name
+        self.timeout = timeout
+        self.deadline = deadline
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.hedge = hedge
+        self.hedge_after = hedge_after
+        self.hedge_quantile = hedge_quantile
+        self.min_samples = min_samples
+        self.counters = collections.Counter()
+        self._latencies = collections.deque(maxlen=window)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread = threading.local()
+        # Abandoned (timed out or out-hedged) attempts finish in the background.
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="model-call")
+
+    def warm(self):
+        getattr(self.backend, "warm", lambda: None)()
+
+    def generate(self, parts, response_schema: dict = None) -> str:
+        self._count("calls")
+        deadline_at = time.monotonic() + self.deadline if self.deadline else None
+        for attempt in range(self.max_attempts):
+            try:
+                return self._attempt(parts, deadline_at, response_schema)
+            except Exception as err:
+                self._count("errors")
+                self._retry_or_raise(err, attempt, deadline_at)
+
+    def stream(self, parts):
+        """
+        Streams from the wrapped backend, retrying failures that happen
+        before the first chunk. Every chunk must arrive within `timeout`
+        and before the overall deadline, or the attempt raises CallTimeout.
+        Once text has been yielded an error is raised as-is, since the
+        caller has already consumed part of it.
+        """
+        self._count("calls")
+        deadline_at = time.monotonic() + self.deadline if self.deadline else None
+        for attempt in range(self.max_attempts):
+            self._count("attempts")
+            started = False
+            chunks = iter(self.backend.stream(parts))
+            pending = None
+            try:
+                while True:
+                    pending = self._pool.submit(next, chunks, _END)
+                    chunk = self._next_chunk(pending, deadline_at)
+                    if chunk is _END:
+                        return
+                    started = True
+                    yield chunk
+            except Exception as err:
+                self._count("errors")
+                if started:
+                    self._count("failures")
+                    raise
+                self._retry_or_raise(err, attempt, deadline_at)
+            finally:
+                # A stalled chunk still holds the stream; close it once that returns.
+                if pending is not None and hasattr(chunks, "close"):
+                    pending.add_done_callback(lambda _, chunks=chunks: chunks.close())
+
+    def _next_chunk(self, pending, deadline_at: float = None):
+        """The result of `pending` (one step of a stream), or CallTimeout if it takes too long."""
+        timeout = self.timeout
+        if deadline_at is not None:
+            timeout = max(0.0, min(timeout or float("inf"), deadline_at - time.monotonic()))
+        done, _ = wait({pending}, timeout=timeout)
+        if not done:
+            self._count("timeouts")
+            raise CallTimeout(f"No stream chunk from {self.model_name} within {timeout:.1f}s")
+        return pending.result()
+
+    def _attempt(self, parts, deadline_at: float = None, response_schema: dict = None) -> str:
+        """One attempt, hedged if enabled; raises CallTimeout if nothing answers in time."""
+        start = time.monotonic()
+        timeout = self.timeout
+        if deadline_at is not None:
+            timeout = min(timeout or float("inf"), deadline_at - start)
+        end = start + timeout if timeout else None
+
+        self._count("attempts")
+        first = self._pool.submit(self._timed_generate, parts, response_schema)
+        pending = {first}
+        hedge_delay = self.hedge_delay()
+        if hedge_delay is not None and (end is None or start + hedge_delay < end):
+            done, _ = wait(pending, timeout=hedge_delay)
+            if not done:
+                self._count("hedges")
+                pending.add(self._pool.submit(self._timed_generate, parts, response_schema))
+
+        error = None
+        while pending:
+            remaining = None if end is None else end - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    if future is not first:
+                        self._count("hedge_wins")
+                    return future.result()
+                error = future.exception()
+        if pending:
+            self._count("timeouts")
+            raise CallTimeout(f"No response from {self.model_name} within {timeout:.1f}s")
+        raise error
+
+    def _timed_generate(self, parts, response_schema: dict = None) -> str:
+        start = time.monotonic()
+        text = self.backend.generate(parts, response_schema=response_schema)
+        with self._lock:
+            self._latencies.append(time.monotonic() - start)
+        return text
+
+    def _retry_or_raise(self, err: Exception, attempt: int, deadline_at: float = None):
+        """Sleeps before the next attempt, or re-raises when `err` should end the call."""
+        if not is_retryable(err) or attempt + 1 >= self.max_attempts:
+            self._count("failures")
+            raise err
+        delay = self.backoff(attempt)
+        if deadline_at is not None and time.monotonic() + delay >= deadline_at:
+            self._count("failures")
+            self._count("deadlines")
+            raise DeadlineExceeded(f"{self.model_name} call gave up after {attempt + 1} attempts: {err}") from err
+        self._count("retries")
+        time.sleep(delay)
+
+    def backoff(self, attempt: int) -> float:
+        """Full-jitter exponential backoff before retry number `attempt` + 1."""
+        with self._lock:
+            return self._random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def hedge_delay(self):
+        """Seconds to wait before hedging, or None when hedging is off or has too few samples."""
+        if not self.hedge:
+            return None
+        if self.hedge_after is not None:
+            return self.hedge_after
+        with self._lock:
+            latencies = list(self._latencies)
+        if len(latencies) < self.min_samples:
+            return None
+        return instrumentation.percentile(latencies, self.hedge_quantile)
+
+    def _count(self, name: str):
+        with self._lock:
+            self.counters[name] += 1
+        self._thread_counters()[name] += 1
+
+    def _thread_counters(self) -> collections.Counter:
+        counters = getattr(self._thread, "counters", None)
+        if counters is None:
+            counters = self._thread.counters = collections.Counter()
+        return counters
+
+    def call_counts(self) -> dict:
+        """
+        Counters of the calls made from the current thread so far. The
+        difference between two readings gives the attempts, retries and
+        hedges of the calls in between. Counting happens on the calling
+        thread, hedged and abandoned attempts included.
+        """
+        return dict(self._thread_counters())
+
+    def stats(self) -> dict:
+        with self._lock:
+            latencies = list(self._latencies)
+            counters = dict(self.counters)
+        return {
+            **{name: counters.get(name, 0) for name in
+               ("calls", "attempts", "retries", "errors", "timeouts", "hedges", "hedge_wins", "failures", "deadlines")},
+            "p50": instrumentation.percentile(latencies, 50),
+            "p95": instrumentation.percentile(latencies, 95),
+        }
+
+
+def print_stats(stats: dict):
+    print(
+        f"Model calls: {stats['calls']} calls, {stats['attempts']} attempts, {stats['retries']} retries, "
+        f"{stats['timeouts']} timeouts, {stats['hedges']} hedged ({stats['hedge_wins']} won), "
+        f"{stats['failures']} failed; latency p50 {stats['p50']:.2f}s p95 {stats['p95']:.2f}s"
+    )
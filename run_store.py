@@ -0,0 +1,206 @@
+"""
+Indexed store of pipeline runs.
+
+Instead of digging generated XML out of the concatenated transcripts in
+prompt_sample/, every run is recorded in SQLite with its inputs and outputs
+kept as content-addressed blobs (blobs/<first two hex chars>/<sha256>):
+
+    runs: id, created, input_key, image_hash, user_input_hash, spec_hash,
+          model, options, llm1_hash, llm2_hash, xml_hash, transcript_hash,
+          seconds, stage_seconds, structure_key
+
+`input_key` hashes everything that determines a run's output (image bytes,
+user input, spec, prompts, model name and options), so a duplicate run is
+found with one indexed lookup before any API call is made. `structure_key`
+hashes the same inputs with the user input replaced by the model structure
+its tables state (tabular.parse_structure, every rate masked), so a run
+whose input only changes parameter values can find the structure it
+shares. Inputs that are not tabular get no structure key: in free text or
+an image any number may be structural ("stratified into 3 age groups").
+"""
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from contextlib import closing
+
+import serimodel
+import tabular
+
+
+DEFAULT_STORE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "runs")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created REAL NOT NULL,
+    input_key TEXT NOT NULL,
+    image_hash TEXT NOT NULL,
+    user_input_hash TEXT NOT NULL,
+    spec_hash TEXT NOT NULL,
+    model TEXT NOT NULL,
+    options TEXT NOT NULL,
+    llm1_hash TEXT,
+    llm2_hash TEXT,
+    xml_hash TEXT,
+    transcript_hash TEXT,
+    seconds REAL,
+    stage_seconds TEXT,
+    structure_key TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_input_key ON runs (input_key, created);
+CREATE INDEX IF NOT EXISTS runs_image_input ON runs (image_hash, user_input_hash, created);
+"""
+
+
+def content_hash(data) -> str:
+    return hashlib.sha256(data if isinstance(data, bytes) else data.encode("utf-8")).hexdigest()
+
+
+class RunStore:
+    """SQLite index plus blob directory under `root`. Safe to share between threads."""
+
+    def __init__(self, root: str = DEFAULT_STORE_DIR):
+        self.root = root
+        self.blob_dir = os.path.join(root, "blobs")
+        os.makedirs(self.blob_dir, exist_ok=True)
+        self.db_path = os.path.join(root, "runs.sqlite")
+        with closing(self._connect()) as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(_SCHEMA)
+            # Stores created before structure keys existed get the columns added.
+            columns = {row["name"] for row in db.execute("PRAGMA table_info(runs)")}
+            if "structure_key" not in columns:
+                db.execute("ALTER TABLE runs ADD COLUMN structure_key TEXT")
+            db.execute("CREATE INDEX IF NOT EXISTS runs_structure_key ON runs (structure_key, created)")
+
+    def _connect(self):
+        db = sqlite3.connect(self.db_path, timeout=30)
+        db.row_factory = sqlite3.Row
+        return db
+
+    def put_blob(self, data) -> str:
+        """Stores str/bytes content once and returns its hash."""
+        data = data if isinstance(data, bytes) else data.encode("utf-8")
+        digest = content_hash(data)
+        path = os.path.join(self.blob_dir, digest[:2], digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        return digest
+
+    def get_blob(self, digest: str) -> bytes:
+        with open(os.path.join(self.blob_dir, digest[:2], digest), "rb") as f:
+            return f.read()
+
+    def get_text(self, digest: str) -> str:
+        """The blob as text, or None when there is no digest or its blob is gone."""
+        if not digest:
+            return None
+        try:
+            return self.get_blob(digest).decode("utf-8")
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def input_key(image_bytes: bytes, user_input: str, spec_text: str, model: str, prompts=(),
+                  options: dict = None) -> str:
+        """Hash of every input that determines a run's output."""
+        digest = hashlib.sha256()
+        for part in (content_hash(image_bytes), content_hash(user_input), content_hash(spec_text), model,
+                     *[content_hash(p) for p in prompts], json.dumps(options or {}, sort_keys=True)):
+            digest.update(part.encode("utf-8") + b"\0")
+        return digest.hexdigest()
+
+    @staticmethod
+    def structure_key(image_bytes: bytes, user_text: str, spec_text: str, model: str, prompts=(),
+                      options: dict = None):
+        """The input key of the structure `user_text` tables state, or None when it is not tabular."""
+        try:
+            compartments = tabular.parse_structure(user_text)
+        except tabular.NotTabular:
+            return None
+        for _, flows in compartments:
+            for flow in flows:
+                flow["rate"] = serimodel.RATE_PLACEHOLDER
+        return RunStore.input_key(image_bytes, serimodel.render(compartments), spec_text, model, prompts, options)
+
+    def find(self, input_key: str):
+        """Latest run with exactly these inputs, or None."""
+        with closing(self._connect()) as db:
+            row = db.execute(
+                "SELECT * FROM runs WHERE input_key = ? ORDER BY created DESC LIMIT 1", (input_key,)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def find_structure(self, structure_key: str):
+        """Latest run with the same structural inputs (any parameter values), or None."""
+        if structure_key is None:
+            return None
+        with closing(self._connect()) as db:
+            row = db.execute(
+                "SELECT * FROM runs WHERE structure_key = ? ORDER BY created DESC LIMIT 1", (structure_key,)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def latest_for(self, image_bytes: bytes, user_input: str):
+        """Latest run for this image and user input, whatever the spec, model or options."""
+        with closing(self._connect()) as db:
+            row = db.execute(
+                "SELECT * FROM runs WHERE image_hash = ? AND user_input_hash = ? ORDER BY created DESC LIMIT 1",
+                (content_hash(image_bytes), content_hash(user_input)),
+            ).fetchone()
+        return dict(row) if row else None
+
+    def record(self, input_key: str, image_bytes: bytes, user_input: str, spec_text: str, model: str,
+               options: dict, llm1: str, llm2: str, xml: str, transcript: str, seconds: float,
+               stage_seconds: dict = None, structure_key: str = None) -> int:
+        """Stores one run and returns its id."""
+        row = (
+            time.time(), input_key,
+            self.put_blob(image_bytes), self.put_blob(user_input), self.put_blob(spec_text),
+            model, json.dumps(options or {}, sort_keys=True),
+            self.put_blob(llm1), self.put_blob(llm2), self.put_blob(xml), self.put_blob(transcript),
+            seconds, json.dumps(stage_seconds or {}), structure_key,
+        )
+        with closing(self._connect()) as db, db:
+            cursor = db.execute(
+                "INSERT INTO runs (created, input_key, image_hash, user_input_hash, spec_hash, model, options, "
+                "llm1_hash, llm2_hash, xml_hash, transcript_hash, seconds, stage_seconds, structure_key) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                row,
+            )
+            return cursor.lastrowid
+
+    def get(self, run_id: int):
+        with closing(self._connect()) as db:
+            row = db.execute("SELECT * FROM runs WHERE id = ?", (run_id,)).fetchone()
+        return dict(row) if row else None
+
+    def runs(self, limit: int = 20) -> list:
+        with closing(self._connect()) as db:
+            rows = db.execute("SELECT * FROM runs ORDER BY created DESC LIMIT ?", (limit,)).fetchall()
+        return [dict(row) for row in rows]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="List stored runs or print a run's generated XML.")
+    parser.add_argument("--store", default=DEFAULT_STORE_DIR)
+    parser.add_argument("--xml", type=int, metavar="RUN_ID", help="print the .serimodel XML of this run")
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    store = RunStore(args.store)
+    if args.xml is not None:
+        run = store.get(args.xml)
+        print(store.get_text(run["xml_hash"]) if run else f"No run with id {args.xml}")
+    else:
+        for run in store.runs(args.limit):
+            created = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(run["created"]))
+            print(f"{run['id']:>5}  {created}  {run['model']:<28} {run['seconds'] or 0:>7.2f}s  "
+                  f"image={run['image_hash'][:10]} input={run['user_input_hash'][:10]} xml={run['xml_hash'][:10]}")
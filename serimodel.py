@@ -0,0 +1,335 @@
+"""
+Helpers for reading .serimodel XML (and LLM responses that contain it).
+
+load() streams a .serimodel file with iterparse, validates it against the
+structural rules in metamodel.txt and compiles it into a CompiledModel:
+interned name tables plus CSR flow arrays (`indptr` over source
+compartments, `targets`, `rates`). save_compiled() writes that form to a
+flat binary file whose arrays load_compiled() memory-maps, so tooling that
+reopens a large stratified model starts without re-parsing any XML.
+"""
+import io
+import json
+import re
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import quoteattr
+
+import numpy as np
+
+import streaming
+
+
+# The rate of a flow whose value is still to be computed (see metamodel.txt).
+RATE_PLACEHOLDER = streaming.RATE_PLACEHOLDER
+
+TARGET_RE = re.compile(r"//@compartments\.(\d+)")
+_XML_RE = re.compile(r"(<\?xml.*?)?<seir:SEIRModel\b.*?</seir:SEIRModel>", re.DOTALL)
+
+
+def extract_xml(text: str) -> str:
+    """
+    Returns the SEIR model XML inside an LLM response or transcript,
+    dropping markdown fences and surrounding prose. Returns the stripped
+    text unchanged if no model is found.
+    """
+    match = _XML_RE.search(text)
+    return match.group(0).strip() if match else text.strip()
+
+
+def parse_compartments(xml_text: str) -> list:
+    """
+    Parses model XML into a list of compartments:
+
+        [{"PrimaryName": ..., "SecondaryName": ...,
+          "flows": [{"rate": "0.4", "target": 3, "description": ...}, ...]}, ...]
+
+    Rates are kept as strings since LLM1 output still holds placeholders.
+    """
+    root = ET.fromstring(extract_xml(xml_text))
+    compartments = []
+    for element in root.findall("compartments"):
+        flows = []
+        for flow in element.findall("outgoingFlows"):
+            match = TARGET_RE.fullmatch(flow.get("target", "").strip())
+            flows.append({
+                "rate": flow.get("rate", "").strip(),
+                "target": int(match.group(1)) if match else None,
+                "description": flow.get("description"),
+            })
+        compartments.append({
+            "PrimaryName": element.get("PrimaryName", ""),
+            "SecondaryName": element.get("SecondaryName", ""),
+            "population": element.get("population"),
+            "flows": flows,
+        })
+    return compartments
+
+
+XML_HEADER = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<seir:SEIRModel xmi:version="2.0" xmlns:xmi="http://www.omg.org/XMI" '
+    'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xmlns:seir="http://example.com/seirmodel">'
+)
+XML_FOOTER = "</seir:SEIRModel>"
+
+
+def read_compartments(xml_text: str) -> list:
+    """Model XML as a list of (compartment attributes, [flow attributes]); comments are dropped."""
+    root = ET.fromstring(extract_xml(xml_text))
+    return [
+        (dict(element.attrib), [dict(flow.attrib) for flow in element.findall("outgoingFlows")])
+        for element in root.findall("compartments")
+    ]
+
+
+def render(compartments: list) -> str:
+    """Inverse of read_compartments, in the layout of covid.serimodel."""
+    lines = [XML_HEADER]
+    for attributes, flows in compartments:
+        opening = "  <compartments" + "".join(f" {key}={quoteattr(value)}" for key, value in attributes.items())
+        if not flows:
+            lines.append(opening + "/>")
+            continue
+        lines.append(opening + ">")
+        for flow in flows:
+            lines.append("    <outgoingFlows" + "".join(f" {key}={quoteattr(value)}" for key, value in flow.items()) + "/>")
+        lines.append("  </compartments>")
+    lines.append(XML_FOOTER)
+    return "\n".join(lines)
+
+
+class ModelValidationError(ValueError):
+    """Raised when a .serimodel file breaks the metamodel's structural rules."""
+
+
+class CompiledModel:
+    """
+    Array form of a model. Compartment names are interned in `name_table`
+    and referenced by `primary_ids`/`secondary_ids`. Flows are stored CSR
+    style: the flows leaving compartment i are `targets[indptr[i]:indptr[i + 1]]`
+    with the matching per-capita `rates`, in document order.
+    """
+
+    def __init__(self, name_table: list, primary_ids, secondary_ids, indptr, targets, rates, populations=None):
+        self.name_table = list(name_table)
+        self.primary_ids = np.asarray(primary_ids, dtype=np.int32)
+        self.secondary_ids = np.asarray(secondary_ids, dtype=np.int32)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.targets = np.asarray(targets, dtype=np.int32)
+        self.rates = np.asarray(rates, dtype=np.float64)
+        self.populations = None if populations is None else np.asarray(populations, dtype=np.float64)
+        self._sources = None
+
+    @property
+    def n_compartments(self) -> int:
+        return len(self.indptr) - 1
+
+    @property
+    def n_flows(self) -> int:
+        return len(self.targets)
+
+    @property
+    def sources(self) -> np.ndarray:
+        """Source compartment of every flow (expanded from `indptr`)."""
+        if self._sources is None:
+            self._sources = np.repeat(np.arange(self.n_compartments, dtype=np.int32), np.diff(self.indptr))
+        return self._sources
+
+    @property
+    def primary_names(self) -> list:
+        return [self.name_table[i] for i in self.primary_ids]
+
+    @property
+    def secondary_names(self) -> list:
+        return [self.name_table[i] for i in self.secondary_ids]
+
+    @property
+    def names(self) -> list:
+        return [f"{p} ({s})" if s else p for p, s in zip(self.primary_names, self.secondary_names)]
+
+    def derivative(self, x, rates=None) -> np.ndarray:
+        """
+        dx/dt for states `x` ((n,) or (batch, n)) computed straight from the
+        flow arrays: every flow's flux rate * x[source] is summed into its
+        target and out of its source with bincount, in O(batch * n_flows)
+        time and memory. `rates` may be (n_flows,) or (batch, n_flows).
+        """
+        rates = self.rates if rates is None else np.asarray(rates, dtype=np.float64)
+        flux = rates * np.asarray(x, dtype=np.float64)[..., self.sources]
+        flat = flux.reshape(-1, self.n_flows)
+        n, rows = self.n_compartments, flat.shape[0]
+        offsets = (np.arange(rows, dtype=np.int64) * n)[:, None]
+        size = rows * n
+        derivative = (np.bincount((offsets + self.targets).ravel(), flat.ravel(), size)
+                      - np.bincount((offsets + self.sources).ravel(), flat.ravel(), size))
+        return derivative.reshape(flux.shape[:-1] + (n,))
+
+    def incidence(self) -> np.ndarray:
+        """(n_flows, n_compartments) matrix: -1 at each flow's source, +1 at its target (dense; small models only)."""
+        matrix = np.zeros((self.n_flows, self.n_compartments))
+        flows = np.arange(self.n_flows)
+        np.add.at(matrix, (flows, self.sources), -1.0)
+        np.add.at(matrix, (flows, self.targets), 1.0)
+        return matrix
+
+    def rate_matrix(self, rates=None) -> np.ndarray:
+        """
+        Dense generator matrix A with dx/dt = A @ x. `rates` may be
+        (n_flows,) or a batch (batch, n_flows), giving (n, n) or (batch, n, n),
+        i.e. O(batch * n^2) memory; large models should use derivative().
+        """
+        rates = self.rates if rates is None else np.asarray(rates, dtype=np.float64)
+        n = self.n_compartments
+        sources = self.sources.astype(np.int64)
+        targets = self.targets.astype(np.int64)
+        flat_rates = rates.reshape(-1, self.n_flows)
+        matrix = np.zeros((flat_rates.shape[0], n * n))
+        # Scatter every flow into A[target, source] (+rate) and A[source, source] (-rate).
+        np.add.at(matrix, (slice(None), targets * n + sources), flat_rates)
+        np.add.at(matrix, (slice(None), sources * n + sources), -flat_rates)
+        return matrix.reshape(rates.shape[:-1] + (n, n))
+
+
+def compile_model(xml_text: str, rules: dict = None) -> CompiledModel:
+    """Compiles model XML text (an LLM response is fine) into a CompiledModel."""
+    return _compile(io.BytesIO(extract_xml(xml_text).encode("utf-8")), rules)
+
+
+def load(path: str, rules: dict = None) -> CompiledModel:
+    """Loads a .serimodel file, or a file written by save_compiled()."""
+    with open(path, "rb") as f:
+        is_compiled = f.read(len(_MAGIC)) == _MAGIC
+    return load_compiled(path) if is_compiled else _compile(path, rules)
+
+
+def _compile(source, rules: dict = None) -> CompiledModel:
+    """Streams `source` with iterparse, validating as it goes."""
+    rules = rules or streaming.load_rules()
+    name_ids = {}
+    primary_ids, secondary_ids, populations = [], [], []
+    indptr, targets, rates = [0], [], []
+    pairs = set()
+    depth = 0
+
+    def intern(name: str) -> int:
+        return name_ids.setdefault(name, len(name_ids))
+
+    for event, element in ET.iterparse(source, events=("start", "end")):
+        if event == "start":
+            depth += 1
+            if depth == 1 and element.tag != rules["root_tag"]:
+                raise ModelValidationError(f"Root element is {element.tag!r}, expected {rules['root_tag']!r}")
+            if depth == 2 and element.tag != rules["compartment_tag"]:
+                raise ModelValidationError(f"Unexpected element <{element.tag}> in the model")
+            if depth == 3 and element.tag != rules["flow_tag"]:
+                raise ModelValidationError(f"Unexpected element <{element.tag}> in compartment {len(primary_ids)}")
+            if depth > 3:
+                raise ModelValidationError(f"Unexpected nested element <{element.tag}>")
+            continue
+
+        depth -= 1
+        if depth == 2:
+            index = len(primary_ids)
+            missing = [name for name in rules["flow_required"] if not element.get(name)]
+            if missing:
+                raise ModelValidationError(f"A flow of compartment {index} is missing {missing}")
+            match = rules["target_re"].match(element.get("target").strip())
+            if not match:
+                raise ModelValidationError(f"Malformed target {element.get('target')!r} in compartment {index}")
+            try:
+                rate = float(element.get("rate"))
+            except ValueError:
+                raise ModelValidationError(
+                    f"Compartment {index} has a non-numeric rate {element.get('rate')!r}"
+                ) from None
+            targets.append(int(match.group(1)))
+            rates.append(rate)
+        elif depth == 1:
+            index = len(primary_ids)
+            missing = [name for name in rules["compartment_required"] if not element.get(name)]
+            if missing:
+                raise ModelValidationError(f"Compartment {index} is missing {missing}")
+            pair = (element.get("PrimaryName"), element.get("SecondaryName", ""))
+            if pair in pairs:
+                raise ModelValidationError(f"Compartment {index} repeats the name pair {pair}")
+            pairs.add(pair)
+            primary_ids.append(intern(pair[0]))
+            secondary_ids.append(intern(pair[1]))
+            population = element.get("population")
+            populations.append(float(population) if population is not None else None)
+            indptr.append(len(targets))
+            # Flows are already folded into the arrays; drop the subtree.
+            element.clear()
+
+    n = len(primary_ids)
+    if targets and max(targets) >= n:
+        raise ModelValidationError(f"A flow targets compartment {max(targets)} but only {n} compartments exist")
+    return CompiledModel(
+        list(name_ids), primary_ids, secondary_ids, indptr, targets, rates,
+        None if None in populations else populations,
+    )
+
+
+_MAGIC = b"SEIRCMP1"
+_ALIGN = 64
+_ARRAYS = ("primary_ids", "secondary_ids", "indptr", "targets", "rates", "populations")
+
+
+def save_compiled(model: CompiledModel, path: str):
+    """
+    Writes `model` as: magic, header length (uint64), JSON header with the
+    name table and each array's dtype/shape/offset, then the raw arrays,
+    each aligned to 64 bytes.
+    """
+    arrays = {name: getattr(model, name) for name in _ARRAYS if getattr(model, name) is not None}
+    layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        layout[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset += -(-array.nbytes // _ALIGN) * _ALIGN
+    header = json.dumps({"name_table": model.name_table, "arrays": layout}, ensure_ascii=False).encode("utf-8")
+    data_start = -(-(len(_MAGIC) + 8 + len(header)) // _ALIGN) * _ALIGN
+
+    with open(path, "wb") as f:
+        f.write(_MAGIC)
+        f.write(len(header).to_bytes(8, "little"))
+        f.write(header)
+        for name, array in arrays.items():
+            f.seek(data_start + layout[name]["offset"])
+            f.write(np.ascontiguousarray(array).tobytes())
+        f.truncate(data_start + offset)
+
+
+def load_compiled(path: str, mmap: bool = True) -> CompiledModel:
+    """Opens a save_compiled() file; with `mmap` the arrays are read-only memory maps."""
+    with open(path, "rb") as f:
+        if f.read(len(_MAGIC)) != _MAGIC:
+            raise ValueError(f"'{path}' is not a compiled SEIR model")
+        header_length = int.from_bytes(f.read(8), "little")
+        header = json.loads(f.read(header_length).decode("utf-8"))
+    data_start = -(-(len(_MAGIC) + 8 + header_length) // _ALIGN) * _ALIGN
+
+    arrays = {}
+    for name, spec in header["arrays"].items():
+        dtype = np.dtype(spec["dtype"])
+        shape = tuple(spec["shape"])
+        offset = data_start + spec["offset"]
+        if mmap and np.prod(shape) > 0:
+            arrays[name] = np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape)
+        else:
+            arrays[name] = np.fromfile(path, dtype=dtype, count=int(np.prod(shape)), offset=offset).reshape(shape)
+    return CompiledModel(header["name_table"], **arrays)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Validate a .serimodel file and write its compiled binary form.")
+    parser.add_argument("model", help="path to a .serimodel file")
+    parser.add_argument("--output", help="compiled file to write (defaults to <model>c)")
+    args = parser.parse_args()
+
+    compiled = load(args.model)
+    output = args.output or args.model + "c"
+    save_compiled(compiled, output)
+    print(f"{compiled.n_compartments} compartments, {compiled.n_flows} flows -> {output}")
@@ -0,0 +1,506 @@
+"""
+Long-running generation service.
+
+Running the script once per model pays every time for interpreter start,
+importing google.generativeai and PIL, configuring the client and reading
+the spec files. A Service keeps all of that warm. Jobs are accepted into a
+bounded queue, and when it is full they are refused at once (HTTP 503 with
+Retry-After) instead of piling up. A pool of worker threads runs them
+through generate_seirmodel_from_image.
+
+HTTP API, on a TCP port or a Unix socket:
+
+    POST /jobs              {"image", "user_input", "spec", "output", "options"}
+                            -> 202 {"id", "status", "url"}; 503 when the queue is full
+    GET  /jobs/<id>         status and result; ?wait=SECONDS blocks until the job ends
+    GET  /jobs/<id>/events  server-sent events: status changes and per-stage
+                            timings until the job ends
+    GET  /stats             queue depth, counters and latency percentiles
+
+Clients are confined to the service's root directory (--root, default
+the working directory). `image`, `spec` and `output` are resolved
+relative to it. `user_input` is resolved like a batch manifest entry
+(main.py constant, file path or literal text), but only from files under
+the root. Any path that leaves the root is refused with 400. `options`
+may set local_rates, stream_llm1,
+preprocess_options, partition_size, fast_path, incremental,
+compact_prompts and lean.
+"""
+import argparse
+import collections
+import http.client
+import json
+import os
+import queue
+import socket
+import socketserver
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import backends
+import batch
+import instrumentation
+import main
+import resilience
+import serimodel
+
+
+JOB_OPTIONS = {"local_rates", "stream_llm1", "preprocess_options", "partition_size", "fast_path", "incremental",
+               "compact_prompts", "lean"}
+
+
+class QueueFull(RuntimeError):
+    """Raised by Service.submit when the job queue is at capacity."""
+
+
+class Job:
+    """One submitted job; `events` collects status changes and stage timings."""
+
+    def __init__(self, request: dict, inputs: dict = None):
+        self.id = uuid.uuid4().hex[:12]
+        self.request = request
+        # The request with its paths resolved and its user input read.
+        self.inputs = inputs if inputs is not None else request
+        self.status = "queued"
+        self.result = None
+        self.ok = None
+        self.xml = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.events = []
+        self._changed = threading.Condition()
+        self.add_event({"event": "queued"})
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("done", "failed")
+
+    def add_event(self, event: dict):
+        with self._changed:
+            self.events.append(event)
+            self._changed.notify_all()
+
+    def wait(self, timeout: float = None) -> bool:
+        with self._changed:
+            return self._changed.wait_for(lambda: self.done, timeout)
+
+    def events_after(self, index: int, timeout: float = None) -> list:
+        """Events from position `index` on, waiting up to `timeout` for new ones."""
+        with self._changed:
+            self._changed.wait_for(lambda: len(self.events) > index or self.done, timeout)
+            return self.events[index:]
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "status": self.status,
+            "ok": self.ok,
+            "result": self.result,
+            "output": self.request.get("output"),
+            "xml": self.xml,
+            "queue_seconds": (self.started or time.time()) - self.created,
+            "run_seconds": self.finished - self.started if self.finished and self.started else None,
+        }
+
+
+class Service:
+    """
+    Warm backend plus bounded queue plus worker threads. `retry_options`
+    and `requests_per_minute` are applied as in batch.run_batch; any other
+    keyword options are the defaults for every job. Job paths must lie
+    under `root` (default: the working directory).
+    """
+
+    def __init__(self, backend=None, workers: int = 4, max_queue: int = 32, cache=None,
+                 requests_per_minute: float = None, retry_options: dict = None, metrics_path: str = None,
+                 run_store=None, max_finished: int = 1000, root: str = None, **defaults):
+        timeout = (retry_options or {}).get("timeout", resilience.DEFAULT_TIMEOUT)
+        backend = batch.RateLimitedBackend(backend or backends.GeminiBackend(main.MODEL_NAME, timeout=timeout),
+                                           batch.RateLimiter(requests_per_minute))
+        if retry_options is not None:
+            backend = resilience.ResilientBackend(backend, **retry_options)
+        self.backend = backend
+        self.root = os.path.realpath(root or os.getcwd())
+        self.cache = cache
+        self.run_store = run_store
+        self.defaults = defaults
+        self.metrics_path = metrics_path
+        self.max_finished = max_finished
+        self.workers = workers
+        self.counters = collections.Counter()
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._jobs = collections.OrderedDict()
+        self._latencies = collections.deque(maxlen=1000)
+        self._lock = threading.Lock()
+        self._threads = []
+        self._busy = 0
+
+    def start(self):
+        """Warms the backend client and starts the workers."""
+        getattr(self.backend, "warm", lambda: None)()
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"job-worker-{number}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def submit(self, request: dict) -> Job:
+        missing = {"image", "user_input", "spec", "output"} - request.keys()
+        if missing:
+            raise ValueError(f"Job is missing keys: {sorted(missing)}")
+        unknown = set(request.get("options", {})) - JOB_OPTIONS
+        if unknown:
+            raise ValueError(f"Unknown job options: {sorted(unknown)}")
+        inputs = {**request, "user_input": self._user_input(request["user_input"])}
+        for key in ("image", "spec", "output"):
+            inputs[key] = self._path(request[key], key)
+        job = Job(request, inputs)
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                self.counters["rejected"] += 1
+            raise QueueFull(f"The job queue is full ({self._queue.maxsize} jobs)") from None
+        with self._lock:
+            self.counters["submitted"] += 1
+            self._jobs[job.id] = job
+            while len(self._jobs) > self.max_finished + self._queue.maxsize + self.workers:
+                oldest_id, oldest = next(iter(self._jobs.items()))
+                if not oldest.done:
+                    break
+                del self._jobs[oldest_id]
+        return job
+
+    def _path(self, value, key: str) -> str:
+        """`value` resolved against the root; ValueError when it is not a string or leaves the root."""
+        if not isinstance(value, str) or not value:
+            raise ValueError(f"Job {key} must be a non-empty path")
+        path = os.path.realpath(os.path.join(self.root, value))
+        if os.path.commonpath([self.root, path]) != self.root:
+            raise ValueError(f"Job {key} {value!r} is outside the service root")
+        return path
+
+    def _user_input(self, value) -> str:
+        """A main.py constant, a file under the root, or else the literal text."""
+        if not isinstance(value, str):
+            raise ValueError("Job user_input must be a string")
+        if isinstance(getattr(main, value, None), str):
+            return getattr(main, value)
+        path = os.path.realpath(os.path.join(self.root, value)) if "\0" not in value else None
+        if path is not None and os.path.isfile(path):
+            with open(self._path(value, "user_input"), "r", encoding="utf-8") as f:
+                return f.read()
+        return value
+
+    def get(self, job_id: str):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            with self._lock:
+                self._busy += 1
+            try:
+                self._run(job)
+            finally:
+                with self._lock:
+                    self._busy -= 1
+
+    def _run(self, job: Job):
+        job.started = time.time()
+        job.status = "running"
+        job.add_event({"event": "running", "queue_seconds": job.started - job.created})
+        request = job.inputs
+        recorder = instrumentation.Recorder(self.metrics_path,
+                                            hooks=[lambda event: job.add_event({"event": "stage", **event})])
+        try:
+            result = main.generate_seirmodel_from_image(
+                request["image"], request["user_input"], request["spec"],
+                request["output"], backend=self.backend, cache=self.cache, recorder=recorder,
+                run_store=self.run_store,
+                **{**self.defaults, **request.get("options", {})},
+            )
+            job.ok = result.startswith("SEIR model successfully")
+            if job.ok:
+                with open(main.output_path(request["output"]), "r", encoding="utf-8") as f:
+                    job.xml = serimodel.extract_xml(f.read().split("LLM2'S RESPONSE:")[-1])
+        except Exception as err:
+            job.ok = False
+            result = f"An unexpected error occurred: {err}"
+        job.result = result
+        job.finished = time.time()
+        with self._lock:
+            self.counters["succeeded" if job.ok else "failed"] += 1
+            self._latencies.append(job.finished - job.created)
+        job.status = "done" if job.ok else "failed"
+        job.add_event({"event": job.status, "result": result, "seconds": job.finished - job.created})
+
+    def stats(self) -> dict:
+        with self._lock:
+            latencies = list(self._latencies)
+            stats = {
+                "queued": self._queue.qsize(),
+                "capacity": self._queue.maxsize,
+                "busy_workers": self._busy,
+                "workers": self.workers,
+                **{name: self.counters.get(name, 0) for name in ("submitted", "rejected", "succeeded", "failed")},
+                "p50": instrumentation.percentile(latencies, 50),
+                "p95": instrumentation.percentile(latencies, 95),
+            }
+        if hasattr(self.backend, "stats"):
+            stats["calls"] = self.backend.stats()
+        return stats
+
+
+class _Handler(BaseHTTPRequestHandler):
+    service = None
+    verbose = False
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/jobs":
+            return self._send(404, {"error": f"Unknown path {self.path}"})
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            job = self.service.submit(json.loads(self.rfile.read(length) or b"{}"))
+        except QueueFull as err:
+            return self._send(503, {"error": str(err)}, {"Retry-After": "1"})
+        except ValueError as err:
+            return self._send(400, {"error": str(err)})
+        self._send(202, {"id": job.id, "status": job.status, "url": f"/jobs/{job.id}"})
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        parts = [part for part in url.path.split("/") if part]
+        if parts == ["stats"]:
+            return self._send(200, self.service.stats())
+        if len(parts) in (2, 3) and parts[0] == "jobs":
+            job = self.service.get(parts[1])
+            if job is None:
+                return self._send(404, {"error": f"No job {parts[1]}"})
+            if len(parts) == 3 and parts[2] == "events":
+                return self._stream_events(job)
+            wait = urllib.parse.parse_qs(url.query).get("wait")
+            if wait:
+                job.wait(float(wait[0]))
+            return self._send(200, job.to_dict())
+        self._send(404, {"error": f"Unknown path {self.path}"})
+
+    def _stream_events(self, job: Job):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        index = 0
+        while True:
+            events = job.events_after(index, timeout=15)
+            try:
+                if not events:
+                    self.wfile.write(b": keep-alive\n\n")
+                for event in events:
+                    self.wfile.write(f"data: {json.dumps(event, default=str)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                return
+            index += len(events)
+            if job.done and index >= len(job.events):
+                return
+
+    def _send(self, status: int, body: dict, headers: dict = None):
+        data = json.dumps(body, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def address_string(self):
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+    def log_message(self, format, *args):
+        if self.verbose:
+            super().log_message(format, *args)
+
+
+class _UnixHTTPServer(ThreadingHTTPServer):
+    address_family = socket.AF_UNIX
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+        socketserver.TCPServer.server_bind(self)
+        self.server_name = "localhost"
+        self.server_port = 0
+
+
+def make_server(service: Service, host: str = "127.0.0.1", port: int = 8765, socket_path: str = None,
+                verbose: bool = False):
+    """HTTP server for `service` on host:port, or on a Unix socket when `socket_path` is given."""
+    handler = type("Handler", (_Handler,), {"service": service, "verbose": verbose})
+    if socket_path:
+        return _UnixHTTPServer(socket_path, handler)
+    return ThreadingHTTPServer((host, port), handler)
+
+
+class _UnixConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path: str, timeout: float = None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def request(address: str, method: str, path: str, body: dict = None, timeout: float = 300) -> tuple:
+    """
+    Minimal client. `address` is "http://host:port" or "unix:/path/to.sock".
+    Returns (status, decoded JSON body).
+    """
+    if address.startswith("unix:"):
+        connection = _UnixConnection(address[len("unix:"):], timeout=timeout)
+    else:
+        parsed = urllib.parse.urlsplit(address)
+        connection = http.client.HTTPConnection(parsed.hostname, parsed.port, timeout=timeout)
+    try:
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        connection.request(method, path, body=data, headers={"Content-Type": "application/json"} if data else {})
+        response = connection.getresponse()
+        return response.status, json.loads(response.read() or b"null")
+    finally:
+        connection.close()
+
+
+def run_job(address: str, job: dict, timeout: float = 300) -> dict:
+    """Submits `job`, retrying while the queue is full, and waits for its result."""
+    deadline = time.monotonic() + timeout
+    while True:
+        status, body = request(address, "POST", "/jobs", job)
+        if status != 503 or time.monotonic() > deadline:
+            break
+        time.sleep(0.2)
+    if status != 202:
+        raise RuntimeError(f"Job was not accepted ({status}): {body.get('error')}")
+    while True:
+        _, result = request(address, "GET", f"/jobs/{body['id']}?wait=30")
+        if result["status"] in ("done", "failed") or time.monotonic() > deadline:
+            return result
+
+
+_ONE_SHOT = """
+import json, sys, time
+start = time.perf_counter()
+import backends, batch, main
+job = json.loads(sys.argv[1])
+backend = backends.FakeBackend(latency=float(sys.argv[2])) if sys.argv[2] != "none" else None
+main.generate_seirmodel_from_image(job["image"], batch.resolve_user_input(job["user_input"]), job["spec"],
+                                   job["output"], backend=backend, **job.get("options", {}))
+"""
+
+
+def compare_latency(jobs: list, fake_latency: float = None) -> dict:
+    """
+    Per-job latency of the one-shot script (a fresh interpreter per job)
+    against the same jobs sent one at a time to a warm in-process service.
+    With `fake_latency` both sides use a FakeBackend instead of Gemini.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    one_shot = []
+    for job in jobs:
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", _ONE_SHOT, json.dumps(job),
+                        "none" if fake_latency is None else str(fake_latency)],
+                       cwd=here, check=True, capture_output=True)
+        one_shot.append(time.perf_counter() - start)
+
+    backend = backends.FakeBackend(latency=fake_latency) if fake_latency is not None else None
+    service = Service(backend, workers=1, root=here).start()
+    server = make_server(service, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    address = f"http://127.0.0.1:{server.server_address[1]}"
+    served = []
+    try:
+        for job in jobs:
+            start = time.perf_counter()
+            run_job(address, job)
+            served.append(time.perf_counter() - start)
+    finally:
+        server.shutdown()
+        service.stop()
+    return {
+        "one_shot_p50": instrumentation.percentile(one_shot, 50),
+        "service_p50": instrumentation.percentile(served, 50),
+        "one_shot": one_shot,
+        "service": served,
+    }
+
+
+if __name__ == "__main__":
+    import llm_cache
+    import run_store
+
+    parser = argparse.ArgumentParser(description="Serve generate_seirmodel_from_image over HTTP with a warm backend.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--socket", metavar="PATH", default=None, help="listen on a Unix socket instead of TCP")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--queue", type=int, default=32, help="jobs waiting beyond this are refused with 503")
+    parser.add_argument("--rpm", type=float, default=None, help="maximum model requests per minute")
+    parser.add_argument("--fake", type=float, metavar="LATENCY", default=None,
+                        help="use a local fake backend with this per-call latency instead of Gemini")
+    parser.add_argument("--replay", metavar="DIR", default=None, help="serve recorded responses from DIR offline")
+    parser.add_argument("--cache", metavar="DIR", nargs="?", const=llm_cache.DEFAULT_CACHE_DIR, default=None,
+                        help="reuse LLM responses from an on-disk cache")
+    parser.add_argument("--store", metavar="DIR", nargs="?", const=run_store.DEFAULT_STORE_DIR, default=None,
+                        help="index runs in a run store; reuse results and structures of earlier runs")
+    parser.add_argument("--metrics", metavar="JSONL", default=None, help="append per-stage measurements to JSONL")
+    parser.add_argument("--compare", metavar="MANIFEST", default=None,
+                        help="compare per-job latency of the one-shot script and the service, then exit")
+    parser.add_argument("--root", default=None,
+                        help="directory job paths are resolved in and confined to (default: working directory)")
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    args = parser.parse_args()
+
+    if args.compare:
+        comparison = compare_latency(batch.load_manifest(args.compare), args.fake)
+        print(f"one-shot script: p50 {comparison['one_shot_p50']:.3f}s per job")
+        print(f"warm service:    p50 {comparison['service_p50']:.3f}s per job")
+        sys.exit(0)
+
+    if args.fake is not None:
+        backend = backends.FakeBackend(latency=args.fake)
+    elif args.replay:
+        backend = backends.ReplayBackend(args.replay)
+    else:
+        backend = None
+    service = Service(backend, args.workers, args.queue, llm_cache.ResponseCache(args.cache) if args.cache else None,
+                      args.rpm, retry_options={}, metrics_path=args.metrics,
+                      run_store=run_store.RunStore(args.store) if args.store else None, root=args.root).start()
+    server = make_server(service, args.host, args.port, args.socket, args.verbose)
+    where = f"unix:{args.socket}" if args.socket else f"http://{args.host}:{server.server_address[1]}"
+    print(f"Serving on {where} with {args.workers} workers (queue {args.queue})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.stop()
@@ -0,0 +1,221 @@
+"""
+Streaming LLM1 generation with incremental validation against metamodel.txt.
+
+The LLM1 response is fed to an XMLPullParser chunk by chunk as it arrives.
+As soon as the stream can no longer become a valid SEIR model (prose or a
+markdown fence in the middle of the XML, a wrong root, an unknown element,
+a flow without a rate or a malformed `//@compartments.N` target, ...) the
+stream is cancelled and the request retried, instead of paying for the rest
+of the generation and the LLM2 call that follows.
+"""
+import json
+import os
+import re
+import xml.etree.ElementTree as ET
+
+
+METAMODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "metamodel.txt")
+RATE_PLACEHOLDER = "[[rate_missing]]"
+
+# Whitespace and at most one (possibly still incomplete) ```xml fence.
+_FENCE_PREFIX_RE = re.compile(r"^\s*(`{1,3}[A-Za-z]*)?\s*$")
+_NUMBER_RE = re.compile(r"^[+-]?(\d+(\.\d*)?|\.\d+)([eE][+-]?\d+)?$")
+
+
+class StreamValidationError(ValueError):
+    """Raised when a streamed response can no longer become a valid model."""
+
+
+class StreamAbortedError(RuntimeError):
+    """Raised when every streaming attempt was aborted."""
+
+    def __init__(self, message: str, errors: list):
+        super().__init__(message)
+        self.errors = errors
+
+
+def load_rules(metamodel_path: str = METAMODEL_PATH) -> dict:
+    """Extracts the structural rules the validator enforces from metamodel.txt."""
+    with open(metamodel_path, "r", encoding="utf-8") as f:
+        structure = json.load(f)["seirmodel_metamodel"]["structure"]
+
+    root = structure["root_element"]
+    prefix, local_name = root["tag"].split(":", 1)
+    target_format = re.search(r"'([^']+)'", structure["outgoingFlows"]["constraints"]["target"]).group(1)
+    target_pattern = re.escape(target_format).replace("X", r"(\d+)")
+    return {
+        "root_qname": root["tag"],
+        "root_tag": f"{{{root['attributes'][f'xmlns:{prefix}']}}}{local_name}",
+        "compartment_tag": structure["compartments"]["element"],
+        "compartment_required": structure["compartments"]["required_attributes"],
+        "compartment_allowed": set(structure["compartments"]["required_attributes"])
+                               | set(structure["compartments"]["optional_attributes"]),
+        "flow_tag": structure["outgoingFlows"]["element"],
+        "flow_required": structure["outgoingFlows"]["required_attributes"],
+        "flow_allowed": set(structure["outgoingFlows"]["required_attributes"])
+                        | set(structure["outgoingFlows"]["optional_attributes"]),
+        "target_re": re.compile(f"^{target_pattern}$"),
+    }
+
+
+class IncrementalValidator:
+    """
+    Incremental checker for a streamed SEIR model. Call feed() with each
+    chunk; it raises StreamValidationError the moment the document becomes
+    unrecoverable. `done` turns True once the root element is closed, and
+    `xml` holds the accepted document text (without any markdown fence).
+    """
+
+    def __init__(self, rules: dict = None):
+        self.rules = rules or load_rules()
+        self.parser = ET.XMLPullParser(events=("start", "end"))
+        self.compartments = 0
+        self.targets = []
+        self.done = False
+        self._stack = []
+        self._started = False
+        self._pending = ""
+        self._parts = []
+
+    def feed(self, chunk: str):
+        if self.done:
+            return
+        if not self._started:
+            # Buffer until the first tag so a leading ```xml fence can be dropped.
+            self._pending += chunk
+            start = self._pending.find("<")
+            prefix = self._pending if start == -1 else self._pending[:start]
+            if not _FENCE_PREFIX_RE.match(prefix):
+                raise StreamValidationError(f"Text before the XML: {prefix.strip()[:40]!r}")
+            if start == -1:
+                return
+            self._started = True
+            chunk = self._pending[start:]
+
+        self._parts.append(chunk)
+        try:
+            self.parser.feed(chunk)
+            self._drain()
+        except ET.ParseError as err:
+            # Anything after the closing root tag (usually a ``` fence) is
+            # junk to expat; it is only an error if the model is incomplete.
+            if not self.done:
+                raise StreamValidationError(f"Malformed XML: {err}") from err
+
+    def close(self) -> str:
+        """Finishes validation once the stream has ended; returns the XML."""
+        if not self.done:
+            raise StreamValidationError("Stream ended before the root element was closed")
+        for target in self.targets:
+            if target >= self.compartments:
+                raise StreamValidationError(
+                    f"Flow targets compartment {target} but only {self.compartments} compartments exist"
+                )
+        return self.xml
+
+    @property
+    def xml(self) -> str:
+        text = "".join(self._parts)
+        if self.done:
+            closing = f"</{self.rules['root_qname']}>"
+            end = text.find(closing)
+            if end != -1:
+                text = text[:end + len(closing)]
+        return text.strip()
+
+    def _drain(self):
+        for event, element in self.parser.read_events():
+            if event == "start":
+                self._start(element)
+            else:
+                self._end(element)
+
+    def _start(self, element):
+        rules = self.rules
+        depth = len(self._stack) + 1
+        if depth > 1:
+            parent = self._stack[-1]
+            preceding = parent.text if len(parent) == 1 else parent[-2].tail
+            _check_no_text(preceding)
+        self._stack.append(element)
+
+        if depth == 1:
+            if element.tag != rules["root_tag"]:
+                raise StreamValidationError(f"Root element is {element.tag!r}, expected {rules['root_tag']!r}")
+        elif depth == 2:
+            _check_attributes(element, rules["compartment_tag"], rules["compartment_required"],
+                              rules["compartment_allowed"])
+            self.compartments += 1
+        elif depth == 3:
+            _check_attributes(element, rules["flow_tag"], rules["flow_required"], rules["flow_allowed"])
+            rate = element.get("rate").strip()
+            if rate != RATE_PLACEHOLDER and not _NUMBER_RE.match(rate):
+                raise StreamValidationError(f"Rate {rate!r} is neither numeric nor {RATE_PLACEHOLDER}")
+            match = rules["target_re"].match(element.get("target").strip())
+            if not match:
+                raise StreamValidationError(f"Malformed flow target {element.get('target')!r}")
+            self.targets.append(int(match.group(1)))
+        else:
+            raise StreamValidationError(f"Unexpected nested element <{element.tag}>")
+
+    def _end(self, element):
+        self._stack.pop()
+        _check_no_text(element[-1].tail if len(element) else element.text)
+        if not self._stack:
+            self.done = True
+
+
+def _check_no_text(text):
+    if text and text.strip():
+        raise StreamValidationError(f"Unexpected text inside the model: {text.strip()[:40]!r}")
+
+
+def _check_attributes(element, tag: str, required: list, allowed: set):
+    if element.tag != tag:
+        raise StreamValidationError(f"Unexpected element <{element.tag}>, expected <{tag}>")
+    missing = [name for name in required if not element.get(name)]
+    if missing:
+        raise StreamValidationError(f"<{tag}> is missing required attributes {missing}")
+    unknown = set(element.attrib) - allowed
+    if unknown:
+        raise StreamValidationError(f"<{tag}> has unknown attributes {sorted(unknown)}")
+
+
+def generate_validated(backend, parts, max_attempts: int = 3, rules: dict = None, stats: dict = None) -> str:
+    """
+    Streams a response from `backend`, validating it incrementally, and
+    retries up to `max_attempts` times when the stream turns invalid.
+    Returns the validated XML. Once the root element closes the stream is
+    cancelled, so trailing chatter is never paid for.
+
+    If `stats` is given it is updated with attempts, aborts and the number of
+    characters received in aborted attempts.
+    """
+    rules = rules or load_rules()
+    stats = stats if stats is not None else {}
+    stats.setdefault("attempts", 0)
+    stats.setdefault("aborted", 0)
+    stats.setdefault("wasted_chars", 0)
+
+    errors = []
+    for _ in range(max_attempts):
+        stats["attempts"] += 1
+        validator = IncrementalValidator(rules)
+        stream = backend.stream(parts)
+        received = 0
+        try:
+            for chunk in stream:
+                received += len(chunk)
+                validator.feed(chunk)
+                if validator.done:
+                    break
+            return validator.close()
+        except StreamValidationError as err:
+            stats["aborted"] += 1
+            stats["wasted_chars"] += received
+            errors.append(str(err))
+            print(f"LLM1 stream aborted after {received} chars: {err}")
+        finally:
+            stream.close()
+
+    raise StreamAbortedError(f"LLM1 stream invalid after {max_attempts} attempts: {errors[-1]}", errors)
@@ -0,0 +1,169 @@
+"""
+Zero-LLM structure for fully tabular inputs.
+
+Inputs such as covidModel, hiv_imp_info_only (markdown Index/Compartment and
+From → To tables) and hiv_json (a Python-literal list of compartments)
+already state every compartment and flow, so LLM1 only re-reads them from
+the image. build_skeleton() parses these formats directly and writes the
+.serimodel following the seirmodel_skeleton.txt conventions: the two
+required header lines, compartments in index order, SecondaryName only for
+grouped compartments and 0-based `//@compartments.N` targets. Rates that the
+input states as plain numbers are written directly; every other rate gets
+the `[[rate_missing]]` placeholder for the rate engine or LLM2.
+
+Flow tables often abbreviate compartment names ("Mild/Mod, iso",
+"Hospital (pre-ICU)"); they are resolved with user_input.name_resolver,
+which rate_engine uses too. If any flow endpoint stays unresolved the input
+is not treated as tabular, and the caller falls back to the LLM.
+"""
+import ast
+import json
+import re
+
+import serimodel
+import user_input
+
+
+_TRAILING_REMARK_RE = re.compile(r"\s*\(([^()]*)\)\s*$")
+_PURE_NUMBER_RE = re.compile(rf"^\s*{user_input.NUMBER}\s*$")
+
+
+class NotTabular(ValueError):
+    """Raised when an input does not fully describe the model's structure."""
+
+
+def build_skeleton(text: str):
+    """Returns the .serimodel XML for a tabular or JSON input, or None when the LLM is needed."""
+    try:
+        return serimodel.render(parse_structure(text))
+    except NotTabular:
+        return None
+
+
+def parse_structure(text: str) -> list:
+    """
+    Parses an input into [(compartment attributes, [flow attributes]), ...]
+    (the form serimodel.render takes). Raises NotTabular with the reason
+    when the input is not fully tabular.
+    """
+    literal = _parse_literal(text)
+    if literal is not None:
+        return _from_literal(literal)
+    return _from_tables(text)
+
+
+def _parse_literal(text: str):
+    stripped = text.strip()
+    if not stripped.startswith(("[", "{")):
+        return None
+    for parse in (json.loads, ast.literal_eval):
+        try:
+            return parse(stripped)
+        except (ValueError, SyntaxError):
+            continue
+    return None
+
+
+def _from_literal(data) -> list:
+    """hiv_json style: a list of {"PrimaryName", "SecondaryName", "outgoingFlows": [...]} dicts."""
+    if isinstance(data, dict):
+        data = data.get("compartments", [data])
+    if not isinstance(data, list) or not all(isinstance(item, dict) and "PrimaryName" in item for item in data):
+        raise NotTabular("The literal is not a list of compartments with a PrimaryName")
+    data = sorted(data, key=lambda item: item.get("compartment_index", 0)) if all(
+        "compartment_index" in item for item in data) else data
+
+    compartments = []
+    for item in data:
+        flows = []
+        for flow in item.get("outgoingFlows") or []:
+            target = flow.get("target")
+            match = serimodel.TARGET_RE.fullmatch(str(target).strip()) if not isinstance(target, int) else None
+            index = target if isinstance(target, int) else int(match.group(1)) if match else None
+            if index is None or not 0 <= index < len(data):
+                raise NotTabular(f"Flow target {target!r} of '{item['PrimaryName']}' is not a compartment index")
+            rate = str(flow.get("rate", "")).strip()
+            flows.append(_flow(rate if _PURE_NUMBER_RE.match(rate) else serimodel.RATE_PLACEHOLDER, index,
+                               str(flow.get("description", "")).strip()))
+        compartments.append((_compartment(str(item["PrimaryName"]), str(item.get("SecondaryName") or "")), flows))
+    return compartments
+
+
+def _from_tables(text: str) -> list:
+    """covidModel / hiv_imp_info_only style: an Index/Compartment table plus a From → To table."""
+    table = user_input.parse_compartment_table(text)
+    if not table:
+        raise NotTabular("The input has no Index/Compartment table")
+    if sorted(index for index, _, _ in table) != list(range(len(table))):
+        raise NotTabular("The compartment table's indices are not 0..n-1")
+    rows = user_input.parse_flow_rows(text)
+    if not rows:
+        raise NotTabular("The input has no From → To flow table")
+
+    names = [split_name(name, subgroup) for _, name, subgroup in sorted(table)]
+    resolve = user_input.name_resolver(
+        [[f"{primary} {secondary}", table_name, primary + secondary]
+         for (_, table_name, _), (primary, secondary, _) in zip(sorted(table), names)],
+        [aliases for _, _, aliases in names],
+    )
+
+    flows = [[] for _ in names]
+    wildcards = []
+    for row in rows:
+        target = resolve(row["target"])
+        if target is None:
+            raise NotTabular(f"Flow target '{row['target']}' matches no compartment")
+        expression = user_input.normalize(row["expression"])
+        rate = expression.strip() if _PURE_NUMBER_RE.match(expression) else serimodel.RATE_PLACEHOLDER
+        if user_input.is_wildcard(row["source"]):
+            wildcards.append((target, rate, row["description"]))
+            continue
+        source = resolve(row["source"])
+        if source is None:
+            raise NotTabular(f"Flow source '{row['source']}' matches no compartment")
+        flows[source].append(_flow(rate, target, row["description"]))
+
+    for target, rate, description in wildcards:
+        for index, ((primary, _, _), compartment_flows) in enumerate(zip(names, flows)):
+            if user_input.wildcard_applies(primary, index, target):
+                compartment_flows.append(_flow(rate, target, description))
+
+    return [(_compartment(primary, secondary), compartment_flows)
+            for (primary, secondary, _), compartment_flows in zip(names, flows)]
+
+
+def split_name(name: str, subgroup: str = "") -> tuple:
+    """
+    (PrimaryName, SecondaryName, aliases) for a table name:
+    'Recruitment_HomosexualMen' with subgroup 'Homosexual Men' ->
+    ('Recruitment', 'Homosexual Men'), 'Exposed (quarantined)' ->
+    ('Exposed', 'quarantined'), 'Susceptible (S)' -> ('Susceptible', '') with alias 'S'.
+    """
+    subgroup_key = user_input.name_key(subgroup)
+    if subgroup_key and user_input.name_key(name).endswith(subgroup_key):
+        for cut in range(len(name) - 1, 0, -1):
+            if user_input.name_key(name[cut:]) == subgroup_key and user_input.name_key(name[:cut]):
+                return name[:cut].rstrip(" _-"), subgroup.strip(), []
+    match = _TRAILING_REMARK_RE.search(name)
+    if match:
+        primary = name[:match.start()].strip()
+        remark = match.group(1).strip()
+        # A short parenthetical such as "(S)" is the compartment's symbol, not a group.
+        if len(remark) <= 3:
+            return primary, "", [remark]
+        return primary, remark, []
+    return name.strip(), "", []
+
+
+def _compartment(primary: str, secondary: str) -> dict:
+    attributes = {"PrimaryName": primary.strip()}
+    if secondary.strip():
+        attributes["SecondaryName"] = secondary.strip()
+    return attributes
+
+
+def _flow(rate: str, target: int, description: str = "") -> dict:
+    flow = {"rate": rate, "target": f"//@compartments.{target}"}
+    if description.strip():
+        flow["description"] = description.strip()
+    return flow
@@ -0,0 +1,64 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import analysis
+import main
+import rate_engine
+import serimodel
+import tabular
+
+
+def test_hiv_skeleton_has_finite_r0():
+    text = main.hiv_imp_info_only
+    model = serimodel.compile_model(rate_engine.fill_rates(tabular.build_skeleton(text), text)[0])
+    infected = dict(zip(model.names, analysis.classify(model)["infected"]))
+    assert not infected["DeathDueToAIDS"] and not infected["NaturalDeath"]
+    r0 = analysis.reproduction_number(model)["R0"]
+    assert np.all(np.isfinite(r0)) and np.all(r0 > 0)
+
+
+def _chain(length: int, rate: float, closing_rate: float = None):
+    """Susceptible → Infectious 0 → ... → Infectious length-1 → Recovered, every flow at `rate`."""
+    compartments = [({"PrimaryName": "Susceptible"}, [{"rate": str(rate), "target": "//@compartments.1"}])]
+    for k in range(length):
+        last = k == length - 1
+        compartments.append(({"PrimaryName": "Infectious", "SecondaryName": f"stage {k}"},
+                             [{"rate": str(closing_rate if last and closing_rate is not None else rate),
+                               "target": f"//@compartments.{k + 2}"}]))
+    compartments.append(({"PrimaryName": "Recovered"}, []))
+    return serimodel.compile_model(serimodel.render(compartments))
+
+
+def test_long_slow_chain_has_finite_r0():
+    # det(V) = 0.01^199 underflows; every stage is still left at rate 0.01.
+    model = _chain(199, 0.01)
+    assert analysis.classify(model)["infected"].sum() == 199
+    r0 = analysis.reproduction_number(model)["R0"]
+    assert np.allclose(r0, 199.0)
+
+
+def test_draws_that_stop_leaving_infection_get_infinite_r0():
+    model = _chain(3, 0.5)
+    rates = np.tile(model.rates, (3, 1))
+    rates[1, -1] = 0.0  # the last infected stage is never left
+    r0 = analysis.reproduction_number(model, rates)["R0"]
+    assert np.isfinite(r0[[0, 2]]).all() and np.isinf(r0[1])
+    assert np.allclose(r0[[0, 2]], 3.0)
+
+
+def test_chunked_draws_match_one_batch():
+    model = _chain(5, 0.3)
+    rates = analysis.sample_rates(model, 50, seed=1)
+    whole = analysis.reproduction_number(model, rates)
+    chunk_bytes = analysis.DENSE_BYTES
+    analysis.DENSE_BYTES = 8 * 5 * 5 * 7
+    try:
+        chunked = analysis.reproduction_number(model, rates)
+    finally:
+        analysis.DENSE_BYTES = chunk_bytes
+    assert np.allclose(whole["R0"], chunked["R0"])
+    assert np.allclose(whole["sensitivity"], chunked["sensitivity"])
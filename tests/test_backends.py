@@ -0,0 +1,65 @@
+import os
+import subprocess
+import sys
+
+import PIL.Image
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import backends
+import main
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMAGE = os.path.join(ROOT, "hivModel(paper).jpeg")
+SPEC = os.path.join(ROOT, "metamodel.txt")
+
+
+def test_importing_main_loads_no_model_sdk():
+    code = "import sys, main; print('google.generativeai' in sys.modules, main._default_backend is None)"
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True,
+                         env={**os.environ, "GOOGLE_API_KEY": ""})
+    assert out.stdout.split() == ["False", "True"]
+
+
+def test_replay_serves_recorded_responses_offline(tmp_path):
+    image = PIL.Image.new("RGB", (4, 4), "white")
+    echo = backends.FakeBackend(response=lambda parts: (parts[-1] if isinstance(parts, list) else parts) * 2)
+    recorder = backends.ReplayBackend(str(tmp_path), inner=echo)
+    assert recorder.generate([image, "ab"]) == "abab"
+    assert "".join(recorder.stream("cd")) == "cdcd"
+
+    replay = backends.ReplayBackend(str(tmp_path), model_name="fake")
+    assert replay.generate([image, "ab"]) == "abab"
+    assert "".join(replay.stream("cd")) == "cdcd"
+    with pytest.raises(LookupError):
+        replay.generate([image, "never recorded"])
+    with pytest.raises(LookupError):
+        replay.generate([PIL.Image.new("RGB", (4, 4), "black"), "ab"])
+
+
+def test_pipeline_runs_offline_from_a_replay(tmp_path):
+    output = str(tmp_path / "out.txt")
+    recorded = backends.ReplayBackend(str(tmp_path / "replays"), inner=backends.FakeBackend())
+    main.generate_seirmodel_from_image(IMAGE, main.covidModel, SPEC, output, backend=recorded, fast_path=False)
+    with open(main.output_path(output), "r", encoding="utf-8") as f:
+        first = f.read()
+
+    replay = backends.ReplayBackend(str(tmp_path / "replays"), model_name="fake")
+    result = main.generate_seirmodel_from_image(IMAGE, main.covidModel, SPEC, output, backend=replay,
+                                                fast_path=False)
+    assert result.startswith("SEIR model successfully")
+    with open(main.output_path(output), "r", encoding="utf-8") as f:
+        assert f.read() == first
+
+
+def test_fake_backend_injects_latency_and_errors(tmp_path):
+    fake = backends.FakeBackend(response="x" * 10, chunk_size=3, error_rate=1.0)
+    with pytest.raises(backends.RateLimitError):
+        fake.generate("prompt")
+    assert fake.errors == 1
+
+    fake = backends.FakeBackend(response="x" * 10, chunk_size=3, latency=0.05)
+    assert list(fake.stream("prompt")) == ["xxx", "xxx", "xxx", "x"]
+    assert backends.measure_pipeline_overhead(IMAGE, main.covidModel, SPEC, str(tmp_path / "o.txt"), repeats=1) >= 0
@@ -0,0 +1,79 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import backends
+import batch
+import main
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMAGE = os.path.join(ROOT, "hivModel(paper).jpeg")
+SPEC = os.path.join(ROOT, "metamodel.txt")
+
+
+def _jobs(tmp_path, count):
+    return [{"image": IMAGE, "user_input": main.simpleModel_imp_info_only, "spec": SPEC,
+             "output": str(tmp_path / f"job{number}.txt")} for number in range(count)]
+
+
+def test_jobs_overlap_on_a_fake_backend(tmp_path):
+    # Two model calls per job at 0.2 s: 1.6 s back to back.
+    report = batch.run_batch(_jobs(tmp_path, 4), max_concurrency=4, backend=backends.FakeBackend(latency=0.2),
+                             fast_path=False)
+    assert report["succeeded"] == 4 and report["failed"] == 0
+    assert report["wall_seconds"] < 1.2
+    assert report["speedup"] > 1.5
+    assert all(os.path.exists(main.output_path(job["output"])) for job in report["jobs"])
+
+
+def test_failed_jobs_are_reported_not_raised(tmp_path):
+    jobs = _jobs(tmp_path, 2)
+    jobs[1]["image"] = str(tmp_path / "missing.png")
+    report = batch.run_batch(jobs, backend=backends.FakeBackend(), fast_path=False)
+    assert report["succeeded"] == 1 and report["failed"] == 1
+
+
+def test_retry_counters_are_reported(tmp_path):
+    fake = backends.FakeBackend(error_rate=0.3, seed=1)
+    report = batch.run_batch(_jobs(tmp_path, 3), backend=fake, fast_path=False,
+                             retry_options={"base_delay": 0, "max_attempts": 10})
+    assert report["succeeded"] == 3
+    assert report["calls"]["retries"] == fake.errors and report["calls"]["attempts"] == fake.calls
+
+
+def test_rate_limiter_spaces_calls():
+    limiter = batch.RateLimiter(requests_per_minute=600)
+    start = time.monotonic()
+    for _ in range(5):
+        limiter.acquire()
+    assert time.monotonic() - start >= 0.39
+
+
+def test_manifest_resolves_constants_and_files(tmp_path):
+    (tmp_path / "input.txt").write_text("S -> I", encoding="utf-8")
+    (tmp_path / "manifest.json").write_text(
+        '[{"image": "image.jpeg", "user_input": "covidModel", "spec": "spec.txt", "output": "a.txt"},'
+        ' {"image": "image.jpeg", "user_input": "input.txt", "spec": "spec.txt", "output": "b.txt"}]',
+        encoding="utf-8")
+    cwd = os.getcwd()
+    os.chdir(tmp_path)
+    try:
+        jobs = batch.load_manifest("manifest.json")
+    finally:
+        os.chdir(cwd)
+    assert jobs[0]["user_input"] == main.covidModel
+    assert jobs[1]["user_input"] == "S -> I"
+
+
+def test_job_options_override_batch_options(tmp_path):
+    jobs = [{"image": IMAGE, "user_input": main.hiv_imp_info_only, "spec": SPEC,
+             "output": str(tmp_path / f"job{number}.txt")} for number in range(2)]
+    jobs[1]["options"] = {"local_rates": False}
+    fake = backends.FakeBackend()
+    report = batch.run_batch(jobs, backend=fake, local_rates=True)
+    assert report["succeeded"] == 2
+    # Only the job without local rates calls LLM2.
+    assert fake.calls == 1
@@ -0,0 +1,38 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _result(family, strategy, rate_error, flow_f1=1.0):
+    return {"family": family, "strategy": strategy, "parsed": True, "compartment_f1": 1.0, "flow_f1": flow_f1,
+            "rates_exact": 1.0, "rate_error": rate_error, "seconds": None}
+
+
+def test_summary_keeps_families_apart_and_uses_median_rate_errors():
+    summary = benchmark.summarize([
+        _result("hiv", "text_only", 16890.0, flow_f1=0.2),
+        _result("hiv", "text_only", 0.1, flow_f1=0.4),
+        _result("hiv", "text_only", 0.2, flow_f1=0.6),
+        _result("covid", "text_only", 0.0, flow_f1=1.0),
+    ])
+    assert set(summary) == {"hiv/text_only", "covid/text_only"}
+    assert summary["hiv/text_only"]["variants"] == 3
+    assert summary["hiv/text_only"]["rate_error"] == 0.2
+    assert summary["covid/text_only"]["flow_f1"] == 1.0
+
+
+def test_the_example_manifest_runs_offline(tmp_path, monkeypatch):
+    monkeypatch.chdir(ROOT)
+    variants = benchmark.manifest_variants(os.path.join(ROOT, "benchmark_manifest.json"))
+    for variant in variants:
+        variant["job"]["output"] = variant["path"] = str(tmp_path / os.path.basename(variant["path"]))
+    report = benchmark.run_benchmark(variants, workers=1, replay=str(tmp_path / "no_replays"),
+                                     model="unrecorded")
+    assert all(row["parsed"] and row["flow_f1"] == 1.0 for row in report["variants"])
+    assert set(report["strategies"]) == {"covid/table", "hiv/table+local_rates", "hiv/json", "hiv/json+local_rates"}
@@ -0,0 +1,22 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ingest
+
+
+def _table(*rows):
+    return {"label": "Table 3", "caption": "Parameters", "page": 5, "score": 5, "rows": [list(row) for row in rows]}
+
+
+def test_duplicate_parameter_symbols_are_found():
+    parameters = _table(("Parameters", "Value", "Unit"), ("C", "333", "Individuals/year"),
+                        ("d", "0.3333", "1/year"), ("d", "0.018", "1/year"), ("a", "0.3333", "1/year"))
+    assert ingest.duplicate_symbols([parameters]) == ["d"]
+
+
+def test_other_tables_and_distinct_symbols_are_ignored():
+    states = _table(("Population", "Description"), ("Sh(t)", "Susceptible"), ("Sh(t)", "Susceptible"))
+    parameters = _table(("Parameter", "Value"), ("δ", "0.018"), ("d", "0.3333"), ("", ""))
+    assert ingest.duplicate_symbols([states, parameters]) == []
@@ -0,0 +1,92 @@
+import json
+import os
+import re
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import backends
+import lean_rates
+import main
+import serimodel
+import tabular
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMAGE = os.path.join(ROOT, "hivModel(paper).jpeg")
+SPEC = os.path.join(ROOT, "metamodel.txt")
+
+MODEL = serimodel.render([
+    ({"PrimaryName": "S"}, [{"rate": serimodel.RATE_PLACEHOLDER, "target": "//@compartments.1",
+                             "description": "Infection"}]),
+    ({"PrimaryName": "I"}, [{"rate": "0.1", "target": "//@compartments.2"},
+                            {"rate": serimodel.RATE_PLACEHOLDER, "target": "//@compartments.3"}]),
+    ({"PrimaryName": "R"}, []),
+    ({"PrimaryName": "D"}, []),
+])
+
+
+def test_pending_flows_are_numbered_in_document_order():
+    assert lean_rates.pending_flows(MODEL) == [(0, "S", "I", "Infection"), (2, "I", "D", "")]
+    assert lean_rates.flow_listing(MODEL) == "0: S → I (Infection)\n2: I → D"
+    assert lean_rates.response_schema([0, 2])["required"] == ["0", "2"]
+
+
+@pytest.mark.parametrize("text, rates, failed", [
+    ('{"0": 0.25, "2": 1e-3}', {0: "0.25", 2: "0.001"}, []),
+    ('```json\n{"0": "0.25", "2": 0}\n```', {0: "0.25", 2: "0.0"}, []),
+    ('{"0": null, "2": -1}', {}, [0, 2]),
+    ('{"0": NaN, "2": Infinity}', {}, [0, 2]),
+    ('{"0": true, "2": "fast"}', {}, [0, 2]),
+    ('{"0": 0.5}', {0: "0.5"}, [2]),
+    ("The rates are 0.25 and 0.001.", {}, [0, 2]),
+    ("[0.25, 0.001]", {}, [0, 2]),
+])
+def test_parse_response(text, rates, failed):
+    assert lean_rates.parse_response(text, [0, 2]) == (rates, failed)
+
+
+def test_merge_fills_only_the_given_flows():
+    merged = lean_rates.merge(MODEL, {0: "0.25"})
+    compartments = serimodel.parse_compartments(merged)
+    assert [[flow["rate"] for flow in c["flows"]] for c in compartments] == [
+        ["0.25"], ["0.1", serimodel.RATE_PLACEHOLDER], [], [],
+    ]
+    assert lean_rates.merge(f"```xml\n{MODEL}\n```", {0: "0.25", 2: "0.5"}).count(serimodel.RATE_PLACEHOLDER) == 0
+
+
+def _lean_answer(skip: int = None):
+    """Fake LLM2 that answers the lean prompt's FLOWS list, leaving flow `skip` null, and echoes any other prompt."""
+    def answer(parts):
+        text = parts if isinstance(parts, str) else parts[-1]
+        if "FLOWS:\n" not in text:
+            return tabular.build_skeleton(main.hiv_imp_info_only).replace(serimodel.RATE_PLACEHOLDER, "0.5")
+        numbers = re.findall(r"^(\d+): ", text.split("FLOWS:\n")[1], re.MULTILINE)
+        return json.dumps({number: None if int(number) == skip else 0.01 for number in numbers})
+    return answer
+
+
+def _final_model(output: str) -> str:
+    with open(main.output_path(output), "r", encoding="utf-8") as f:
+        return serimodel.extract_xml(f.read().split("LLM2'S RESPONSE:")[-1])
+
+
+def test_lean_llm2_fills_the_skeleton_in_one_call(tmp_path):
+    fake = backends.FakeBackend(response=_lean_answer())
+    output = str(tmp_path / "lean.txt")
+    result = main.generate_seirmodel_from_image(IMAGE, main.hiv_imp_info_only, SPEC, output, backend=fake, lean=True)
+    assert result.startswith("SEIR model successfully")
+    assert fake.calls == 1
+    rates = [flow["rate"] for c in serimodel.parse_compartments(_final_model(output)) for flow in c["flows"]]
+    assert len(rates) == 24 and set(rates) == {"0.01"}
+
+
+def test_invalid_lean_values_fall_back_to_the_full_prompt(tmp_path):
+    fake = backends.FakeBackend(response=_lean_answer(skip=3))
+    output = str(tmp_path / "lean.txt")
+    result = main.generate_seirmodel_from_image(IMAGE, main.hiv_imp_info_only, SPEC, output, backend=fake, lean=True)
+    assert result.startswith("SEIR model successfully")
+    assert fake.calls == 2
+    assert serimodel.RATE_PLACEHOLDER not in _final_model(output)
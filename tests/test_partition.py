@@ -0,0 +1,77 @@
+import copy
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+import partition
+import serimodel
+import tabular
+import user_input
+
+
+TABLE = user_input.parse_compartment_table(main.hiv_imp_info_only)
+MODEL = serimodel.read_compartments(tabular.build_skeleton(main.hiv_imp_info_only))
+
+
+def _answer(prompt: str, stage: str) -> str:
+    """Answers a partition prompt from MODEL, numbering targets with the prompt's local table."""
+    assert stage == "llm1_partition"
+    local_table = user_input.parse_compartment_table(prompt.split("do not output them.")[-1])
+    global_index = {name: index for index, name, _ in TABLE}
+    order = [global_index[name] for _, name, _ in sorted(local_table)]
+    last = int(prompt.split("numbered 0 to ")[1].split()[0])
+    local = {index: position for position, index in enumerate(order)}
+    compartments = []
+    for index in order[:last + 1]:
+        attributes, flows = copy.deepcopy(MODEL[index])
+        for flow in flows:
+            flow["target"] = f"//@compartments.{local[int(flow['target'].rsplit('.', 1)[1])]}"
+        compartments.append((attributes, flows))
+    return serimodel.render(compartments)
+
+
+def test_partitions_follow_the_strata():
+    partitions = partition.plan_partitions(TABLE, max_size=2)
+    assert [p["name"] for p in partitions] == [
+        "Homosexual Men 1", "Homosexual Men 2", "Women 1", "Women 2", "Heterosexual Men 1", "Heterosexual Men 2",
+        "Shared", "Terminal",
+    ]
+    assert sorted(index for p in partitions for index in p["members"]) == list(range(len(TABLE)))
+
+
+def test_stitched_partitions_match_the_whole_model():
+    xml, partitions = partition.generate_structure(_answer, lambda extra: extra, main.hiv_imp_info_only, max_size=2)
+    assert len(partitions) == 8
+    assert serimodel.read_compartments(xml) == MODEL
+
+
+def test_stitch_remaps_local_targets():
+    table = [(0, "S", ""), (1, "I", ""), (2, "R", "")]
+    partitions = [{"name": "tail", "members": [1, 2]}, {"name": "head", "members": [0]}]
+    orders = [partition.partition_table(p, table)[1] for p in partitions]
+    assert orders == [[1, 2, 0], [0, 1, 2]]
+    responses = [
+        serimodel.render([({"PrimaryName": "I"}, [{"rate": "0.1", "target": "//@compartments.1"}]),
+                          ({"PrimaryName": "R"}, [{"rate": "0.01", "target": "//@compartments.2"}])]),
+        serimodel.render([({"PrimaryName": "S"}, [{"rate": "0.3", "target": "//@compartments.1"}])]),
+    ]
+    stitched = partition.stitch(responses, partitions, orders, 3)
+    assert [[flow["target"] for flow in flows] for _, flows in stitched] == [
+        ["//@compartments.1"], ["//@compartments.2"], ["//@compartments.0"],
+    ]
+
+
+@pytest.mark.parametrize("response, message", [
+    ("not xml", "invalid XML"),
+    (serimodel.render([({"PrimaryName": "S"}, [])] * 2), "expected 1"),
+    (serimodel.render([({"PrimaryName": "S"}, [{"rate": "1", "target": "//@compartments.3"}])]), "invalid target"),
+])
+def test_stitch_rejects_bad_responses(response, message):
+    table = [(0, "S", ""), (1, "I", ""), (2, "R", "")]
+    partitions = [{"name": "head", "members": [0]}]
+    with pytest.raises(partition.PartitionError, match=message):
+        partition.stitch([response], partitions, [partition.partition_table(partitions[0], table)[1]], 3)
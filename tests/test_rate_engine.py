@@ -0,0 +1,66 @@
+import os
+import sys
+from fractions import Fraction
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+import rate_engine
+import serimodel
+import tabular
+
+
+def _rates(xml: str) -> dict:
+    """{(source, target): [rates in document order]} for a filled model."""
+    rates = {}
+    for source, compartment in enumerate(serimodel.parse_compartments(xml)):
+        for flow in compartment["flows"]:
+            rates.setdefault((source, flow["target"]), []).append(flow["rate"])
+    return rates
+
+
+def test_evaluate_is_exact_and_reads_juxtaposed_symbols():
+    values = {"Ψ": Fraction(333), "θ": Fraction("0.48"), "γ": Fraction("0.92")}
+    assert rate_engine.evaluate("Ψθ(1−γ)", values) == Fraction(333) * Fraction("0.48") * Fraction("0.08")
+    assert rate_engine.evaluate("0.1 + 0.2", {}) == Fraction(3, 10)
+    assert rate_engine.evaluate("2^3 / -4", {}) == -2
+
+
+def test_evaluate_follows_equations():
+    values = {"β": Fraction("0.5"), "S": Fraction(90), "I": Fraction(10)}
+    equations = {"λ": "β * (I / (S + I))"}
+    assert rate_engine.evaluate("λ", values, equations) == Fraction(1, 20)
+
+
+@pytest.mark.parametrize("expression", ["β * κ", "1 / 0", "(β", "β $ 2"])
+def test_evaluate_raises_unresolved_rate(expression):
+    with pytest.raises(rate_engine.UnresolvedRate):
+        rate_engine.evaluate(expression, {"β": Fraction(1)})
+
+
+def test_fill_rates_resolves_every_hiv_flow():
+    skeleton = tabular.build_skeleton(main.hiv_imp_info_only)
+    assert serimodel.RATE_PLACEHOLDER in skeleton
+    xml, unresolved = rate_engine.fill_rates(skeleton, main.hiv_imp_info_only)
+    assert unresolved == []
+    assert serimodel.RATE_PLACEHOLDER not in xml
+
+    rates = _rates(xml)
+    assert rates[(0, 3)] == ["12.7872"]
+    # λh = βh * ch * (Ih / (Sh + Ih)), with populations written as Sℎ =2⁢4⁢4⁢6 and 𝐼ℎ =7⁢9.
+    assert float(rates[(3, 6)][0]) == pytest.approx(0.44 * 7 * 79 / (2446 + 79))
+    # Two table rows for Women, matched in order: λhw then λm.
+    assert float(rates[(4, 7)][0]) == pytest.approx(0.018 * 2 * 79 / (171173 + 2446 + 29 + 79))
+    assert float(rates[(4, 7)][1]) == pytest.approx(0.02 * 4 * 6 / (189994 + 6))
+    assert rates[(9, 10)] == ["0.018"] and rates[(10, 11)] == ["0.3333"]
+    # The wildcard natural-death row reaches every living compartment but not the recruitment sources.
+    assert [source for (source, target) in rates if target == 12] == [3, 4, 5, 6, 7, 8, 9, 10]
+
+
+def test_fill_rates_reports_flows_it_cannot_compute():
+    text = main.hiv_imp_info_only.replace("δ\t0.018", "")
+    xml, unresolved = rate_engine.fill_rates(tabular.build_skeleton(text), text)
+    assert [(flow["source"], flow["target"]) for flow in unresolved] == [(9, 10)]
+    assert xml.count(serimodel.RATE_PLACEHOLDER) == 1
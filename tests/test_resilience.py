@@ -0,0 +1,162 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import backends
+import resilience
+
+
+class StallingStream:
+    """
+    A hung server stream: the first `stall_first` streams block before
+    their first chunk, and with `stall_after` every stream blocks after its
+    chunks, until `release` is set.
+    """
+
+    model_name = "stalling"
+
+    def __init__(self, chunks=(), stall_first=0, stall_after=False):
+        self.chunks = list(chunks)
+        self.stall_first = stall_first
+        self.stall_after = stall_after
+        self.release = threading.Event()
+        self.closed = 0
+        self.calls = 0
+
+    def stream(self, parts):
+        self.calls += 1
+        try:
+            if self.calls <= self.stall_first:
+                self.release.wait()
+            yield from self.chunks
+            if self.stall_after:
+                self.release.wait()
+        finally:
+            self.closed += 1
+
+
+def test_retries_a_failing_call_and_counts_it_for_the_caller():
+    fake = backends.FakeBackend(response="ok", error_rate=0.5, seed=3)
+    backend = resilience.ResilientBackend(fake, base_delay=0, max_attempts=10)
+    before = backend.call_counts()
+    assert backend.generate("prompt") == "ok"
+    after = backend.call_counts()
+    attempts = after.get("attempts", 0) - before.get("attempts", 0)
+    assert attempts == fake.calls and attempts - 1 == after.get("retries", 0) - before.get("retries", 0)
+
+
+def test_call_counts_are_per_thread():
+    backend = resilience.ResilientBackend(backends.FakeBackend(response="ok"))
+    backend.generate("prompt")
+    seen = {}
+    thread = threading.Thread(target=lambda: seen.update(backend.call_counts()))
+    thread.start()
+    thread.join()
+    assert seen == {} and backend.call_counts()["attempts"] == 1
+
+
+def test_stalled_stream_before_first_chunk_is_retried():
+    inner = StallingStream(["<a/>"], stall_first=1)
+    backend = resilience.ResilientBackend(inner, timeout=0.2, base_delay=0)
+    assert "".join(backend.stream("prompt")) == "<a/>"
+    assert backend.stats()["timeouts"] == 1 and backend.stats()["retries"] == 1
+    inner.release.set()
+
+
+def test_stalled_stream_respects_the_deadline():
+    inner = StallingStream(stall_first=10)
+    backend = resilience.ResilientBackend(inner, timeout=5, deadline=0.3, base_delay=0)
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        list(backend.stream("prompt"))
+    assert time.monotonic() - start < 2
+    inner.release.set()
+
+
+def test_stream_stalling_after_text_raises_and_closes():
+    inner = StallingStream(["<a>"], stall_after=True)
+    backend = resilience.ResilientBackend(inner, timeout=0.2, base_delay=0)
+    received = []
+    with pytest.raises(resilience.CallTimeout):
+        for chunk in backend.stream("prompt"):
+            received.append(chunk)
+    assert received == ["<a>"] and inner.calls == 1
+    inner.release.set()
+    deadline = time.monotonic() + 2
+    while not inner.closed and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert inner.closed == 1
+
+
+def test_slow_attempt_is_hedged_and_the_duplicate_wins():
+    class SlowFirst:
+        model_name = "slow-first"
+        calls = 0
+
+        def generate(self, parts, response_schema=None):
+            self.calls += 1
+            if self.calls == 1:
+                time.sleep(1.0)
+                return "first"
+            return "hedge"
+
+    backend = resilience.ResilientBackend(SlowFirst(), hedge=True, hedge_after=0.05)
+    start = time.monotonic()
+    assert backend.generate("prompt") == "hedge"
+    assert time.monotonic() - start < 0.8
+    stats = backend.stats()
+    assert stats["hedges"] == 1 and stats["hedge_wins"] == 1
+    assert backend.call_counts()["hedges"] == 1
+
+
+def test_attempt_timeout_is_retried_until_the_deadline():
+    fake = backends.FakeBackend(response="ok", latency=1.0)
+    backend = resilience.ResilientBackend(fake, timeout=0.1, deadline=0.35, base_delay=0)
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        backend.generate("prompt")
+    assert time.monotonic() - start < 0.8
+    assert backend.stats()["timeouts"] >= 2
+
+
+def test_errors_that_are_not_transient_are_not_retried():
+    class Broken:
+        model_name = "broken"
+
+        def generate(self, parts, response_schema=None):
+            raise KeyError("bad request")
+
+    backend = resilience.ResilientBackend(Broken(), base_delay=0)
+    with pytest.raises(KeyError):
+        backend.generate("prompt")
+    assert backend.stats()["attempts"] == 1 and backend.stats()["failures"] == 1
+
+
+def test_backoff_is_capped_full_jitter():
+    backend = resilience.ResilientBackend(backends.FakeBackend(), base_delay=1.0, max_delay=4.0, seed=0)
+    delays = [backend.backoff(attempt) for attempt in range(8) for _ in range(20)]
+    assert min(delays) >= 0 and max(delays) <= 4.0
+    assert max(backend.backoff(0) for _ in range(50)) <= 1.0
+
+
+def test_stage_spans_record_attempts_retries_and_hedges(tmp_path):
+    import instrumentation
+    import main
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    fake = backends.FakeBackend(response="<seir:SEIRModel/>", error_rate=0.5, seed=2)
+    backend = resilience.ResilientBackend(fake, base_delay=0, max_attempts=20)
+    recorder = instrumentation.Recorder()
+    main.generate_seirmodel_from_image(os.path.join(root, "hivModel(paper).jpeg"), main.covidModel,
+                                       os.path.join(root, "metamodel.txt"), str(tmp_path / "out.txt"),
+                                       backend=backend, recorder=recorder, fast_path=False)
+    spans = [event for event in recorder.events if event["stage"] in ("llm1", "llm2")]
+    assert [event["stage"] for event in spans] == ["llm1", "llm2"]
+    assert sum(event["attempts"] for event in spans) == fake.calls
+    assert sum(event["retries"] for event in spans) == fake.errors
+    assert all(event["hedges"] == 0 for event in spans)
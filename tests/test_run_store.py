@@ -0,0 +1,59 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+import run_store
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMAGE = os.path.join(ROOT, "hivModel(paper).jpeg")
+SPEC = os.path.join(ROOT, "metamodel.txt")
+
+def _key(text):
+    return run_store.RunStore.structure_key(b"image", text, "spec", "model")
+
+
+def test_free_text_inputs_have_no_structure_key():
+    assert _key("An SEIR model stratified into 3 age groups, beta = 0.3.") is None
+    assert _key("An SEIR model stratified into 5 age groups, beta = 0.3.") is None
+
+
+def test_tabular_inputs_share_a_key_across_parameter_values():
+    changed = main.hiv_imp_info_only.replace("βh\t0.44", "βh\t0.5")
+    assert changed != main.hiv_imp_info_only
+    assert _key(changed) == _key(main.hiv_imp_info_only) is not None
+
+
+def test_tabular_structure_changes_change_the_key():
+    assert _key(main.covidModel) != _key(main.hiv_imp_info_only)
+    dropped = main.hiv_imp_info_only.replace("| TreatedWithART → PeopleLivingWithAIDS                       | δ               |\n", "")
+    assert dropped != main.hiv_imp_info_only
+    assert _key(dropped) != _key(main.hiv_imp_info_only)
+
+
+
+def test_missing_blobs_read_as_none(tmp_path):
+    store = run_store.RunStore(str(tmp_path))
+    digest = store.put_blob("kept")
+    assert store.get_text(digest) == "kept"
+    os.remove(os.path.join(store.blob_dir, digest[:2], digest))
+    assert store.get_text(digest) is None
+
+
+def test_duplicate_run_with_missing_transcript_runs_again(tmp_path):
+    import backends
+
+    store = run_store.RunStore(str(tmp_path / "runs"))
+    output = str(tmp_path / "out.txt")
+
+    def run():
+        return main.generate_seirmodel_from_image(
+            IMAGE, main.hiv_imp_info_only, SPEC, output, backend=backends.FakeBackend(), run_store=store)
+
+    run()
+    first = store.runs()[0]
+    os.remove(os.path.join(store.blob_dir, first["transcript_hash"][:2], first["transcript_hash"]))
+    assert run().startswith("SEIR model successfully")
+    assert len(store.runs()) == 2
@@ -0,0 +1,72 @@
+import os
+import shutil
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import backends
+import service
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMAGE = os.path.join(ROOT, "hivModel(paper).jpeg")
+SPEC = os.path.join(ROOT, "metamodel.txt")
+
+
+def _root(tmp_path):
+    shutil.copy(IMAGE, tmp_path / "image.jpeg")
+    shutil.copy(SPEC, tmp_path / "metamodel.txt")
+    return str(tmp_path)
+
+
+def _job(output="out.txt", **changes):
+    return {"image": "image.jpeg", "user_input": "simpleModel_imp_info_only", "spec": "metamodel.txt",
+            "output": output, "options": {"fast_path": False}, **changes}
+
+
+def test_jobs_run_end_to_end_over_a_unix_socket(tmp_path):
+    fake = backends.FakeBackend(latency=0.05)
+    jobs = service.Service(fake, workers=2, root=_root(tmp_path)).start()
+    socket_path = str(tmp_path / "s.sock")
+    server = service.make_server(jobs, socket_path=socket_path)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        address = f"unix:{socket_path}"
+        results = [service.run_job(address, _job(f"out{number}.txt"), timeout=30) for number in range(2)]
+        status, stats = service.request(address, "GET", "/stats")
+        status_missing, _ = service.request(address, "GET", "/jobs/nope")
+    finally:
+        server.shutdown()
+        server.server_close()
+        jobs.stop()
+
+    assert [result["status"] for result in results] == ["done", "done"]
+    assert all(result["ok"] and "SEIRModel" in result["xml"] for result in results)
+    assert os.path.exists(tmp_path / "prompt_sample" / "out1.txt")
+    assert fake.calls == 4
+    assert status == 200 and stats["submitted"] == 2 and stats["succeeded"] == 2
+    assert status_missing == 404
+
+
+def test_paths_outside_the_root_are_rejected(tmp_path):
+    jobs = service.Service(backends.FakeBackend(), workers=0, root=_root(tmp_path))
+    with pytest.raises(ValueError):
+        jobs.submit(_job(image="../image.jpeg"))
+    with pytest.raises(ValueError):
+        jobs.submit(_job(output="/etc/out.txt"))
+    with pytest.raises(ValueError):
+        jobs.submit({"image": "image.jpeg"})
+    with pytest.raises(ValueError):
+        jobs.submit(_job(options={"unknown": True}))
+
+
+def test_a_full_queue_rejects_jobs(tmp_path):
+    jobs = service.Service(backends.FakeBackend(), workers=0, max_queue=1, root=_root(tmp_path))
+    jobs.submit(_job())
+    with pytest.raises(service.QueueFull):
+        jobs.submit(_job())
+    assert jobs.stats()["rejected"] == 1 and jobs.stats()["queued"] == 1
@@ -0,0 +1,40 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import serimodel
+import stochastic
+
+
+def _sir():
+    return serimodel.compile_model(serimodel.render([
+        ({"PrimaryName": "Susceptible"}, [{"rate": "0.02", "target": "//@compartments.1"}]),
+        ({"PrimaryName": "Infectious"}, [{"rate": "0.1", "target": "//@compartments.2"}]),
+        ({"PrimaryName": "Recovered"}, []),
+    ]))
+
+
+def test_chunked_summary_matches_pooled_trajectories():
+    model, initial = _sir(), [200, 6, 0]
+    times = np.linspace(0.0, 30.0, 16)
+    summary = stochastic.simulate_stochastic(model, 30.0, 15, initial, replicates=300, chunk_size=70, seed=4)
+
+    streams = np.random.SeedSequence(4).spawn(5)
+    sizes = [70, 70, 70, 70, 20]
+    pooled = np.concatenate([stochastic._run_chunk((model, np.array(initial), times, size, "gillespie", None, s))
+                             for size, s in zip(sizes, streams)])
+    assert np.array_equal(summary["values"], np.quantile(pooled, stochastic.DEFAULT_QUANTILES, axis=0))
+    assert np.allclose(summary["mean"], pooled.mean(axis=0))
+
+
+def test_large_counts_stay_within_the_bin_precision():
+    rng = np.random.default_rng(0)
+    samples = rng.integers(0, 10 ** 6, size=(900, 2, 3))
+    histogram = stochastic.CountHistogram((2, 3), 10 ** 6)
+    for part in np.array_split(samples, 4):
+        histogram.add(part)
+    exact = np.quantile(samples, (0.05, 0.5, 0.95), axis=0)
+    assert np.all(np.abs(histogram.quantiles((0.05, 0.5, 0.95)) - exact) <= stochastic.BIN_PRECISION * exact)
@@ -0,0 +1,63 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import backends
+import main
+import streaming
+import tabular
+
+
+MODEL = tabular.build_skeleton(main.covidModel)
+
+
+def _feed(text: str, chunk_size: int = 7) -> streaming.IncrementalValidator:
+    validator = streaming.IncrementalValidator()
+    for start in range(0, len(text), chunk_size):
+        validator.feed(text[start:start + chunk_size])
+    return validator
+
+
+def test_a_valid_model_is_accepted_chunk_by_chunk():
+    validator = _feed(f"```xml\n{MODEL}\n```\nHope this helps!")
+    assert validator.done
+    assert validator.close() == MODEL.strip()
+
+
+@pytest.mark.parametrize("text, message", [
+    ("Here is the model:\n<seir:SEIRModel", "Text before the XML"),
+    ('<?xml version="1.0"?><SEIRModel>', "Root element"),
+    (MODEL.replace("</compartments>", "Note: flows above.</compartments>", 1), "Unexpected text"),
+    (MODEL.replace('rate="', 'rate="beta*', 1), "neither numeric"),
+    (MODEL.replace('target="//@compartments.', 'target="compartment ', 1), "Malformed flow target"),
+    (MODEL.replace('"Infection"/>', '"Infection"><note/></outgoingFlows>', 1), "Unexpected nested element"),
+])
+def test_invalid_models_are_rejected(text, message):
+    with pytest.raises(streaming.StreamValidationError, match=message):
+        _feed(text)
+
+
+def test_unclosed_models_and_unknown_targets_fail_on_close():
+    with pytest.raises(streaming.StreamValidationError, match="before the root element was closed"):
+        _feed(MODEL[:len(MODEL) // 2]).close()
+    with pytest.raises(streaming.StreamValidationError, match="only"):
+        _feed(MODEL.replace('target="//@compartments.1"', 'target="//@compartments.99"', 1)).close()
+
+
+def test_invalid_streams_are_retried():
+    responses = iter([f"Sure! {MODEL}", MODEL])
+    fake = backends.FakeBackend(response=lambda parts: next(responses), chunk_size=16)
+    stats = {}
+    assert streaming.generate_validated(fake, ["prompt"], stats=stats) == MODEL.strip()
+    assert stats["attempts"] == 2 and stats["aborted"] == 1
+    assert 0 < stats["wasted_chars"] < len(MODEL)
+
+
+def test_giving_up_reports_every_error():
+    fake = backends.FakeBackend(response="I cannot read this image.")
+    with pytest.raises(streaming.StreamAbortedError) as info:
+        streaming.generate_validated(fake, ["prompt"], max_attempts=2)
+    assert len(info.value.errors) == 2
@@ -0,0 +1,68 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import rate_engine
+import serimodel
+import tabular
+
+
+SIR_WITH_BACKGROUND_DEATH = """
+| Index | Compartment |
+| ----- | ----------- |
+| 0     | Susceptible |
+| 1     | Infectious  |
+| 2     | Recovered   |
+| 3     | Dead        |
+
+| Flow (From → To)        | Rate Variable |
+| ----------------------- | ------------- |
+| Susceptible → Infectious | β            |
+| Infectious → Recovered   | γ            |
+| All states → Dead        | μ            |
+
+| Parameter | Value |
+| --------- | ----- |
+| β         | 0.3   |
+| γ         | 0.1   |
+| μ         | 0.01  |
+"""
+
+
+def _targets(xml_text):
+    return [[flow["target"] for flow in c["flows"]] for c in serimodel.parse_compartments(xml_text)]
+
+
+def test_wildcard_reaches_compartments_without_inflow_or_outflow():
+    skeleton = tabular.build_skeleton(SIR_WITH_BACKGROUND_DEATH)
+    assert _targets(skeleton) == [[1, 3], [2, 3], [3], []]
+
+
+def test_wildcard_rate_fills_every_background_death():
+    filled, unresolved = rate_engine.fill_rates(tabular.build_skeleton(SIR_WITH_BACKGROUND_DEATH),
+                                                SIR_WITH_BACKGROUND_DEATH)
+    assert unresolved == []
+    rates = [[float(flow["rate"]) for flow in c["flows"]] for c in serimodel.parse_compartments(filled)]
+    assert rates == [[0.3, 0.01], [0.1, 0.01], [0.01], []]
+
+
+def test_wildcard_skips_recruitment_and_terminal_states():
+    import main
+
+    compartments = serimodel.parse_compartments(tabular.build_skeleton(main.hiv_imp_info_only))
+    natural_death = next(i for i, c in enumerate(compartments) if c["PrimaryName"] == "NaturalDeath")
+    leaving = {c["PrimaryName"] for c in compartments if any(f["target"] == natural_death for f in c["flows"])}
+    assert "Recruitment" not in leaving and "DeathDueToAIDS" not in leaving
+    assert {"Susceptible", "UntreatedInfected", "TreatedWithART", "PeopleLivingWithAIDS"} <= leaving
+
+
+def test_wildcard_exemptions_follow_the_metamodel():
+    import json
+
+    import streaming
+    import user_input
+
+    with open(streaming.METAMODEL_PATH, "r", encoding="utf-8") as f:
+        types = json.load(f)["seirmodel_metamodel"]["compartment_types"]
+    assert user_input.WILDCARD_EXEMPT_STATES == types["demographic_states"] + types["terminal_states"]
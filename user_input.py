@@ -0,0 +1,231 @@
+"""
+Parsing for the free-form user inputs in main.py (hiv_imp_info_only,
+covidModel, simpleModel_imp_info_only, ...).
+
+Inputs mix markdown tables, tab-separated parameter lists, `name = value`
+population lines and `λh = βh * ch * ...` equations, and spell symbols with
+mathematical italic letters (𝑆𝑤), invisible times (U+2062) and typographic
+operators (×, −). normalize() folds all of that to plain symbols first.
+"""
+import re
+import unicodedata
+
+
+_INVISIBLE = dict.fromkeys(map(ord, "⁡⁢⁣⁤​‌‍﻿"))
+_OPERATORS = str.maketrans({"×": "*", "·": "*", "⋅": "*", "∗": "*", "−": "-", "–": "-", "÷": "/"})
+
+SYMBOL = r"[^\W\d]\w*"
+NUMBER = r"[+-]?(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][+-]?\d+)?"
+
+_PARAMETER_LINE_RE = re.compile(rf"^\s*({SYMBOL})\s+({NUMBER})\s*$")
+_ASSIGNMENT_RE = re.compile(rf"({SYMBOL})\s*=\s*({NUMBER})(?![\w.]*\s*[-+*/(])")
+_EQUATION_RE = re.compile(rf"^\s*({SYMBOL})\s*=\s*(.*[A-Za-zͰ-Ͽ].*?)\s*$")
+_APPROX_RE = re.compile(rf"≈\s*\**\s*({NUMBER})")
+_FIRST_NUMBER_RE = re.compile(NUMBER)
+
+
+def normalize(text: str) -> str:
+    """Folds math-alphabet letters, invisible operators and typographic symbols to plain text."""
+    return unicodedata.normalize("NFKC", text).translate(_INVISIBLE).translate(_OPERATORS)
+
+
+def name_key(name: str) -> str:
+    """Loose key for matching compartment names: 'Susceptible_HomosexualMen' == 'Susceptible (Homosexual Men)'."""
+    return re.sub(r"[\W_]+", "", normalize(name)).lower()
+
+
+def parse_markdown_tables(text: str) -> list:
+    """
+    Returns every markdown table in `text` as a list of rows, header row
+    first, each row a list of stripped cell strings. Separator rows are dropped.
+    """
+    tables = []
+    current = None
+    for line in text.splitlines():
+        stripped = line.strip()
+        if not stripped.startswith("|"):
+            current = None
+            continue
+        cells = [cell.strip() for cell in stripped.strip("|").split("|")]
+        if all(re.fullmatch(r":?-+:?", cell) for cell in cells if cell):
+            continue
+        if current is None:
+            current = []
+            tables.append(current)
+        current.append(cells)
+    return tables
+
+
+def parse_number(cell: str):
+    """Reads a value cell such as '0.4', '**0.21/day**' or '1/14 days → γ ≈ 0.0714/day'."""
+    cell = normalize(cell)
+    match = _APPROX_RE.search(cell) or _FIRST_NUMBER_RE.search(cell.replace("*", " "))
+    return float(match.group(1) if match.lastindex else match.group(0)) if match else None
+
+
+def parse_values(text: str) -> dict:
+    """
+    Collects every numeric parameter and population value in the input:
+    tab-separated `Ψ 333` lines, `Sh = 2446, Ih = 79` assignments and
+    Parameter/Value markdown tables.
+    """
+    text = normalize(text)
+    values = {}
+    for line in text.splitlines():
+        match = _PARAMETER_LINE_RE.match(line)
+        if match:
+            values[match.group(1)] = float(match.group(2))
+            continue
+        if "|" in line or "→" in line:
+            continue
+        for name, number in _ASSIGNMENT_RE.findall(line):
+            values.setdefault(name, float(number))
+
+    for table in parse_markdown_tables(text):
+        header = [cell.lower() for cell in table[0]]
+        if not header or "parameter" not in header[0] or not any("value" in cell for cell in header):
+            continue
+        value_column = next(i for i, cell in enumerate(header) if "value" in cell)
+        for row in table[1:]:
+            if len(row) > value_column and re.fullmatch(SYMBOL, row[0]):
+                number = parse_number(row[value_column])
+                if number is not None:
+                    values.setdefault(row[0], number)
+    return values
+
+
+def parse_equations(text: str) -> dict:
+    """Collects `name = expression` lines such as `λh = βh * ch * (Ih / (Sh + Ih))`."""
+    equations = {}
+    for line in normalize(text).splitlines():
+        if "|" in line or "→" in line:
+            continue
+        match = _EQUATION_RE.match(line)
+        if match and not _ASSIGNMENT_RE.match(line.strip()):
+            equations[match.group(1)] = match.group(2)
+    return equations
+
+
+def parse_compartment_table(text: str) -> list:
+    """
+    Reads the `| Index | Compartment ... |` table into a list of
+    (index, name, subgroup) tuples; subgroup is '' when the table has none.
+    """
+    for table in parse_markdown_tables(normalize(text)):
+        header = [cell.lower() for cell in table[0]]
+        if len(header) < 2 or header[0] != "index":
+            continue
+        rows = []
+        for row in table[1:]:
+            if row[0].isdigit() and len(row) >= 2:
+                subgroup = row[2] if len(row) > 2 and "subgroup" in header[2] else ""
+                rows.append((int(row[0]), row[1], subgroup))
+        return rows
+    return []
+
+
+def parse_flow_table(text: str) -> list:
+    """
+    Reads the `| From → To | ... | Rate |` table into a list of
+    (source, target, rate_expression) tuples, in table order.
+    """
+    return [(row["source"], row["target"], row["expression"]) for row in parse_flow_rows(text)]
+
+
+def parse_flow_rows(text: str) -> list:
+    """
+    Like parse_flow_table, but returns {"source", "target", "description",
+    "expression"} dicts; description is '' when the table has no such column.
+    """
+    flows = []
+    for table in parse_markdown_tables(normalize(text)):
+        if "→" not in table[0][0]:
+            continue
+        header = [cell.lower() for cell in table[0]]
+        description_column = next((i for i, cell in enumerate(header) if "description" in cell), None)
+        for row in table[1:]:
+            if "→" not in row[0] or len(row) < 2:
+                continue
+            source, target = (part.strip() for part in row[0].split("→", 1))
+            flows.append({
+                "source": source,
+                "target": target,
+                "description": row[description_column] if description_column is not None else "",
+                "expression": row[-1].replace("**", "").strip(),
+            })
+    return flows
+
+
+# Flow-table sources that stand for every compartment ("All states → Death").
+WILDCARD_SOURCES = {"all", "any", "allstates", "allcompartments", "allnonterminalcompartment",
+                    "allnonterminalcompartments"}
+
+# Compartments a wildcard row never leaves: the metamodel's demographic_states
+# (pure inflow nodes) and terminal_states (see compartment_types in metamodel.txt).
+WILDCARD_EXEMPT_STATES = ["Recruitment", "Birth", "Immigration", "Death", "Natural Death", "Death due to AIDS", "Dead"]
+_WILDCARD_EXEMPT_KEYS = {name_key(name) for name in WILDCARD_EXEMPT_STATES}
+
+_STOP_WORDS = {"to", "and", "of", "with", "the", "from", "in"}
+_TRAILING_REMARK_RE = re.compile(r"\s*\(([^()]*)\)\s*$")
+
+
+def is_wildcard(name: str) -> bool:
+    return name_key(name) in WILDCARD_SOURCES
+
+
+def wildcard_applies(primary_name: str, source: int, target: int) -> bool:
+    """
+    Whether a wildcard row into `target` gives compartment `source` (named
+    `primary_name`) a flow: every compartment except the row's own target
+    and the demographic and terminal states, whatever its other flows.
+    """
+    return source != target and name_key(primary_name) not in _WILDCARD_EXEMPT_KEYS
+
+
+def name_resolver(names: list, aliases: list = None):
+    """
+    Returns resolve(name) -> compartment index or None for the names used in
+    flow tables. `names[i]` lists compartment i's full names, the first of
+    them "Primary Secondary"; `aliases[i]` lists shorter names (a bare
+    PrimaryName, a symbol) that only count when no other compartment has
+    them. Names are matched exactly, then without a trailing remark in
+    parentheses, then as unique aliases, then by word prefixes, since flow
+    tables abbreviate ("Mild/Mod, iso", "Hospital (pre-ICU)").
+    """
+    exact = {}
+    for index, compartment_names in enumerate(names):
+        for name in compartment_names:
+            exact.setdefault(name_key(name), index)
+    shared = {}
+    for index, compartment_aliases in enumerate(aliases or []):
+        for alias in compartment_aliases:
+            shared.setdefault(name_key(alias), set()).add(index)
+    words = [_words(compartment_names[0]) if compartment_names else [] for compartment_names in names]
+
+    def resolve(name: str):
+        for candidate in (name, _TRAILING_REMARK_RE.sub("", name)):
+            key = name_key(candidate)
+            if key in exact:
+                return exact[key]
+            if len(shared.get(key, ())) == 1:
+                return next(iter(shared[key]))
+        abbreviated = _words(name)
+        best = None
+        for index, compartment_words in enumerate(words):
+            matched = sum(any(_prefix_match(word, other) for other in compartment_words) for word in abbreviated)
+            extra = sum(not any(_prefix_match(other, word) for word in abbreviated) for other in compartment_words)
+            # Most words matched, then fewest unmatched words, then table order.
+            score = (matched, -extra)
+            if matched and 2 * matched >= len(abbreviated) and (best is None or score > best[0]):
+                best = (score, index)
+        return best[1] if best else None
+
+    return resolve
+
+
+def _words(name: str) -> list:
+    return [word for word in re.findall(r"[a-z0-9]+", normalize(name).lower()) if word not in _STOP_WORDS]
+
+
+def _prefix_match(a: str, b: str) -> bool:
+    return min(len(a), len(b)) >= 3 and (a.startswith(b) or b.startswith(a)) or a == b